@@ -0,0 +1,5 @@
+"""
+Бенчмарки горячих путей: шифрование, хранилище, сеть.
+
+Запуск из корня репозитория: python -m benchmarks --help
+"""
@@ -0,0 +1,185 @@
+"""Запуск бенчмарков, запись результатов и сравнение с базовыми.
+
+    python -m benchmarks                      все наборы, сравнение с baseline.json
+    python -m benchmarks --quick storage      быстрый прогон, сравнение с baseline-quick.json
+    python -m benchmarks --update-baseline    сохранить результаты как базовые
+
+Код выхода 1, если какой-либо показатель хуже базового больше чем на
+--tolerance (по умолчанию 20%), если для показателя нет базового значения,
+набор не запустился из-за отсутствующей зависимости или базовые замеры
+сняты в другом режиме (--quick и полный прогон не сравниваются).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import importlib
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+SUITES = ["crypto", "storage", "network"]
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+DEFAULT_QUICK_BASELINE = BENCH_DIR / "baseline-quick.json"
+DEFAULT_OUTPUT = BENCH_DIR / "results.json"
+
+
+def run_suites(names: List[str], quick: bool) -> Tuple[Dict[str, Dict], List[str]]:
+    """Запуск наборов.
+
+    Возвращает результаты и наборы, не запущенные из-за отсутствующих
+    зависимостей.
+    """
+    results: Dict[str, Dict] = {}
+    skipped: List[str] = []
+    for name in names:
+        print(f"[{name}] ...", file=sys.stderr)
+        start = time.perf_counter()
+        try:
+            module = importlib.import_module(f"benchmarks.bench_{name}")
+            results.update(module.run(quick))
+        except ImportError as e:
+            # aiortc и PyNaCl загружаются лениво, уже во время замера
+            print(f"[{name}] не запущен: {e}", file=sys.stderr)
+            skipped.append(name)
+            continue
+        print(f"[{name}] {time.perf_counter() - start:.1f} с", file=sys.stderr)
+    return results, skipped
+
+
+def best_of(runs: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+    """Лучшее значение каждого показателя по нескольким прогонам наборов.
+
+    В поле worst сохраняется худшее значение: разброс между прогонами
+    показывает шум машины, и регрессией считается только выход за него.
+    """
+    best: Dict[str, Dict] = {}
+    for results in runs:
+        for name, current in results.items():
+            previous = best.get(name)
+            if previous is None:
+                best[name] = {**current, "worst": current["value"]}
+                continue
+            better = max if current["higher_is_better"] else min
+            worse = min if current["higher_is_better"] else max
+            previous["value"] = better(previous["value"], current["value"])
+            previous["worst"] = worse(previous["worst"], current["value"])
+    return best
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict],
+            tolerance: float) -> List[str]:
+    """Печать сравнения с базовыми результатами, возвращает регрессии
+    и показатели без базового значения"""
+    regressions = []
+    for name in sorted(results):
+        current = results[name]
+        base = baseline.get(name)
+        line = f"{name:45s} {current['value']:>12.3f} {current['unit']:6s}"
+        if base is None or not base["value"]:
+            print(f"{line}  НЕТ БАЗОВОГО")
+            regressions.append(name)
+            continue
+        change = (current["value"] - base["value"]) / base["value"]
+        # Допуск отсчитывается от худшего прогона базовых замеров
+        reference = base.get("worst") or base["value"]
+        worse = (current["value"] - reference) / reference
+        if current["higher_is_better"]:
+            worse = -worse
+        status = ""
+        if worse > tolerance:
+            status = "  РЕГРЕССИЯ"
+            regressions.append(name)
+        print(f"{line}  {change * 100:+7.1f}% к {base['value']:.3f}{status}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки P2P Chat")
+    parser.add_argument("suites", nargs="*",
+                        help=f"наборы для запуска: {', '.join(SUITES)} (по умолчанию все)")
+    parser.add_argument("--quick", action="store_true",
+                        help="меньше итераций, для быстрой проверки")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="прогонов всех наборов, берется лучшее значение (по умолчанию 3)")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT,
+                        help="файл результатов (JSON)")
+    parser.add_argument("--baseline", type=Path,
+                        help="файл базовых результатов (JSON; по умолчанию "
+                             "baseline.json или baseline-quick.json для --quick)")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="допустимое ухудшение, доля (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="записать результаты как базовые")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"неизвестные наборы: {', '.join(sorted(unknown))}")
+
+    if args.runs < 1:
+        parser.error("--runs должно быть не меньше 1")
+    if args.baseline is None:
+        args.baseline = DEFAULT_QUICK_BASELINE if args.quick else DEFAULT_BASELINE
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("quick", False) != args.quick:
+            # Быстрый прогон меньше прогревается, его значения несравнимы с полным
+            mode = "с --quick" if baseline.get("quick") else "без --quick"
+            print(f"Базовые результаты {args.baseline} сняты {mode}; "
+                  f"запустите в том же режиме или укажите --baseline", file=sys.stderr)
+            return 1
+
+    runs, skipped = [], []
+    with tempfile.TemporaryDirectory(prefix="p2p-chat-bench-") as data_dir:
+        # Все данные хранилища - во временном каталоге; переменная читается
+        # при импорте конфигурации, поэтому каталог общий для всех прогонов
+        os.environ["P2P_CHAT_DATA_DIR"] = data_dir
+        sys.path.insert(0, str(ROOT_DIR))
+        for run in range(args.runs):
+            if args.runs > 1:
+                print(f"Прогон {run + 1} из {args.runs}", file=sys.stderr)
+            results, skipped = run_suites(args.suites or SUITES, args.quick)
+            runs.append(results)
+    results = best_of(runs)
+    if skipped:
+        print(f"Не запущены наборы: {', '.join(skipped)} - установите зависимости "
+              f"из requirements.txt", file=sys.stderr)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "runs": args.runs,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"Результаты: {args.output}", file=sys.stderr)
+
+    if args.update_baseline:
+        if skipped:
+            return 1
+        baseline.setdefault("results", {}).update(results)
+        baseline.update({k: v for k, v in report.items() if k != "results"})
+        args.baseline.write_text(json.dumps(baseline, indent=2, ensure_ascii=False))
+        print(f"Базовые результаты обновлены: {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not baseline:
+        print(f"Нет базовых результатов ({args.baseline}); "
+              f"создайте их с --update-baseline", file=sys.stderr)
+        return 1
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    if regressions:
+        print(f"Регрессии ({len(regressions)}): {', '.join(regressions)}",
+              file=sys.stderr)
+        return 1
+    return 1 if skipped else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""Пропускная способность CryptoManager"""
+from typing import Dict
+from src.core.crypto import CryptoManager
+from .common import Result, result, throughput
+
+MESSAGE_SIZES = [64, 1024, 16 * 1024]
+BATCH_SIZE = 100
+
+
+def run(quick: bool) -> Dict[str, Result]:
+    count = 500 if quick else 5000
+    alice, bob = CryptoManager(), CryptoManager()
+    alice.generate_keys()
+    bob.generate_keys()
+    bob_key = bob.get_public_key()
+    alice_key = alice.get_public_key()
+    results: Dict[str, Result] = {}
+
+    for size in MESSAGE_SIZES:
+        text = "x" * size
+        frame = alice.encrypt_message(text, bob_key)
+        results[f"crypto.encrypt_message.{size}B"] = result(
+            throughput(lambda: alice.encrypt_message(text, bob_key), count),
+            "msg/s", True)
+        results[f"crypto.decrypt_message.{size}B"] = result(
+            throughput(lambda: bob.decrypt_message(frame, alice_key), count),
+            "msg/s", True)
+
+    # Пачка коротких сообщений одним кадром (MESSAGE_BATCH_WINDOW > 0)
+    batch = ["x" * 64] * BATCH_SIZE
+    frame = alice.encrypt_messages(batch, bob_key)
+    batches = max(count // BATCH_SIZE, 10)
+    results["crypto.encrypt_messages.batch100x64B"] = result(
+        throughput(lambda: alice.encrypt_messages(batch, bob_key), batches) * BATCH_SIZE,
+        "msg/s", True)
+    results["crypto.decrypt_texts.batch100x64B"] = result(
+        throughput(lambda: bob.decrypt_texts(frame, alice_key), batches) * BATCH_SIZE,
+        "msg/s", True)
+
+    alice.shutdown()
+    bob.shutdown()
+    return results
@@ -0,0 +1,104 @@
+"""Пропускная способность и RTT P2PConnection между двумя пирами в процессе.
+
+Соединение устанавливается через loopback только по локальным
+кандидатам (без STUN), поэтому бенчмарк работает без сети.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+from src.core.crypto import CryptoManager
+from src.core.network import P2PConnection
+from .common import REPEAT, Result, result, percentile
+
+CONNECT_TIMEOUT = 15.0
+MESSAGE_SIZE = 64
+
+
+async def _connect(batch_window: float):
+    alice_crypto, bob_crypto = CryptoManager(), CryptoManager()
+    alice_crypto.generate_keys()
+    bob_crypto.generate_keys()
+    alice = P2PConnection(alice_crypto, bob_crypto.get_public_key(),
+                          batch_window=batch_window, ice_servers=[])
+    bob = P2PConnection(bob_crypto, alice_crypto.get_public_key(),
+                        batch_window=batch_window, ice_servers=[])
+
+    offer = await alice.create_offer()
+    answer = await bob.handle_offer(offer)
+    await alice.handle_answer(answer)
+
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while not (alice.is_connected and bob.is_connected):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Пиры не соединились по loopback")
+        await asyncio.sleep(0.01)
+    return alice, bob
+
+
+async def _throughput(alice: P2PConnection, bob: P2PConnection, count: int) -> float:
+    """Сообщений в секунду от отправки первого до получения последнего"""
+    done = asyncio.get_event_loop().create_future()
+    received = 0
+
+    def on_message(text: str, message_id: Optional[str]) -> None:
+        nonlocal received
+        received += 1
+        if received == count and not done.done():
+            done.set_result(None)
+
+    bob.set_callbacks(on_message, None)
+    text = "x" * MESSAGE_SIZE
+    start = time.perf_counter()
+    for _ in range(count):
+        alice.send_message(text)
+    await asyncio.wait_for(done, 60)
+    return count / (time.perf_counter() - start)
+
+
+async def _round_trips(alice: P2PConnection, bob: P2PConnection, count: int) -> List[float]:
+    """Время эха сообщения: alice -> bob -> alice"""
+    pending: List[asyncio.Future] = []
+    bob.set_callbacks(lambda text, message_id: bob.send_message(text), None)
+
+    def on_echo(text: str, message_id: Optional[str]) -> None:
+        if pending and not pending[0].done():
+            pending[0].set_result(None)
+
+    alice.set_callbacks(on_echo, None)
+    samples = []
+    for _ in range(count):
+        pending[:] = [asyncio.get_event_loop().create_future()]
+        start = time.perf_counter()
+        alice.send_message("ping")
+        await asyncio.wait_for(pending[0], 10)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def _run(quick: bool) -> Dict[str, Result]:
+    count = 2000 if quick else 20000
+    results: Dict[str, Result] = {}
+
+    for label, batch_window in (("unbatched", 0.0), ("batched", 0.002)):
+        alice, bob = await _connect(batch_window)
+        try:
+            # Лучший из нескольких прогонов по одному соединению
+            best = 0.0
+            for _ in range(REPEAT):
+                best = max(best, await _throughput(alice, bob, count // REPEAT))
+            results[f"network.throughput.{label}.{MESSAGE_SIZE}B"] = result(
+                best, "msg/s", True)
+            if not batch_window:
+                samples = await _round_trips(alice, bob, 100 if quick else 1000)
+                results["network.rtt.p50"] = result(
+                    percentile(samples, 50) * 1e3, "ms", False)
+                results["network.rtt.p90"] = result(
+                    percentile(samples, 90) * 1e3, "ms", False)
+        finally:
+            await alice.close()
+            await bob.close()
+    return results
+
+
+def run(quick: bool) -> Dict[str, Result]:
+    return asyncio.run(_run(quick))
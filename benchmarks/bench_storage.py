@@ -0,0 +1,41 @@
+"""Задержки Storage в зависимости от размера истории"""
+import os
+import base64
+from typing import Dict
+from src.core.storage import Storage
+from src.utils.config import HISTORY_PAGE_SIZE
+from .common import Result, result, latencies, percentile, best_percentile
+
+HISTORY_SIZES = [1000, 10000, 50000]
+QUICK_HISTORY_SIZES = [1000, 10000]
+
+
+def _peer_id() -> str:
+    # Новый контакт на каждый прогон: история начинается с нуля
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+def run(quick: bool) -> Dict[str, Result]:
+    storage = Storage()
+    results: Dict[str, Result] = {}
+    try:
+        for size in QUICK_HISTORY_SIZES if quick else HISTORY_SIZES:
+            peer_id = _peer_id()
+            counter = iter(range(size))
+            samples = latencies(lambda: storage.add_message(peer_id, {
+                "text": f"Сообщение номер {next(counter)} для замера хранилища",
+                "is_self": True}), size)
+            results[f"storage.add_message.p50.{size}"] = result(
+                percentile(samples, 50) * 1e6, "us", False)
+            results[f"storage.add_message.p90.{size}"] = result(
+                percentile(samples, 90) * 1e6, "us", False)
+
+            # Первая страница при открытии чата и полная загрузка истории
+            page = best_percentile(lambda: storage.load_chat_history(
+                peer_id, limit=HISTORY_PAGE_SIZE), 20, 50)
+            results[f"storage.load_page.p50.{size}"] = result(page * 1e3, "ms", False)
+            full = best_percentile(lambda: storage.load_chat_history(peer_id), 3, 50)
+            results[f"storage.load_all.p50.{size}"] = result(full * 1e3, "ms", False)
+    finally:
+        storage.close()
+    return results
@@ -0,0 +1,59 @@
+import gc
+import time
+from typing import Callable, Dict, List
+
+# Результат бенчмарка: значение, единица и направление улучшения
+Result = Dict[str, object]
+
+# Прогонов одного замера: в результат идет лучший, как в timeit, чтобы
+# сравнение с базовым не зависело от случайной нагрузки на машину
+REPEAT = 5
+
+
+def result(value: float, unit: str, higher_is_better: bool) -> Result:
+    return {"value": round(value, 3), "unit": unit,
+            "higher_is_better": higher_is_better}
+
+
+def throughput(fn: Callable[[], None], count: int, repeat: int = REPEAT) -> float:
+    """Операций в секунду для count вызовов fn, лучший из repeat прогонов"""
+    best = 0.0
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(count):
+                fn()
+            best = max(best, count / (time.perf_counter() - start))
+        finally:
+            gc.enable()
+    return best
+
+
+def latencies(fn: Callable[[], None], count: int) -> List[float]:
+    """Длительность каждого из count вызовов fn, секунды"""
+    samples = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return samples
+
+
+def best_percentile(fn: Callable[[], None], count: int, p: float,
+                    repeat: int = REPEAT) -> float:
+    """Перцентиль p задержки fn, лучший из repeat прогонов по count вызовов"""
+    return min(percentile(latencies(fn, count), p) for _ in range(repeat))
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Перцентиль p (0-100) по выборке"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -11,6 +11,7 @@ setup(
         "cryptography>=42.0.0",
         "aiortc>=1.5.0",
         "aioice>=0.9.0",
+        "qasync>=0.27.0",
         "pytest>=8.0.0",
         "pytest-asyncio>=0.23.0",
         "pyinstaller>=6.3.0",
@@ -20,6 +21,7 @@ setup(
     entry_points={
         "console_scripts": [
             "p2p-chat=src.main:main",
+            "p2p-chatd=src.daemon:main",
         ],
     },
     author="Your Name",
@@ -0,0 +1,359 @@
+import json
+import os
+import struct
+from bisect import bisect_left, bisect_right
+import zlib
+import logging
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from ..utils.config import CHAT_SEGMENT_SIZE
+from ..utils.fileio import atomic_write_json, fsync_batcher, fsync_dir, io_stats
+
+logger = logging.getLogger(__name__)
+
+# Заголовок записи: длина полезной нагрузки и её CRC32
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".log"
+PENDING_SUFFIX = ".new"
+COMPACT_MARKER = "COMPACTING"
+NEXT_SEQ_FILE = "NEXT_SEQ"
+
+
+def encode_record(message: Dict) -> bytes:
+    """Упаковка сообщения в одну запись журнала"""
+    payload = json.dumps(message, ensure_ascii=False,
+                         separators=(",", ":")).encode("utf-8")
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(data: bytes) -> tuple[List[Dict], int]:
+    """Разбор записей из буфера, возвращает сообщения и длину корректной части"""
+    view = memoryview(data)
+    messages = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(view):
+        length, crc = RECORD_HEADER.unpack_from(view, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + length
+        if end > len(view):
+            break
+        payload = view[start:end]
+        if zlib.crc32(payload) != crc:
+            break
+        messages.append(json.loads(payload.tobytes().decode("utf-8")))
+        offset = end
+    return messages, offset
+
+
+def record_offsets(data: bytes) -> List[int]:
+    """Смещения корректных записей в буфере (без разбора JSON)"""
+    view = memoryview(data)
+    offsets = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(view):
+        length, crc = RECORD_HEADER.unpack_from(view, offset)
+        end = offset + RECORD_HEADER.size + length
+        if end > len(view) or zlib.crc32(view[offset + RECORD_HEADER.size:end]) != crc:
+            break
+        offsets.append(offset)
+        offset = end
+    return offsets
+
+
+def decode_record_at(data: bytes, offset: int) -> Dict:
+    """Разбор одной записи по ее смещению"""
+    length, _ = RECORD_HEADER.unpack_from(data, offset)
+    start = offset + RECORD_HEADER.size
+    return json.loads(data[start:start + length].decode("utf-8"))
+
+
+class ChatLog:
+    """Сегментированный append-only журнал сообщений одного чата.
+
+    Каждый сегмент называется по seq первой записи в нём, поэтому
+    порядок сегментов совпадает с порядком сообщений.
+
+    Перезапись (rewrite) атомарна: новые сегменты пишутся в *.new, затем
+    маркер COMPACTING со списком новых сегментов фиксирует замену. При
+    сбое после маркера открытие журнала удаляет только старые сегменты,
+    которых нет в списке, и доводит переименования до конца; без маркера
+    недописанные *.new просто удаляются.
+
+    seq никогда не выдается повторно: перезапись сохраняет следующий seq
+    в NEXT_SEQ (уплотнение может удалить последние записи), а first_seq
+    задает начало для журнала, созданного на месте удаленного.
+    """
+
+    def __init__(self, directory: Path, segment_size: int = CHAT_SEGMENT_SIZE,
+                 first_seq: int = 1):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._writer: Optional[BinaryIO] = None
+        self._writer_size = 0
+        # Смещения записей прочитанных сегментов: страница истории
+        # разбирает только свои записи, а не весь сегмент
+        self._offsets: Dict[int, List[int]] = {}
+        self._recover_compaction()
+        self._segments: List[int] = sorted(
+            int(p.stem) for p in self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+        self._next_seq = max(self._scan_tail(), self._stored_next_seq(), first_seq)
+
+    @property
+    def next_seq(self) -> int:
+        """seq, который получит следующая запись"""
+        return self._next_seq
+
+    def _segment_path(self, first_seq: int, suffix: str = SEGMENT_SUFFIX) -> Path:
+        return self.directory / f"{first_seq:012d}{suffix}"
+
+    def _recover_compaction(self) -> None:
+        """Завершение или откат прерванного уплотнения"""
+        marker = self.directory / COMPACT_MARKER
+        pending = list(self.directory.glob(f"*{PENDING_SUFFIX}"))
+        if marker.exists():
+            # Новые сегменты полностью записаны - доводим замену до конца.
+            # Уже переименованные новые сегменты есть в списке маркера
+            new_segments = set(json.loads(marker.read_text()))
+            for old in self.directory.glob(f"*{SEGMENT_SUFFIX}"):
+                if int(old.stem) not in new_segments:
+                    old.unlink()
+            for new in pending:
+                new.replace(new.with_suffix(SEGMENT_SUFFIX))
+            marker.unlink()
+            fsync_dir(self.directory)
+            io_stats["compactions_redone"] += 1
+            logger.warning(f"Завершено прерванное уплотнение: {self.directory}")
+        elif pending:
+            # Уплотнение оборвалось до фиксации - старые сегменты целы
+            for new in pending:
+                new.unlink()
+            io_stats["compactions_undone"] += 1
+
+    def _stored_next_seq(self) -> int:
+        try:
+            return int(json.loads((self.directory / NEXT_SEQ_FILE).read_text()))
+        except (FileNotFoundError, ValueError):
+            return 1
+
+    def _scan_tail(self) -> int:
+        """Поиск следующего seq и отсечение оборванной последней записи"""
+        while self._segments:
+            path = self._segment_path(self._segments[-1])
+            data = path.read_bytes()
+            messages, valid = decode_records(data)
+            if valid < len(data):
+                logger.warning(
+                    f"Обрезана повреждённая запись в {path} ({len(data) - valid} байт)")
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+                io_stats["truncated_records"] += 1
+            if messages:
+                return messages[-1]["seq"] + 1
+            # Пустой сегмент не несёт данных
+            path.unlink()
+            self._segments.pop()
+        return 1
+
+    def _open_writer(self, record_size: int) -> BinaryIO:
+        if self._writer and self._writer_size + record_size <= self.segment_size:
+            return self._writer
+        self._close_writer()
+        if self._segments:
+            path = self._segment_path(self._segments[-1])
+            size = path.stat().st_size
+            if size + record_size <= self.segment_size:
+                self._writer = open(path, "ab")
+                self._writer_size = size
+                return self._writer
+        self._segments.append(self._next_seq)
+        self._offsets[self._next_seq] = []
+        self._writer = open(self._segment_path(self._next_seq), "ab")
+        self._writer_size = 0
+        return self._writer
+
+    def _close_writer(self) -> None:
+        if self._writer:
+            fsync_batcher.release(self._writer)
+            self._writer.close()
+            self._writer = None
+            self._writer_size = 0
+
+    def append(self, message: Dict) -> Dict:
+        """Дописывание сообщения в конец журнала"""
+        record_message = {**message, "seq": self._next_seq}
+        record = encode_record(record_message)
+        writer = self._open_writer(len(record))
+        offsets = self._offsets.get(self._segments[-1])
+        if offsets is not None:
+            offsets.append(self._writer_size)
+        writer.write(record)
+        writer.flush()
+        # fsync выполняется группой для всех записей окна
+        fsync_batcher.schedule(writer)
+        self._writer_size += len(record)
+        self._next_seq += 1
+        return record_message
+
+    def __iter__(self) -> Iterator[Dict]:
+        for first_seq in self._segments:
+            data = self._segment_path(first_seq).read_bytes()
+            messages, _ = decode_records(data)
+            yield from messages
+
+    def read_all(self) -> List[Dict]:
+        """Чтение всех сообщений журнала"""
+        return list(self)
+
+    def read_page(self, before: Optional[int], limit: Optional[int],
+                  keep: Callable[[Dict], bool]) -> List[Dict]:
+        """Чтение последних limit записей с seq меньше before (None - всех).
+
+        Сегменты читаются с конца, поэтому стоимость не зависит от
+        длины всей истории.
+        """
+        if limit == 0:
+            return []
+        end = len(self._segments) if before is None else bisect_left(
+            self._segments, before)
+        page: List[Dict] = []
+        for position in range(end - 1, -1, -1):
+            data, offsets = self._segment_records(self._segments[position])
+            stop = len(offsets)
+            if before is not None and position == end - 1:
+                # Граница курсора внутри сегмента
+                stop = self._bisect_seq(data, offsets, before)
+            chunk: List[Dict] = []
+            for index in range(stop - 1, -1, -1):
+                message = decode_record_at(data, offsets[index])
+                if keep(message):
+                    chunk.append(message)
+                    if limit is not None and len(page) + len(chunk) >= limit:
+                        break
+            page[:0] = reversed(chunk)
+            if limit is not None and len(page) >= limit:
+                break
+        return page
+
+    def find(self, seqs: Iterable[int]) -> Dict[int, Dict]:
+        """Записи с данными seq; отсутствующие в журнале пропускаются"""
+        by_segment: Dict[int, List[int]] = {}
+        for seq in seqs:
+            position = bisect_right(self._segments, seq) - 1
+            if position >= 0:
+                by_segment.setdefault(self._segments[position], []).append(seq)
+        found = {}
+        for first_seq, wanted in by_segment.items():
+            data, offsets = self._segment_records(first_seq)
+            for seq in wanted:
+                index = self._bisect_seq(data, offsets, seq)
+                if index < len(offsets):
+                    message = decode_record_at(data, offsets[index])
+                    if message["seq"] == seq:
+                        found[seq] = message
+        return found
+
+    def _segment_records(self, first_seq: int) -> Tuple[bytes, List[int]]:
+        """Содержимое сегмента и смещения его записей"""
+        data = self._segment_path(first_seq).read_bytes()
+        offsets = self._offsets.get(first_seq)
+        if offsets is None:
+            offsets = self._offsets[first_seq] = record_offsets(data)
+        return data, offsets
+
+    @staticmethod
+    def _bisect_seq(data: bytes, offsets: List[int], seq: int) -> int:
+        """Номер первой записи сегмента с seq не меньше данного"""
+        low, high = 0, len(offsets)
+        while low < high:
+            middle = (low + high) // 2
+            if decode_record_at(data, offsets[middle])["seq"] < seq:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def rewrite(self, messages: List[Dict]) -> None:
+        """Полная замена содержимого журнала с сохранением seq"""
+        self._close_writer()
+        new_segments: List[int] = []
+        writer: Optional[BinaryIO] = None
+        size = 0
+        next_seq = 1
+        try:
+            for message in messages:
+                seq = message.get("seq")
+                if not isinstance(seq, int) or seq < next_seq:
+                    seq = next_seq
+                record = encode_record({**message, "seq": seq})
+                if writer is None or size + len(record) > self.segment_size:
+                    if writer:
+                        writer.flush()
+                        os.fsync(writer.fileno())
+                        writer.close()
+                    new_segments.append(seq)
+                    writer = open(self._segment_path(seq, PENDING_SUFFIX), "wb")
+                    size = 0
+                writer.write(record)
+                size += len(record)
+                next_seq = seq + 1
+            if writer:
+                writer.flush()
+                os.fsync(writer.fileno())
+        finally:
+            if writer:
+                writer.close()
+
+        # Следующий seq не должен уменьшиться, даже если хвост журнала удален
+        next_seq = max(next_seq, self._next_seq)
+        atomic_write_json(self.directory / NEXT_SEQ_FILE, next_seq, indent=None)
+
+        # Маркер со списком новых сегментов фиксирует, что они на диске полностью
+        marker = self.directory / COMPACT_MARKER
+        atomic_write_json(marker, new_segments, indent=None)
+        kept = set(new_segments)
+        for first_seq in self._segments:
+            if first_seq not in kept:
+                self._segment_path(first_seq).unlink(missing_ok=True)
+        for first_seq in new_segments:
+            self._segment_path(first_seq, PENDING_SUFFIX).replace(
+                self._segment_path(first_seq))
+        marker.unlink()
+        fsync_dir(self.directory)
+
+        self._segments = new_segments
+        self._offsets.clear()
+        self._next_seq = next_seq
+
+    def compact(self, keep: Callable[[Dict], bool]) -> List[Dict]:
+        """Уплотнение журнала: удаление ненужных записей и слияние сегментов.
+
+        Возвращает удаленные записи.
+        """
+        alive, removed = [], []
+        for message in self.read_all():
+            (alive if keep(message) else removed).append(message)
+        if removed or self._has_small_segments():
+            self.rewrite(alive)
+        return removed
+
+    def _has_small_segments(self) -> bool:
+        """Есть ли недозаполненные сегменты, кроме последнего"""
+        return any(
+            self._segment_path(first_seq).stat().st_size < self.segment_size // 2
+            for first_seq in self._segments[:-1]
+        )
+
+    def close(self) -> None:
+        """Закрытие открытого сегмента"""
+        self._close_writer()
+
+    def destroy(self) -> None:
+        """Удаление журнала с диска"""
+        self._close_writer()
+        for path in self.directory.iterdir():
+            path.unlink()
+        self.directory.rmdir()
+        self._segments = []
+        self._offsets.clear()
+        self._next_seq = 1
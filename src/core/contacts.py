@@ -0,0 +1,84 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# События изменения списка контактов
+CONTACT_ADDED = "added"
+CONTACT_REMOVED = "removed"
+
+ContactListener = Callable[[str, Dict], None]
+
+
+class ContactIndex:
+    """Контакты в памяти, проиндексированные по публичному ключу.
+
+    Поиск и проверка дубликата - обращение к словарю, порядок добавления
+    сохраняется (словарь упорядочен). Подписчики получают отдельные
+    события добавления и удаления, поэтому списку в интерфейсе не нужно
+    перезагружаться целиком.
+    """
+
+    def __init__(self, contacts: Iterable[Dict] = ()):
+        self._by_key: Dict[str, Dict] = {}
+        self._listeners: List[ContactListener] = []
+        for contact in contacts:
+            self._by_key.setdefault(contact["public_key"], contact)
+
+    def __contains__(self, public_key: str) -> bool:
+        return public_key in self._by_key
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def get(self, public_key: str) -> Optional[Dict]:
+        """Контакт по публичному ключу"""
+        return self._by_key.get(public_key)
+
+    def all(self) -> List[Dict]:
+        """Все контакты в порядке добавления"""
+        return list(self._by_key.values())
+
+    def add(self, contact: Dict) -> bool:
+        """Добавление контакта, False если такой ключ уже есть"""
+        if contact["public_key"] in self._by_key:
+            return False
+        self._by_key[contact["public_key"]] = contact
+        self._notify(CONTACT_ADDED, contact)
+        return True
+
+    def remove(self, public_key: str) -> Optional[Dict]:
+        """Удаление контакта, возвращает удаленный контакт"""
+        contact = self._by_key.pop(public_key, None)
+        if contact is not None:
+            self._notify(CONTACT_REMOVED, contact)
+        return contact
+
+    def replace(self, contacts: Iterable[Dict]) -> None:
+        """Замена содержимого (файл контактов изменен извне) с событиями о разнице"""
+        by_key: Dict[str, Dict] = {}
+        for contact in contacts:
+            by_key.setdefault(contact["public_key"], contact)
+        old, self._by_key = self._by_key, by_key
+        for public_key, contact in old.items():
+            if public_key not in by_key:
+                self._notify(CONTACT_REMOVED, contact)
+        for public_key, contact in by_key.items():
+            if public_key not in old:
+                self._notify(CONTACT_ADDED, contact)
+
+    def subscribe(self, listener: ContactListener) -> None:
+        """Подписка на события (событие, контакт)"""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: ContactListener) -> None:
+        """Отписка от событий"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, event: str, contact: Dict) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(event, contact)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменения контактов: {e}")
@@ -1,78 +1,195 @@
-from nacl.public import PrivateKey, PublicKey, Box
-from nacl.utils import random
-from nacl.signing import SigningKey, VerifyKey
-import base64
-from typing import Optional
-from ..utils.config import KEY_SIZE, NONCE_SIZE
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from ..utils.config import (
+    KEY_SIZE, NONCE_SIZE, CRYPTO_CACHE_SIZE, CRYPTO_WORKERS,
+    CRYPTO_PARALLEL_THRESHOLD
+)
+from . import metrics
+from .wire import (
+    BytesLike, FLAG_BATCH, HEADER, encode_frame, decode_frame, header,
+    pack_batch, unpack_batch
+)
+
+if TYPE_CHECKING:
+    from nacl.public import PrivateKey, PublicKey, Box
+    from nacl.signing import SigningKey, VerifyKey
+
+# PyNaCl (libsodium) импортируется при первой операции с ключами, чтобы
+# не задерживать запуск приложения
+
+logger = logging.getLogger(__name__)
+
+CRYPTO_SECONDS = metrics.Histogram(
+    "p2p_crypto_seconds", "Время шифрования и расшифровки кадра", ("op",))
+_ENCRYPT_SECONDS = CRYPTO_SECONDS.labels("encrypt")
+_DECRYPT_SECONDS = CRYPTO_SECONDS.labels("decrypt")
 
 
 class CryptoManager:
-    def __init__(self):
-        self._private_key: Optional[PrivateKey] = None
-        self._public_key: Optional[PublicKey] = None
-        self._signing_key: Optional[SigningKey] = None
-        self._verify_key: Optional[VerifyKey] = None
+    def __init__(self, cache_size: int = CRYPTO_CACHE_SIZE):
+        self._private_key: Optional["PrivateKey"] = None
+        self._public_key: Optional["PublicKey"] = None
+        self._signing_key: Optional["SigningKey"] = None
+        self._verify_key: Optional["VerifyKey"] = None
+
+        # LRU-кэши по публичному ключу собеседника: Box хранит вычисленный
+        # общий ключ Curve25519, поэтому на сообщение остается только AEAD
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self._boxes: "OrderedDict[bytes, Box]" = OrderedDict()
+        self._executor: Optional[ThreadPoolExecutor] = None
 
     def generate_keys(self) -> None:
         """Генерация пары ключей для шифрования и подписи"""
+        from nacl.public import PrivateKey
+        from nacl.signing import SigningKey
         self._private_key = PrivateKey.generate()
         self._public_key = self._private_key.public_key
         self._signing_key = SigningKey.generate()
         self._verify_key = self._signing_key.verify_key
+        self.clear_cache()
 
     def load_keys(self, private_key: bytes, verify_key: bytes) -> None:
         """Загрузка существующих ключей"""
+        from nacl.public import PrivateKey
+        from nacl.signing import SigningKey
         self._private_key = PrivateKey(private_key)
         self._public_key = self._private_key.public_key
         self._signing_key = SigningKey(verify_key)
         self._verify_key = self._signing_key.verify_key
-
-    def encrypt_message(self, message: str, recipient_public_key: bytes) -> dict[str, str]:
-        """Шифрование сообщения для получателя"""
+        self.clear_cache()
+
+    def _cached(self, cache: OrderedDict, key: bytes, factory):
+        """Получение значения из LRU-кэша с созданием при промахе"""
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                return value
+        value = factory()
+        with self._cache_lock:
+            cache[key] = value
+            if len(cache) > self._cache_size:
+                cache.popitem(last=False)
+        return value
+
+    def _box(self, peer_public_key: bytes) -> "Box":
+        """Box с предвычисленным общим ключом для собеседника"""
+        from nacl.public import PublicKey, Box
+        return self._cached(
+            self._boxes, bytes(peer_public_key),
+            lambda: Box(self._private_key, PublicKey(peer_public_key)))
+
+    def invalidate_peer(self, peer_public_key: bytes) -> None:
+        """Сброс кэшированных ключей собеседника (например, при смене его ключей)"""
+        with self._cache_lock:
+            self._boxes.pop(bytes(peer_public_key), None)
+
+    def clear_cache(self) -> None:
+        """Сброс всех кэшированных ключей (при смене собственных ключей)"""
+        with self._cache_lock:
+            self._boxes.clear()
+
+    @metrics.timed(_ENCRYPT_SECONDS)
+    def encrypt_payload(self, payload: bytes, recipient_public_key: bytes,
+                        flags: int = 0) -> bytes:
+        """Шифрование произвольных байтов в бинарный кадр"""
         if not self._private_key:
             raise ValueError("Ключи не инициализированы")
 
-        # Создаем Box для ECDH
-        box = Box(self._private_key, PublicKey(recipient_public_key))
+        # Box с общим ключом берется из кэша
+        box = self._box(recipient_public_key)
 
         # Генерируем случайный nonce
+        from nacl.utils import random
         nonce = random(NONCE_SIZE)
 
-        # Шифруем сообщение
-        encrypted = box.encrypt(message.encode(), nonce)
-
-        # Подписываем сообщение
-        signature = self._signing_key.sign(encrypted).signature
+        # Шифруем сообщение вместе с копией заголовка
+        ciphertext = box.encrypt(header(flags) + payload, nonce).ciphertext
 
-        return {
-            "encrypted": base64.b64encode(encrypted).decode(),
-            "nonce": base64.b64encode(nonce).decode(),
-            "signature": base64.b64encode(signature).decode()
-        }
+        return encode_frame(flags, nonce, ciphertext)
 
-    def decrypt_message(self, encrypted_data: dict[str, str], sender_public_key: bytes) -> str:
-        """Расшифровка сообщения от отправителя"""
+    @metrics.timed(_DECRYPT_SECONDS)
+    def decrypt_payload(self, data: BytesLike, sender_public_key: bytes) -> Tuple[int, bytes]:
+        """Проверка и расшифровка бинарного кадра, возвращает флаги и данные"""
         if not self._private_key:
             raise ValueError("Ключи не инициализированы")
 
-        # Создаем Box для ECDH
-        box = Box(self._private_key, PublicKey(sender_public_key))
-
-        # Декодируем данные
-        encrypted = base64.b64decode(encrypted_data["encrypted"])
-        nonce = base64.b64decode(encrypted_data["nonce"])
-        signature = base64.b64decode(encrypted_data["signature"])
+        frame = decode_frame(data)
 
-        # Проверяем подпись
-        verify_key = VerifyKey(sender_public_key)
+        # MAC Box подтверждает, что кадр зашифрован собеседником
+        box = self._box(sender_public_key)
         try:
-            verify_key.verify(encrypted, signature)
+            plaintext = box.decrypt(bytes(frame.ciphertext), bytes(frame.nonce))
         except Exception as e:
-            raise ValueError("Неверная подпись сообщения") from e
+            raise ValueError("Не удалось расшифровать сообщение") from e
+        if plaintext[:HEADER.size] != header(frame.flags):
+            raise ValueError("Заголовок кадра изменен")
+        return frame.flags, plaintext[HEADER.size:]
 
-        # Расшифровываем сообщение
-        decrypted = box.decrypt(encrypted, nonce)
-        return decrypted.decode()
+    def encrypt_message(self, message: str, recipient_public_key: bytes) -> bytes:
+        """Шифрование сообщения для получателя"""
+        return self.encrypt_payload(message.encode(), recipient_public_key)
+
+    def decrypt_message(self, encrypted_data: BytesLike, sender_public_key: bytes) -> str:
+        """Расшифровка сообщения от отправителя"""
+        _, plaintext = self.decrypt_payload(encrypted_data, sender_public_key)
+        return plaintext.decode()
+
+    def encrypt_messages(self, messages: List[str], recipient_public_key: bytes) -> bytes:
+        """Шифрование нескольких сообщений в один кадр"""
+        if len(messages) == 1:
+            return self.encrypt_message(messages[0], recipient_public_key)
+        return self.encrypt_payload(
+            pack_batch(messages), recipient_public_key, FLAG_BATCH)
+
+    def decrypt_texts(self, encrypted_data: BytesLike, sender_public_key: bytes) -> List[str]:
+        """Расшифровка кадра с одним или несколькими сообщениями"""
+        flags, plaintext = self.decrypt_payload(encrypted_data, sender_public_key)
+        if flags & FLAG_BATCH:
+            return unpack_batch(plaintext)
+        return [plaintext.decode()]
+
+    def _try_decrypt(self, encrypted_data: BytesLike, sender_public_key: bytes) -> List[str]:
+        try:
+            return self.decrypt_texts(encrypted_data, sender_public_key)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.warning(f"Отброшено сообщение: {e}")
+            return []
+
+    def decrypt_messages(self, messages: List[BytesLike],
+                         sender_public_key: bytes) -> List[List[str]]:
+        """Пакетная расшифровка кадров одного отправителя.
+
+        Расшифровка идет в пуле потоков (libsodium
+        отпускает GIL). Для каждого кадра в исходном порядке возвращается
+        список его сообщений; кадр, не прошедший проверку, дает пустой список.
+        """
+        if len(messages) < CRYPTO_PARALLEL_THRESHOLD:
+            return [self._try_decrypt(m, sender_public_key) for m in messages]
+
+        # Прогреваем кэш, чтобы потоки не вычисляли общий ключ одновременно
+        self._box(sender_public_key)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+        chunk_size = -(-len(messages) // CRYPTO_WORKERS)
+        chunks = [messages[i:i + chunk_size]
+                  for i in range(0, len(messages), chunk_size)]
+        results = self._executor.map(
+            lambda chunk: [self._try_decrypt(m, sender_public_key) for m in chunk],
+            chunks)
+        return [texts for chunk in results for texts in chunk]
+
+    def shutdown(self) -> None:
+        """Остановка пула потоков пакетной расшифровки"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
     def get_public_key(self) -> bytes:
         """Получение публичного ключа"""
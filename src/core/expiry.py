@@ -0,0 +1,189 @@
+import heapq
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from datetime import datetime
+from .chatlog import encode_record, decode_records
+from ..utils.config import EXPIRY_MIN_INTERVAL
+from ..utils.fileio import atomic_write_bytes, fsync_batcher, io_stats
+
+logger = logging.getLogger(__name__)
+
+# Элемент индекса: (момент истечения, peer_id, seq сообщения)
+ExpiryEntry = Tuple[float, str, int]
+
+
+def message_expires_at(message: dict) -> Optional[float]:
+    """Момент истечения сообщения в секундах epoch"""
+    expires_at = message.get("expires_at")
+    if expires_at is None and "expiry" in message and "timestamp" in message:
+        # Сообщения, сохранённые до появления expires_at
+        expires_at = datetime.fromisoformat(
+            message["timestamp"]).timestamp() + message["expiry"]
+    return expires_at
+
+
+class ExpiryIndex:
+    """Мин-куча сроков жизни сообщений, сохраняемая на диск.
+
+    Файл только дописывается: новые элементы - записями {"t", "p", "s"},
+    извлечение пачки - отметкой {"w", "p", "s"} с последним извлеченным
+    элементом. Куча извлекает элементы по возрастанию, поэтому при
+    загрузке отметка повторяет извлечение всех меньших элементов,
+    записанных до нее. Файл перезаписывается только при накоплении
+    EXPIRY_INDEX_GARBAGE извлеченных элементов.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._heap: List[ExpiryEntry] = []
+        self._writer: Optional[BinaryIO] = None
+        # Извлеченные элементы, которые еще остаются в файле, по чатам
+        self.garbage: Dict[str, int] = {}
+        if path.exists():
+            records, valid = decode_records(path.read_bytes())
+            for record in records:
+                if "w" in record:
+                    self._pop_through((record["w"], record["p"], record["s"]))
+                else:
+                    heapq.heappush(self._heap, (record["t"], record["p"], record["s"]))
+            if valid < path.stat().st_size:
+                io_stats["corrupt_files"] += 1
+                logger.warning(f"Индекс сроков жизни повреждён, перезаписан: {path}")
+                self.save()
+
+    def _pop_through(self, mark: ExpiryEntry) -> None:
+        """Повтор извлечения элементов не больше отметки"""
+        while self._heap and self._heap[0] <= mark:
+            _, peer_id, _ = heapq.heappop(self._heap)
+            self.garbage[peer_id] = self.garbage.get(peer_id, 0) + 1
+
+    def _write(self, record: dict) -> None:
+        if self._writer is None:
+            self._writer = open(self.path, "ab")
+        self._writer.write(encode_record(record))
+        self._writer.flush()
+        fsync_batcher.schedule(self._writer)
+
+    @property
+    def garbage_total(self) -> int:
+        return sum(self.garbage.values())
+
+    @property
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def push(self, expires_at: float, peer_id: str, seq: int) -> None:
+        """Добавление сообщения в индекс"""
+        heapq.heappush(self._heap, (expires_at, peer_id, seq))
+        self._write({"t": expires_at, "p": peer_id, "s": seq})
+
+    def next_expiry(self) -> Optional[float]:
+        """Ближайший момент истечения"""
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: Optional[int] = None) -> List[ExpiryEntry]:
+        """Извлечение истекших элементов (не более limit) с отметкой в файле"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            if limit is not None and len(due) >= limit:
+                break
+            due.append(heapq.heappop(self._heap))
+        if due:
+            expires_at, peer_id, seq = due[-1]
+            self._write({"w": expires_at, "p": peer_id, "s": seq})
+            for _, peer_id, _ in due:
+                self.garbage[peer_id] = self.garbage.get(peer_id, 0) + 1
+        return due
+
+    def drop_peer(self, peer_id: str) -> None:
+        """Удаление всех элементов чата (чат удален)"""
+        self._heap = [entry for entry in self._heap if entry[1] != peer_id]
+        heapq.heapify(self._heap)
+        self.garbage.pop(peer_id, None)
+        self.save()
+
+    def reset(self, entries: List[ExpiryEntry]) -> None:
+        """Полная замена содержимого индекса"""
+        self._heap = list(entries)
+        heapq.heapify(self._heap)
+        self.save()
+
+    def save(self) -> None:
+        """Перезапись файла индекса текущим содержимым кучи"""
+        self.close()
+        self.garbage = {}
+        atomic_write_bytes(self.path, b"".join(
+            encode_record({"t": expires_at, "p": peer_id, "s": seq})
+            for expires_at, peer_id, seq in self._heap))
+
+    def close(self) -> None:
+        if self._writer:
+            fsync_batcher.release(self._writer)
+            self._writer.close()
+            self._writer = None
+
+
+class ExpiryScheduler(threading.Thread):
+    """Фоновое удаление истекших сообщений.
+
+    Поток спит до ближайшего момента истечения из индекса хранилища
+    и удаляет сообщения пачками. Добавление сообщения с более ранним
+    сроком будит его через schedule(). Между пробуждениями проходит не
+    меньше EXPIRY_MIN_INTERVAL, чтобы близкие сроки удалялись одной
+    пачкой (истекшие сообщения и так не показываются).
+    """
+
+    def __init__(self, storage, batch_size: int):
+        super().__init__(name="expiry-scheduler", daemon=True)
+        self._storage = storage
+        self._batch_size = batch_size
+        self._condition = threading.Condition()
+        self._wake_at: Optional[float] = None
+        self._not_before = 0.0
+        self._stopped = False
+
+    def schedule(self, expires_at: float) -> None:
+        """Уведомление о новом сроке истечения"""
+        with self._condition:
+            if self._wake_at is None or expires_at < self._wake_at:
+                self._condition.notify()
+
+    def stop(self) -> None:
+        """Остановка планировщика"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self.is_alive():
+            self.join()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                self._wake_at = self._storage.next_expiry()
+                if self._wake_at is not None:
+                    self._wake_at = max(self._wake_at, self._not_before)
+                if self._wake_at is None:
+                    self._condition.wait()
+                else:
+                    delay = self._wake_at - time.time()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                if self._stopped:
+                    return
+            try:
+                removed = self._storage.purge_expired(self._batch_size)
+                if removed:
+                    logger.info(f"Удалено истекших сообщений: {removed}")
+                # Полная пачка - остались истекшие, продолжаем без паузы
+                self._not_before = 0.0 if removed >= self._batch_size \
+                    else time.time() + EXPIRY_MIN_INTERVAL
+            except Exception as e:
+                logger.error(f"Ошибка удаления истекших сообщений: {e}")
+                # Не крутимся в цикле при постоянной ошибке
+                with self._condition:
+                    self._condition.wait(60)
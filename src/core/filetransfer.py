@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+import logging
+from collections import deque
+from pathlib import Path
+from typing import BinaryIO, Callable, Deque, Dict, Optional
+from ..utils.config import (
+    DOWNLOADS_DIR, FILE_CHUNK_SIZE, FILE_MAX_SIZE, FILE_REPLY_TIMEOUT,
+    FILE_SEND_WINDOW, FILE_STATE_SAVE_INTERVAL, MAX_MESSAGE_SIZE
+)
+from ..utils.fileio import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Заголовок фрагмента внутри зашифрованных данных: id передачи и номер
+CHUNK_HEADER = struct.Struct(">16sQ")
+TRANSFER_ID_SIZE = 16
+
+
+def transfer_id_for(path: Path) -> bytes:
+    """Идентификатор передачи, одинаковый для повторной отправки того же файла"""
+    stat = path.stat()
+    return hashlib.sha256(
+        f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).digest()[:TRANSFER_ID_SIZE]
+
+
+def check_offer(offer: Dict) -> None:
+    """Проверка предложения файла до выделения места, ValueError при нарушении"""
+    if len(bytes.fromhex(offer["transfer_id"])) != TRANSFER_ID_SIZE:
+        raise ValueError("Неверный идентификатор передачи")
+    size, chunk_size, chunks = (
+        int(offer["size"]), int(offer["chunk_size"]), int(offer["chunks"]))
+    if not 0 <= size <= FILE_MAX_SIZE:
+        raise ValueError(f"Размер файла {size} превышает допустимый {FILE_MAX_SIZE}")
+    if not 0 < chunk_size <= MAX_MESSAGE_SIZE:
+        raise ValueError(f"Недопустимый размер фрагмента {chunk_size}")
+    if chunks != -(-size // chunk_size):
+        raise ValueError(f"Число фрагментов {chunks} не соответствует размеру {size}")
+
+
+class IncomingTransfer:
+    """Принимаемый файл: предвыделенный .part и состояние для докачки"""
+
+    def __init__(self, offer: Dict, downloads_dir: Path):
+        check_offer(offer)
+        self.transfer_id = bytes.fromhex(offer["transfer_id"])
+        self.name = Path(offer["name"]).name or "file"
+        self.size = int(offer["size"])
+        self.chunk_size = int(offer["chunk_size"])
+        self.chunks = int(offer["chunks"])
+        self.part_path = downloads_dir / f"{self.name}.{offer['transfer_id'][:8]}.part"
+        self.state_path = self.part_path.with_suffix(".json")
+        self.received = min(self._load_state(), self.chunks)
+        self._unsaved = 0
+
+        # Файл создается сразу полного размера, фрагменты пишутся на место
+        mode = "r+b" if self.part_path.exists() else "w+b"
+        self.file: BinaryIO = open(self.part_path, mode)
+        self.file.truncate(self.size)
+
+    def _load_state(self) -> int:
+        """Число подряд принятых фрагментов из прошлой попытки"""
+        if not self.state_path.exists() or not self.part_path.exists():
+            return 0
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if state.get("transfer_id") == self.transfer_id.hex():
+                return int(state.get("received", 0))
+        except (json.JSONDecodeError, IOError, ValueError):
+            pass
+        return 0
+
+    def save_state(self) -> None:
+        """Сохранение прогресса для докачки"""
+        # Прогресс фиксируется только после того, как фрагменты на диске
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        atomic_write_json(self.state_path, {
+            "transfer_id": self.transfer_id.hex(), "name": self.name,
+            "size": self.size, "received": self.received}, indent=None)
+        self._unsaved = 0
+
+    def write_chunk(self, index: int, data: memoryview) -> None:
+        """Запись фрагмента на его место в файле"""
+        offset = index * self.chunk_size
+        if index >= self.chunks or len(data) > self.chunk_size \
+                or offset + len(data) > self.size:
+            raise ValueError(
+                f"Фрагмент {index} ({len(data)} байт) вне объявленного файла "
+                f"({self.chunks} фрагментов, {self.size} байт)")
+        self.file.seek(offset)
+        self.file.write(data)
+        if index == self.received:
+            self.received += 1
+        self._unsaved += 1
+        if self._unsaved >= FILE_STATE_SAVE_INTERVAL:
+            self.save_state()
+
+    def finish(self) -> Path:
+        """Переименование полностью принятого файла"""
+        self.file.close()
+        target = self.part_path.parent / self.name
+        counter = 1
+        while target.exists():
+            target = self.part_path.parent / f"{Path(self.name).stem} ({counter}){Path(self.name).suffix}"
+            counter += 1
+        os.replace(self.part_path, target)
+        self.state_path.unlink(missing_ok=True)
+        return target
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.save_state()
+            self.file.close()
+
+
+class FileTransferManager:
+    """Потоковая передача файлов по отдельному data channel.
+
+    Файл читается через mmap фрагментами FILE_CHUNK_SIZE, каждый фрагмент
+    шифруется отдельно и отправляется в поток "file" с низким приоритетом.
+    В очереди одновременно не больше FILE_SEND_WINDOW фрагментов, следующий
+    читается после сброса самого старого.
+    Получатель сообщает, сколько фрагментов у него уже есть, и отправка
+    продолжается с этого места.
+    """
+
+    def __init__(self, crypto_manager, mux,
+                 peer_public_key: Optional[bytes] = None,
+                 downloads_dir: Path = DOWNLOADS_DIR,
+                 reply_timeout: float = FILE_REPLY_TIMEOUT):
+        self.crypto = crypto_manager
+        self.mux = mux
+        self.peer_public_key = peer_public_key
+        self.downloads_dir = downloads_dir
+        self.reply_timeout = reply_timeout
+        self.channel = None
+        self._accepted: Dict[bytes, asyncio.Future] = {}
+        self._done: Dict[bytes, asyncio.Future] = {}
+        self._incoming: Dict[bytes, IncomingTransfer] = {}
+        self.file_received: Optional[Callable[[Path], None]] = None
+        self.progress: Optional[Callable[[str, int, int], None]] = None
+
+    def attach(self, channel) -> None:
+        """Подключение data channel для передачи файлов"""
+        self.channel = channel
+
+        @channel.on("message")
+        def on_message(message):
+            try:
+                if isinstance(message, str):
+                    self._on_control(json.loads(message))
+                else:
+                    self._on_chunk(message)
+            except Exception as e:
+                logger.error(f"Ошибка обработки данных файла: {e}")
+
+    def _send(self, data) -> asyncio.Future:
+        # Управляющие сообщения идут в том же потоке, что и фрагменты,
+        # чтобы file_complete не обогнал их в очереди
+        return self.mux.send("file", data)
+
+    def _send_control(self, message: Dict) -> None:
+        self._send(json.dumps(message))
+
+    def _seal(self, payload: bytes) -> bytes:
+        if self.peer_public_key is None:
+            return payload
+        return self.crypto.encrypt_payload(payload, self.peer_public_key)
+
+    def _open(self, data: bytes) -> bytes:
+        if self.peer_public_key is None:
+            return data
+        _, payload = self.crypto.decrypt_payload(data, self.peer_public_key)
+        return payload
+
+    async def _wait_reply(self, future: asyncio.Future, name: str):
+        """Ответ получателя; RuntimeError, если он молчит дольше reply_timeout"""
+        try:
+            return await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Получатель не ответил на передачу файла {name}")
+
+    async def send_file(self, path: Path) -> None:
+        """Отправка файла с докачкой с места, известного получателю"""
+        if self.channel is None or self.channel.readyState != "open":
+            raise RuntimeError("Канал передачи файлов не подключен")
+
+        path = Path(path)
+        size = path.stat().st_size
+        transfer_id = transfer_id_for(path)
+        chunks = -(-size // FILE_CHUNK_SIZE)
+        loop = asyncio.get_event_loop()
+        accepted = self._accepted[transfer_id] = loop.create_future()
+
+        try:
+            self._send_control({
+                "type": "file_offer",
+                "transfer_id": transfer_id.hex(),
+                "name": path.name,
+                "size": size,
+                "chunk_size": FILE_CHUNK_SIZE,
+                "chunks": chunks
+            })
+            start = await self._wait_reply(accepted, path.name)
+            if start is None:
+                raise RuntimeError(f"Файл {path.name} отклонен получателем")
+            while start is not None:
+                logger.info(f"Отправка файла {path.name}: с фрагмента {start} из {chunks}")
+                await self._stream_chunks(path, transfer_id, size, start)
+
+                # Получатель отвечает file_done или номером, с которого повторить
+                done = self._done[transfer_id] = loop.create_future()
+                self._send_control({"type": "file_complete",
+                                    "transfer_id": transfer_id.hex()})
+                start = await self._wait_reply(done, path.name)
+            logger.info(f"Файл {path.name} доставлен")
+        finally:
+            self._accepted.pop(transfer_id, None)
+            self._done.pop(transfer_id, None)
+
+    async def _stream_chunks(self, path: Path, transfer_id: bytes,
+                             size: int, start: int) -> None:
+        """Отправка фрагментов файла начиная с номера start"""
+        if not size:
+            return
+        chunks = -(-size // FILE_CHUNK_SIZE)
+        in_flight: Deque[asyncio.Future] = deque()
+        with open(path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                memoryview(mapped) as view:
+            for index in range(start, chunks):
+                if len(in_flight) >= FILE_SEND_WINDOW:
+                    await in_flight.popleft()
+                offset = index * FILE_CHUNK_SIZE
+                # Срез отпускается сразу, иначе mmap нельзя закрыть
+                with view[offset:offset + FILE_CHUNK_SIZE] as chunk:
+                    payload = CHUNK_HEADER.pack(transfer_id, index) + chunk
+                in_flight.append(self._send(self._seal(payload)))
+                if self.progress:
+                    self.progress(transfer_id.hex(),
+                                  min(offset + FILE_CHUNK_SIZE, size), size)
+        # file_complete уходит только после сброса всех фрагментов,
+        # а ошибки их отправки не теряются
+        await asyncio.gather(*in_flight)
+
+    def _on_control(self, message: Dict) -> None:
+        """Обработка управляющих сообщений передачи"""
+        kind = message.get("type")
+        transfer_id = bytes.fromhex(message.get("transfer_id", ""))
+
+        if kind == "file_offer":
+            transfer = self._incoming.get(transfer_id)
+            if transfer is None:
+                try:
+                    check_offer(message)
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Предложение файла отклонено: {e}")
+                    self._send_control({"type": "file_reject",
+                                        "transfer_id": message.get("transfer_id", "")})
+                    return
+                self.downloads_dir.mkdir(parents=True, exist_ok=True)
+                transfer = IncomingTransfer(message, self.downloads_dir)
+                self._incoming[transfer_id] = transfer
+            logger.info(
+                f"Прием файла {transfer.name}: {transfer.received} из {transfer.chunks} фрагментов уже есть")
+            self._send_control({"type": "file_accept",
+                                "transfer_id": message["transfer_id"],
+                                "resume_from": transfer.received})
+        elif kind == "file_accept":
+            future = self._accepted.get(transfer_id)
+            if future and not future.done():
+                future.set_result(int(message.get("resume_from", 0)))
+        elif kind == "file_reject":
+            future = self._accepted.get(transfer_id)
+            if future and not future.done():
+                future.set_result(None)
+        elif kind == "file_complete":
+            transfer = self._incoming.get(transfer_id)
+            if transfer is None:
+                return
+            if transfer.received < transfer.chunks:
+                # Часть фрагментов потеряна - просим отправить с первого недостающего
+                self._send_control({"type": "file_resend",
+                                    "transfer_id": message["transfer_id"],
+                                    "resume_from": transfer.received})
+                return
+            del self._incoming[transfer_id]
+            path = transfer.finish()
+            self._send_control({"type": "file_done",
+                                "transfer_id": message["transfer_id"]})
+            logger.info(f"Файл принят: {path}")
+            if self.file_received:
+                self.file_received(path)
+        elif kind in ("file_done", "file_resend"):
+            future = self._done.get(transfer_id)
+            if future and not future.done():
+                future.set_result(message.get("resume_from"))
+
+    def _on_chunk(self, data: bytes) -> None:
+        """Запись принятого фрагмента"""
+        payload = memoryview(self._open(data))
+        transfer_id, index = CHUNK_HEADER.unpack_from(payload)
+        transfer = self._incoming.get(transfer_id)
+        if transfer is None:
+            logger.warning("Фрагмент неизвестной передачи отброшен")
+            return
+        transfer.write_chunk(index, payload[CHUNK_HEADER.size:])
+        if self.progress:
+            self.progress(transfer_id.hex(),
+                          min(transfer.received * transfer.chunk_size, transfer.size),
+                          transfer.size)
+
+    def close(self) -> None:
+        """Сохранение состояния незавершенных приемов и отмена отправок"""
+        for transfer in self._incoming.values():
+            transfer.close()
+        self._incoming.clear()
+        for future in list(self._accepted.values()) + list(self._done.values()):
+            if not future.done():
+                future.set_exception(RuntimeError("Соединение закрыто"))
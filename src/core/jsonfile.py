@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+from ..utils.config import JSON_FLUSH_DELAY, JSON_CHECK_INTERVAL
+from ..utils.fileio import atomic_write_json, io_stats
+
+logger = logging.getLogger(__name__)
+
+
+class CachedJsonFile:
+    """JSON-документ в памяти с отложенной записью на диск.
+
+    Чтение - обращение к словарю в памяти. Изменения помечают документ
+    измененным, и через flush_delay он записывается одним разом (через
+    временный файл и переименование), сколько бы изменений ни пришлось
+    на это окно. Правки файла другими программами подхватываются по
+    mtime, который проверяется не чаще раза в check_interval секунд.
+    """
+
+    def __init__(self, path: Path, default: Callable[[], Dict],
+                 flush_delay: float = JSON_FLUSH_DELAY,
+                 check_interval: float = JSON_CHECK_INTERVAL):
+        self.path = path
+        self._default = default
+        self._flush_delay = flush_delay
+        self._check_interval = check_interval
+        self._lock = threading.RLock()
+        self._data: Optional[Dict] = None
+        # Номер загрузки с диска: растет при каждом перечитывании файла
+        self.generation = 0
+        self._mtime_ns: Optional[int] = None
+        self._checked_at = 0.0
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+
+    def _stat_mtime(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self) -> None:
+        """Чтение документа с диска"""
+        self._mtime_ns = self._stat_mtime()
+        self._checked_at = time.monotonic()
+        data = None
+        if self._mtime_ns is not None:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                io_stats["corrupt_files"] += 1
+                logger.error(f"Ошибка чтения {self.path}: {e}")
+        self._data = data if isinstance(data, dict) else self._default()
+        self.generation += 1
+
+    @property
+    def data(self) -> Dict:
+        """Текущее содержимое документа"""
+        with self._lock:
+            if self._data is None:
+                self._load()
+            elif not self._dirty and \
+                    time.monotonic() - self._checked_at >= self._check_interval:
+                # Файл мог быть изменен вручную или другим процессом
+                self._checked_at = time.monotonic()
+                if self._stat_mtime() != self._mtime_ns:
+                    logger.info(f"Файл изменен извне, перечитан: {self.path}")
+                    self._load()
+            return self._data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.data[key] = value
+            self.mark_dirty()
+
+    def mark_dirty(self) -> None:
+        """Документ изменен: запись будет выполнена после задержки"""
+        with self._lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """Немедленная запись измененного документа"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            atomic_write_json(self.path, self._data)
+            self._mtime_ns = self._stat_mtime()
+            self._dirty = False
+
+    def close(self) -> None:
+        """Запись несохраненных изменений"""
+        self.flush()
@@ -0,0 +1,298 @@
+"""Метрики работы соединений, шифрования и хранилища.
+
+Счетчики, гистограммы и датчики регистрируются в модулях, где они
+обновляются, и выводятся в текстовом формате Prometheus (render) или
+списком строк для окна статистики (snapshot). Пока сбор выключен,
+каждое обновление сводится к проверке одного флага.
+"""
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+from ..utils.config import METRICS_ENABLED
+
+_enabled = METRICS_ENABLED
+_registry: List["_Metric"] = []
+
+# Границы гистограмм по умолчанию, секунды: от 10 мкс до 10 с
+DEFAULT_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05,
+                   0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+def enable() -> None:
+    """Включение сбора метрик"""
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """Выключение сбора (накопленные значения сохраняются)"""
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Значение метрики для набора меток"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        """(суффикс имени, метки, значение) для вывода"""
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield suffix, {**labels, **extra}, value
+
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        if not _enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield "", {}, self.value
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self._children[()].inc(amount)
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        if _enabled:
+            self.value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+
+class Gauge(Counter):
+    """Текущее значение, может уменьшаться"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def dec(self, amount: float = 1) -> None:
+        self._children[()].dec(amount)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: "_HistogramValue"):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        if not _enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Замер длительности блока with"""
+        return _Timer(self) if _enabled else _NULL_TIMER
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(bound)}, cumulative
+        yield "_bucket", {"le": "+Inf"}, self.count
+        yield "_sum", {}, self.sum
+        yield "_count", {}, self.count
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (длительности, размеры)"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+
+class Callback(_Metric):
+    """Значения, вычисляемые при выводе метрик.
+
+    fn возвращает число (без меток) или словарь {кортеж меток: число}.
+    Ничего не стоит, пока метрики не запрашивают.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], object],
+                 labelnames: Sequence[str] = (), kind: str = "gauge"):
+        self.kind = kind
+        self._fn = fn
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def _samples(self):
+        try:
+            values = self._fn()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+def timed(metric) -> Callable:
+    """Декоратор: длительность вызова в гистограмму metric"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4"""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric._samples():
+            lines.append(f"{metric.name}{suffix}{_format_labels(labels)} "
+                         f"{_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> List[Tuple[str, str]]:
+    """Краткие значения для отображения: (метрика с метками, значение)"""
+    rows = []
+    for metric in _registry:
+        if isinstance(metric, Histogram):
+            for key, child in list(metric._children.items()):
+                name = metric.name + _format_labels(dict(zip(metric.labelnames, key)))
+                mean = child.sum / child.count if child.count else 0.0
+                rows.append((name, f"{child.count} шт., среднее {mean:.6g}"))
+            continue
+        for _, labels, value in metric._samples():
+            rows.append((metric.name + _format_labels(labels), f"{value:.6g}"))
+    return rows
+
+
+def reset() -> None:
+    """Сброс накопленных значений (новый сеанс сбора)"""
+    for metric in _registry:
+        if not isinstance(metric, Callback):
+            for key in list(metric._children):
+                metric._children[key] = metric._new_child()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+from . import metrics
+from .sendqueue import SendQueue, PRIORITY_CHAT, PRIORITY_BULK, WIRE_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class StreamConfig(NamedTuple):
+    ordered: bool  # Доставка в порядке отправки
+    max_retransmits: Optional[int]  # None - надежная доставка
+    priority: int  # Приоритет в очереди отправки
+
+
+# Логические потоки соединения, у каждого свой data channel
+STREAMS: Dict[str, StreamConfig] = {
+    "chat": StreamConfig(ordered=True, max_retransmits=None, priority=PRIORITY_CHAT),
+    "file": StreamConfig(ordered=True, max_retransmits=None, priority=PRIORITY_BULK),
+    "presence": StreamConfig(ordered=False, max_retransmits=0, priority=PRIORITY_CHAT),
+    "sync": StreamConfig(ordered=True, max_retransmits=None, priority=PRIORITY_BULK),
+}
+
+
+class ChannelMux:
+    """Набор именованных потоков поверх одного RTCPeerConnection.
+
+    Каждый поток - отдельный data channel со своими настройками
+    упорядоченности и надежности, поэтому объемные данные (файлы,
+    синхронизация) не задерживают интерактивные сообщения. Инициатор
+    соединения создает каналы всех потоков, принимающая сторона
+    распределяет входящие каналы по метке.
+    """
+
+    def __init__(self, send_queue: SendQueue, streams: Dict[str, StreamConfig] = STREAMS):
+        self.send_queue = send_queue
+        self.streams = streams
+        self.channels: Dict[str, object] = {}
+        # Эта сторона создала предложение и каналы
+        self.initiator = False
+        self._handlers: Dict[str, Callable[[object], None]] = {}
+
+    def register(self, name: str, handler: Callable[[object], None]) -> None:
+        """Обработчик, получающий data channel потока при его появлении"""
+        if name not in self.streams:
+            raise ValueError(f"Неизвестный поток: {name}")
+        self._handlers[name] = handler
+        channel = self.channels.get(name)
+        if channel is not None:
+            handler(channel)
+
+    def on_message(self, name: str, callback: Callable[[Union[str, bytes]], None]) -> None:
+        """Обработчик сообщений потока"""
+        def attach(channel):
+            @channel.on("message")
+            def on_message(message):
+                try:
+                    callback(message)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки сообщения потока {name}: {e}")
+
+        self.register(name, attach)
+
+    def create_channels(self, pc) -> None:
+        """Создание каналов всех потоков (сторона, создающая предложение)"""
+        self.initiator = True
+        for name, config in self.streams.items():
+            self._attach(pc.createDataChannel(
+                name, ordered=config.ordered,
+                maxRetransmits=config.max_retransmits))
+
+    def handle_datachannel(self, channel) -> None:
+        """Входящий канал от собеседника"""
+        if channel.label not in self.streams:
+            logger.warning(f"Канал неизвестного потока отклонен: {channel.label}")
+            channel.close()
+            return
+        self._attach(channel)
+
+    def _attach(self, channel) -> None:
+        self.channels[channel.label] = channel
+        self.send_queue.watch(channel)
+
+        @channel.on("message")
+        def count_received(message):
+            if metrics.enabled():
+                WIRE_BYTES.labels("in", channel.label).inc(
+                    len(message.encode() if isinstance(message, str) else message))
+        handler = self._handlers.get(channel.label)
+        if handler is not None:
+            handler(channel)
+
+    def is_open(self, name: str) -> bool:
+        """Канал потока открыт"""
+        channel = self.channels.get(name)
+        return channel is not None and channel.readyState == "open"
+
+    def send(self, name: str, data: Union[str, bytes]) -> asyncio.Future:
+        """Отправка данных в поток с его приоритетом"""
+        channel = self.channels.get(name)
+        if channel is None or channel.readyState != "open":
+            raise RuntimeError(f"Поток {name} не подключен")
+        return self.send_queue.put(channel, data, self.streams[name].priority)
+
+    def clear(self) -> Dict[str, List[Tuple[Union[str, bytes], asyncio.Future]]]:
+        """Забыть каналы закрытого соединения.
+
+        Возвращает по потокам данные, не успевшие уйти в каналы
+        (см. SendQueue.detach).
+        """
+        pending = {name: self.send_queue.detach(channel)
+                   for name, channel in self.channels.items()}
+        self.channels.clear()
+        return pending
@@ -1,62 +1,412 @@
 import asyncio
+import base64
+import binascii
 import json
 import logging
-from typing import Optional, Callable
-from aiortc import RTCPeerConnection, RTCSessionDescription
-from ..utils.config import STUN_SERVERS
+import random
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING, Awaitable, Dict, List, Optional, Callable, Tuple, Union
+)
+from ..utils.config import (
+    STUN_SERVERS, MAX_PEER_CONNECTIONS, PEER_IDLE_TIMEOUT, IDLE_CHECK_INTERVAL,
+    KEY_SIZE, RECEIVE_DELIVERY_CHUNK,
+    MESSAGE_BATCH_WINDOW, MESSAGE_BATCH_MAX_SIZE, RECONNECT_ATTEMPTS,
+    RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY, RECONNECT_ATTEMPT_TIMEOUT,
+    RECONNECT_WAIT_TIMEOUT
+)
+from .filetransfer import FileTransferManager
+from .sendqueue import SendQueue
+from .mux import ChannelMux
+from .outbox import Outbox
+from .sync import HistorySync
+from . import metrics
+
+if TYPE_CHECKING:
+    from aiortc import RTCPeerConnection
+
+# aiortc (и av) импортируется при создании первого соединения: загрузка
+# занимает заметную часть запуска и не нужна до начала общения
 
 logger = logging.getLogger(__name__)
 
+MESSAGES = metrics.Counter(
+    "p2p_messages_total", "Сообщений чата отправлено и принято", ("direction",))
+_MESSAGES_SENT = MESSAGES.labels("out")
+_MESSAGES_RECEIVED = MESSAGES.labels("in")
+# Время от создания RTCPeerConnection до завершения этапа установления
+HANDSHAKE_SECONDS = metrics.Histogram(
+    "p2p_handshake_seconds", "Длительность этапов установления соединения", ("phase",))
+CONNECTION_STATES = metrics.Counter(
+    "p2p_connection_states_total", "Переходов соединений в состояние", ("state",))
+RECONNECTS = metrics.Counter(
+    "p2p_reconnects_total", "Восстановлений оборвавшихся соединений", ("result",))
+RECONNECT_SECONDS = metrics.Histogram(
+    "p2p_reconnect_seconds", "Длительность успешного восстановления соединения")
+
+
+def _forward(source: asyncio.Future, target: asyncio.Future) -> None:
+    """Передача результата source в target"""
+    def on_done(future: asyncio.Future) -> None:
+        if target.done():
+            return
+        if future.cancelled():
+            target.cancel()
+        elif future.exception() is not None:
+            target.set_exception(future.exception())
+        else:
+            target.set_result(None)
+
+    source.add_done_callback(on_done)
+
+
+def peer_key_from_id(peer_id: str) -> Optional[bytes]:
+    """Публичный ключ собеседника из его идентификатора (base64)"""
+    try:
+        key = base64.b64decode(peer_id, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return key if len(key) == KEY_SIZE else None
+
 
 class P2PConnection:
-    def __init__(self, crypto_manager):
-        self.pc: Optional[RTCPeerConnection] = None
+    def __init__(self, crypto_manager, peer_public_key: Optional[bytes] = None,
+                 batch_window: float = MESSAGE_BATCH_WINDOW,
+                 outbox: Optional[Outbox] = None,
+                 ice_servers: Optional[List[str]] = None):
+        self.pc: Optional["RTCPeerConnection"] = None
+        # Пустой список - только локальные кандидаты, без STUN
+        self.ice_servers = STUN_SERVERS if ice_servers is None else ice_servers
         self.data_channel = None
         self.crypto = crypto_manager
+        # С ключом собеседника сообщения передаются зашифрованными
+        # бинарными кадрами, без него - открытым текстом
+        self.peer_public_key = peer_public_key
         self._connected = False
+        self._closed = False
+        self.last_activity = time.monotonic()
         self.message_received = None
         self.connection_closed = None
+        # Доставка с подтверждениями; без нее строки передаются как есть
+        self.outbox = outbox
+
+        # Входящие сообщения, собираемые в пачку для расшифровки
+        self._rx_pending: List[Union[str, bytes]] = []
+        self._rx_flush_handle: Optional[asyncio.Handle] = None
+        self._rx_delivery: Optional[asyncio.Task] = None
+
+        # Пакетная отправка: сообщения, отправленные в течение окна,
+        # шифруются и уходят одним кадром (0 - выключено)
+        self.batch_window = batch_window
+        self._tx_pending: List[Tuple[str, asyncio.Future]] = []
+        self._tx_pending_size = 0
+        self._tx_flush_handle: Optional[asyncio.TimerHandle] = None
+
+        # Все исходящие данные проходят через очередь с учетом буфера SCTP
+        self.send_queue = SendQueue()
+
+        # Логические потоки соединения: chat, file, presence, sync
+        self.mux = ChannelMux(self.send_queue)
+        self.mux.register("chat", self._attach_channel)
+
+        # Файлы передаются по отдельному потоку "file"
+        self.files = FileTransferManager(
+            crypto_manager, self.mux, peer_public_key)
+        self.mux.register("file", self.files.attach)
+
+        # Согласование истории по потоку "sync" (подключается пулом)
+        self.history_sync: Optional[HistorySync] = None
+
+        # Восстановление после обрыва. renegotiate(offer) передает новое
+        # предложение собеседнику и возвращает его ответ; без него
+        # соединение ждет нового предложения от собеседника (handle_offer)
+        self.renegotiate: Optional[Callable[[str], Awaitable[str]]] = None
+        self._reconnecting = False
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._opened = asyncio.Event()
+        # Сообщения, отправленные во время восстановления, и кадры чата,
+        # не успевшие уйти в оборвавшийся канал
+        self._held: List[Tuple[str, asyncio.Future]] = []
+        self._requeued: List[Tuple[Union[str, bytes], asyncio.Future]] = []
 
     def set_callbacks(self, on_message, on_connection_closed):
-        """Установка функций обратного вызова"""
+        """Установка функций обратного вызова.
+
+        on_message(text, message_id) вызывается для каждого принятого
+        сообщения; message_id - id отправителя или None.
+        """
         self.message_received = on_message
         self.connection_closed = on_connection_closed
 
     async def create_connection(self) -> None:
-        """Создание нового P2P соединения"""
-        self.pc = RTCPeerConnection({
-            "iceServers": [{"urls": STUN_SERVERS}]
-        })
+        """Создание нового P2P соединения.
+
+        Повторный вызов при уже созданном соединении ничего не делает: пул
+        запускает создание заранее, а create_offer и handle_offer могут
+        выполниться раньше этой задачи.
+        """
+        if self.pc is not None:
+            return
+        from aiortc import RTCPeerConnection, RTCConfiguration, RTCIceServer
+        self.pc = pc = RTCPeerConnection(RTCConfiguration(
+            iceServers=[RTCIceServer(urls=self.ice_servers)] if self.ice_servers else []
+        ))
+        started = time.perf_counter()
 
-        @self.pc.on("datachannel")
+        def handshake_phase(phase: str) -> None:
+            HANDSHAKE_SECONDS.labels(phase).observe(time.perf_counter() - started)
+
+        @pc.on("icegatheringstatechange")
+        def on_icegatheringstatechange():
+            if pc.iceGatheringState == "complete":
+                handshake_phase("gathering")
+
+        @pc.on("iceconnectionstatechange")
+        def on_iceconnectionstatechange():
+            if pc.iceConnectionState == "completed":
+                handshake_phase("ice")
+
+        @pc.on("datachannel")
         def on_datachannel(channel):
-            self.data_channel = channel
-            self._connected = True
-
-            @channel.on("message")
-            def on_message(message):
-                if isinstance(message, str) and self.message_received:
-                    self.message_received(message)
-
-        @self.pc.on("connectionstatechange")
-        async def on_connectionstatechange():
-            if self.pc.connectionState == "failed":
-                await self.pc.close()
+            self.mux.handle_datachannel(channel)
+
+        @pc.on("connectionstatechange")
+        def on_connectionstatechange():
+            CONNECTION_STATES.labels(pc.connectionState).inc()
+            if pc is not self.pc:
+                # Событие соединения, уже замененного при восстановлении
+                return
+            if pc.connectionState == "connected":
+                handshake_phase("connected")
+            if pc.connectionState == "failed" and not self._closed \
+                    and self._reconnect_task is None:
+                self._reconnecting = True
                 self._connected = False
-                if self.connection_closed:
-                    self.connection_closed()
+                self._reconnect_task = asyncio.ensure_future(self._reconnect())
 
-    async def create_offer(self) -> str:
-        """Создание предложения для соединения"""
-        if not self.pc:
-            await self.create_connection()
+    async def _reconnect(self) -> None:
+        """Восстановление оборвавшегося соединения.
+
+        Неподтвержденные сообщения остаются в outbox, новые откладываются
+        до открытия канала. Если все попытки неудачны, соединение
+        закрывается с вызовом connection_closed.
+        """
+        started = time.perf_counter()
+        logger.info("Соединение оборвалось, восстановление")
+        try:
+            if self.renegotiate is not None:
+                recovered = await self._renegotiate_with_backoff()
+            else:
+                await self._restart()
+                recovered = await self._wait_opened(RECONNECT_WAIT_TIMEOUT)
+        finally:
+            self._reconnect_task = None
+
+        RECONNECTS.labels("ok" if recovered else "failed").inc()
+        if recovered:
+            RECONNECT_SECONDS.observe(time.perf_counter() - started)
+            logger.info(f"Соединение восстановлено за {time.perf_counter() - started:.2f} с")
+        elif not self._closed:
+            logger.warning("Не удалось восстановить соединение")
+            await self._fail()
+
+    async def _renegotiate_with_backoff(self) -> bool:
+        """Попытки согласовать новое соединение с растущей паузой между ними"""
+        for attempt in range(RECONNECT_ATTEMPTS):
+            if attempt:
+                delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+                # Случайная доля паузы, чтобы повторы разных пиров не совпадали
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            if self._closed:
+                return False
+            try:
+                await self._restart()
+                offer = await self.create_offer()
+                answer = await asyncio.wait_for(
+                    self.renegotiate(offer), RECONNECT_ATTEMPT_TIMEOUT)
+                await self.handle_answer(answer)
+                if await self._wait_opened(RECONNECT_ATTEMPT_TIMEOUT):
+                    return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Попытка восстановления {attempt + 1} не удалась: {e}")
+        return False
+
+    async def _wait_opened(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._opened.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _restart(self) -> None:
+        """Замена оборвавшегося RTCPeerConnection пустым.
+
+        aiortc не умеет перезапускать ICE на существующем соединении
+        (restartIce), а DTLS и SCTP после отказа не переиспользуются,
+        поэтому соединение согласуется заново. Очередь отправки, outbox
+        и обработчики потоков сохраняются.
+        """
+        self._reconnecting = True
+        self._connected = False
+        self._opened.clear()
+        if self.outbox is not None:
+            # Outbox досылает неподтвержденные сообщения после открытия канала
+            self.outbox.bind(None)
+        if self._tx_flush_handle is not None:
+            self._tx_flush_handle.cancel()
+            self._tx_flush_handle = None
+        self._held[:0] = self._tx_pending
+        self._tx_pending = []
+        self._tx_pending_size = 0
+
+        for name, pending in self.mux.clear().items():
+            if name == "chat" and self.outbox is None:
+                self._requeued.extend(pending)
+                continue
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(RuntimeError("Соединение прервано"))
+        self.data_channel = None
+        pc, self.pc = self.pc, None
+        if pc is not None:
+            await pc.close()
 
-        self.data_channel = self.pc.createDataChannel("chat")
+    async def _fail(self) -> None:
+        """Соединение потеряно окончательно"""
+        if self.pc:
+            await self.pc.close()
+        self._connected = False
+        self._closed = True
+        self._reconnecting = False
+        if self.outbox is not None:
+            self.outbox.bind(None)
+        self._drop_pending(RuntimeError("Соединение закрыто"))
+        if self.connection_closed:
+            self.connection_closed()
+
+    def _drop_pending(self, error: Exception) -> None:
+        """Отмена отложенных на время восстановления сообщений"""
+        pending = [future for _, future in self._held + self._requeued]
+        self._held.clear()
+        self._requeued.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def _attach_channel(self, channel) -> None:
+        """Подключение обработчиков к data channel"""
+        self.data_channel = channel
+
+        @channel.on("open")
+        def on_open():
+            self._on_open()
 
-        @self.data_channel.on("message")
+        @channel.on("message")
         def on_message(message):
-            if isinstance(message, str):
-                self.message_received(message)
+            self._on_channel_message(message)
+
+        if channel.readyState == "open":
+            self._on_open()
+
+    def _on_open(self) -> None:
+        """Канал сообщений открыт: досылаем неподтвержденные и отложенные сообщения"""
+        self._connected = True
+        self._reconnecting = False
+        self._opened.set()
+        requeued, self._requeued = self._requeued, []
+        for data, future in requeued:
+            _forward(self.mux.send("chat", data), future)
+        if self.outbox is not None:
+            self.outbox.bind(self.send_message)
+            self.outbox.resend_pending()
+        held, self._held = self._held, []
+        for message, future in held:
+            _forward(self.send_message(message), future)
+
+    def _on_channel_message(self, message: Union[str, bytes]) -> None:
+        """Обработка сообщения из data channel"""
+        self.last_activity = time.monotonic()
+        if isinstance(message, bytes) and self.peer_public_key is None:
+            logger.warning("Получен бинарный кадр без ключа собеседника")
+            return
+
+        self._rx_pending.append(message)
+        self._schedule_receive_flush()
+
+    def _schedule_receive_flush(self) -> None:
+        """Доставка накопленных кадров без задержки, если пачка не в работе.
+
+        Пока предыдущая пачка расшифровывается, новые кадры копятся и
+        уходят одной пачкой после нее, поэтому одиночное сообщение не ждет,
+        а поток сообщений расшифровывается пачками.
+        """
+        if self._rx_pending and self._rx_flush_handle is None and \
+                (self._rx_delivery is None or self._rx_delivery.done()):
+            self._rx_flush_handle = asyncio.get_event_loop().call_soon(
+                self._flush_received)
+
+    def _flush_received(self) -> None:
+        """Передача накопленной пачки на расшифровку"""
+        self._rx_flush_handle = None
+        batch, self._rx_pending = self._rx_pending, []
+        self._rx_delivery = asyncio.ensure_future(
+            self._deliver_batch(batch, self._rx_delivery))
+        self._rx_delivery.add_done_callback(
+            lambda _: self._schedule_receive_flush())
+
+    async def _deliver_batch(self, batch: List[Union[str, bytes]],
+                             previous: Optional[asyncio.Task]) -> None:
+        """Расшифровка пачки вне цикла событий и доставка в исходном порядке"""
+        frames = [m for m in batch if isinstance(m, bytes)]
+        decrypted = iter(())
+        if frames:
+            decrypted = iter(await asyncio.get_event_loop().run_in_executor(
+                None, self.crypto.decrypt_messages, frames, self.peer_public_key))
+
+        # Пачки расшифровываются параллельно, но доставляются по порядку
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        delivered = 0
+        for message in batch:
+            # Один кадр может содержать несколько сообщений
+            texts = next(decrypted) if isinstance(message, bytes) else [message]
+            for text in texts:
+                try:
+                    self._deliver(text)
+                except Exception as e:
+                    # Ошибка обработчика не должна терять остаток пачки
+                    logger.error(f"Ошибка обработки входящего сообщения: {e}")
+                delivered += 1
+                if delivered % RECEIVE_DELIVERY_CHUNK == 0:
+                    # Даем GUI обработать события между частями большой пачки
+                    await asyncio.sleep(0)
+
+    def _deliver(self, text: str) -> None:
+        """Передача сообщения получателю и подтверждение после его обработки"""
+        message_id = None
+        if self.outbox is not None:
+            parsed = self.outbox.receive(text)
+            if parsed is None:
+                return
+            text, message_id = parsed
+        _MESSAGES_RECEIVED.inc()
+        if not self.message_received:
+            # Без получателя сообщение не подтверждается и придет повторно
+            return
+        self.message_received(text, message_id)
+        if message_id is not None:
+            self.outbox.acknowledge(message_id)
+
+    async def create_offer(self) -> str:
+        """Создание предложения для соединения"""
+        await self.create_connection()
+
+        self.mux.create_channels(self.pc)
 
         offer = await self.pc.createOffer()
         await self.pc.setLocalDescription(offer)
@@ -71,6 +421,7 @@ class P2PConnection:
         if not self.pc:
             raise RuntimeError("Соединение не создано")
 
+        from aiortc import RTCSessionDescription
         answer_dict = json.loads(answer)
         answer_desc = RTCSessionDescription(
             sdp=answer_dict["sdp"],
@@ -80,9 +431,13 @@ class P2PConnection:
 
     async def handle_offer(self, offer: str) -> str:
         """Обработка входящего предложения"""
-        if not self.pc:
-            await self.create_connection()
+        if self.pc is not None and self.pc.remoteDescription is not None:
+            # Новое предложение для согласованного соединения: собеседник
+            # восстанавливает его после обрыва, замеченного им раньше нас
+            await self._restart()
+        await self.create_connection()
 
+        from aiortc import RTCSessionDescription
         offer_dict = json.loads(offer)
         offer_desc = RTCSessionDescription(
             sdp=offer_dict["sdp"],
@@ -98,22 +453,284 @@ class P2PConnection:
             "type": self.pc.localDescription.type
         })
 
-    async def send_message(self, message: str) -> None:
-        """Отправка сообщения через data channel"""
+    def send_message(self, message: str) -> asyncio.Future:
+        """Отправка сообщения через data channel.
+
+        Возвращает future, который завершается, когда сообщение ушло
+        из буфера канала в транспорт.
+        """
+        if self._reconnecting:
+            # Соединение восстанавливается: сообщение уйдет после открытия канала
+            future = asyncio.get_event_loop().create_future()
+            self._held.append((message, future))
+            return future
         if not self.data_channel or not self._connected:
             raise RuntimeError("Data channel не создан или не подключен")
+        self.last_activity = time.monotonic()
+        _MESSAGES_SENT.inc()
 
-        self.data_channel.send(message)
+        if self.peer_public_key is None:
+            return self.mux.send("chat", message)
+        if not self.batch_window:
+            # Бинарный кадр уходит в канал как binary-сообщение
+            return self.mux.send(
+                "chat", self.crypto.encrypt_message(message, self.peer_public_key))
+
+        future = asyncio.get_event_loop().create_future()
+        self._tx_pending.append((message, future))
+        self._tx_pending_size += len(message.encode())
+        if self._tx_pending_size >= MESSAGE_BATCH_MAX_SIZE:
+            self._flush_batch()
+        elif self._tx_flush_handle is None:
+            self._tx_flush_handle = asyncio.get_event_loop().call_later(
+                self.batch_window, self._flush_batch)
+        return future
+
+    def _flush_batch(self) -> None:
+        """Шифрование накопленных сообщений одним кадром и постановка в очередь"""
+        if self._tx_flush_handle is not None:
+            self._tx_flush_handle.cancel()
+            self._tx_flush_handle = None
+        pending, self._tx_pending = self._tx_pending, []
+        self._tx_pending_size = 0
+        if not pending:
+            return
+
+        futures = [future for _, future in pending]
+        try:
+            frame = self.crypto.encrypt_messages(
+                [message for message, _ in pending], self.peer_public_key)
+            sent = self.mux.send("chat", frame)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        def on_sent(sent_future: asyncio.Future) -> None:
+            error = None if sent_future.cancelled() else sent_future.exception()
+            for future in futures:
+                if future.done():
+                    continue
+                if sent_future.cancelled():
+                    future.cancel()
+                elif error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+        sent.add_done_callback(on_sent)
+
+    async def send_file(self, path: Path) -> None:
+        """Отправка файла по каналу передачи файлов"""
+        if not self._connected:
+            raise RuntimeError("Data channel не создан или не подключен")
+        await self.files.send_file(path)
+        self.last_activity = time.monotonic()
 
     async def close(self) -> None:
         """Закрытие соединения"""
+        self._closed = True
+        self._reconnecting = False
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        self._drop_pending(RuntimeError("Соединение закрыто"))
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.data_channel is not None:
+            self._flush_batch()
+        self.files.close()
+        self.send_queue.close()
+        if self._rx_flush_handle is not None:
+            self._rx_flush_handle.cancel()
+            self._flush_received()
         if self.pc:
             await self.pc.close()
             self._connected = False
             self.data_channel = None
+            self.mux.clear()
             self.pc = None
 
+    @property
+    def is_reconnecting(self) -> bool:
+        """Соединение оборвалось и восстанавливается"""
+        return self._reconnecting or self._reconnect_task is not None
+
+    @property
+    def is_closed(self) -> bool:
+        """Соединение закрыто или оборвалось и не может быть переиспользовано"""
+        return self._closed
+
     @property
     def is_connected(self) -> bool:
         """Проверка состояния соединения"""
         return self._connected and self.pc and self.pc.connectionState == "connected"
+
+
+class ConnectionManager:
+    """Пул живых P2P соединений по контактам.
+
+    Повторное открытие чата возвращает уже установленное соединение без
+    нового ICE/DTLS рукопожатия. Неиспользуемые соединения закрываются по
+    таймауту простоя и при превышении лимита (самые давно использованные).
+
+    С хранилищем пул сам сохраняет и подтверждает принятые сообщения и
+    файлы всех своих соединений, в том числе контактов, чей чат сейчас не
+    открыт; интерфейс только показывает их через message_stored.
+    """
+
+    def __init__(self, crypto_manager, storage=None,
+                 max_connections: int = MAX_PEER_CONNECTIONS,
+                 idle_timeout: float = PEER_IDLE_TIMEOUT):
+        self.crypto = crypto_manager
+        self.storage = storage
+        # Очереди доставки переживают переподключения контакта
+        self._outboxes: Dict[str, Outbox] = {}
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        # Порядок - от давно использованных к недавним
+        self._connections: "OrderedDict[str, P2PConnection]" = OrderedDict()
+        self._users: Dict[str, int] = {}
+        self._sweep_handle: Optional[asyncio.TimerHandle] = None
+        # Уведомления о событиях соединений: (peer_id, сохраненное сообщение),
+        # (peer_id, путь, сохраненное сообщение) и (peer_id)
+        self.message_stored: Optional[Callable[[str, Dict], None]] = None
+        self.file_received: Optional[Callable[[str, Path, Dict], None]] = None
+        self.connection_closed: Optional[Callable[[str], None]] = None
+
+    def acquire(self, peer_id: str) -> P2PConnection:
+        """Получение соединения с контактом (существующего или нового)"""
+        connection = self._connections.get(peer_id)
+        if connection is not None and connection.is_closed:
+            self._connections.pop(peer_id)
+            connection = None
+
+        if connection is None:
+            outbox = self.outbox(peer_id)
+            connection = P2PConnection(
+                self.crypto, peer_key_from_id(peer_id), outbox=outbox)
+            if self.storage is not None:
+                if connection.peer_public_key is not None:
+                    connection.history_sync = HistorySync(
+                        self.storage, peer_id, connection.mux,
+                        self.crypto, connection.peer_public_key, outbox)
+                connection.set_callbacks(
+                    lambda text, message_id: self._store_message(peer_id, text, message_id),
+                    lambda: self._on_closed(peer_id))
+                connection.files.file_received = \
+                    lambda path: self._store_file(peer_id, path)
+            self._connections[peer_id] = connection
+            asyncio.ensure_future(connection.create_connection())
+            logger.info(f"Новое соединение с {peer_id[:10]}...")
+        else:
+            self._connections.move_to_end(peer_id)
+            logger.info(f"Повторное использование соединения с {peer_id[:10]}...")
+
+        self._users[peer_id] = self._users.get(peer_id, 0) + 1
+        connection.last_activity = time.monotonic()
+        self._evict_over_limit()
+        self._schedule_sweep()
+        return connection
+
+    def _store_message(self, peer_id: str, text: str, message_id: Optional[str]) -> None:
+        """Сохранение принятого сообщения; после возврата оно подтверждается"""
+        data = {"sender": peer_id, "text": text}
+        if message_id is not None:
+            # id отправителя: обе стороны знают сообщение под одним id
+            data["id"] = message_id
+        stored = self.storage.add_message(peer_id, data)
+        if self.message_stored:
+            self.message_stored(peer_id, stored)
+
+    def _store_file(self, peer_id: str, path: Path) -> None:
+        """Запись о полностью принятом файле в историю чата"""
+        stored = self.storage.add_message(peer_id, {
+            "sender": peer_id, "text": f"Файл: {path.name} (сохранен в {path.parent})"})
+        if self.file_received:
+            self.file_received(peer_id, path, stored)
+
+    def _on_closed(self, peer_id: str) -> None:
+        if self.connection_closed:
+            self.connection_closed(peer_id)
+
+    def outbox(self, peer_id: str) -> Optional[Outbox]:
+        """Очередь доставки контакта (None без хранилища)"""
+        if self.storage is None:
+            return None
+        outbox = self._outboxes.get(peer_id)
+        if outbox is None:
+            outbox = self._outboxes[peer_id] = Outbox(self.storage, peer_id)
+        return outbox
+
+    def release(self, peer_id: str) -> None:
+        """Соединение больше не используется открытым чатом"""
+        users = self._users.get(peer_id, 0) - 1
+        if users > 0:
+            self._users[peer_id] = users
+        else:
+            self._users.pop(peer_id, None)
+        connection = self._connections.get(peer_id)
+        if connection is not None:
+            connection.last_activity = time.monotonic()
+
+    def get(self, peer_id: str) -> Optional[P2PConnection]:
+        """Соединение из пула без изменения его использования"""
+        return self._connections.get(peer_id)
+
+    def __contains__(self, peer_id: str) -> bool:
+        return peer_id in self._connections
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def _evict_over_limit(self) -> None:
+        """Закрытие давно использованных соединений сверх лимита"""
+        excess = len(self._connections) - self.max_connections
+        if excess <= 0:
+            return
+        for peer_id in list(self._connections):
+            if excess <= 0:
+                break
+            if self._users.get(peer_id):
+                continue
+            self._discard(peer_id)
+            excess -= 1
+        if excess > 0:
+            logger.warning(
+                f"Лимит соединений превышен: все {len(self._connections)} используются")
+
+    def _discard(self, peer_id: str) -> None:
+        connection = self._connections.pop(peer_id)
+        self._users.pop(peer_id, None)
+        asyncio.ensure_future(connection.close())
+        logger.info(f"Соединение с {peer_id[:10]}... закрыто пулом")
+
+    def _schedule_sweep(self) -> None:
+        if self._sweep_handle is None and self._connections:
+            self._sweep_handle = asyncio.get_event_loop().call_later(
+                IDLE_CHECK_INTERVAL, self._sweep)
+
+    def _sweep(self) -> None:
+        """Закрытие соединений, простаивающих дольше таймаута"""
+        self._sweep_handle = None
+        now = time.monotonic()
+        for peer_id, connection in list(self._connections.items()):
+            if connection.is_closed:
+                self._connections.pop(peer_id)
+                self._users.pop(peer_id, None)
+            elif not self._users.get(peer_id) and \
+                    now - connection.last_activity > self.idle_timeout:
+                self._discard(peer_id)
+        self._schedule_sweep()
+
+    async def close_all(self) -> None:
+        """Закрытие всех соединений пула"""
+        if self._sweep_handle is not None:
+            self._sweep_handle.cancel()
+            self._sweep_handle = None
+        connections = list(self._connections.values())
+        self._connections.clear()
+        self._users.clear()
+        await asyncio.gather(*(c.close() for c in connections),
+                             return_exceptions=True)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+from ..utils.config import (
+    OUTBOX_ACK_DELAY, OUTBOX_ACK_BATCH, OUTBOX_DEDUP_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Доставка сообщений контакту с подтверждениями.
+
+    Исходящее сообщение сохраняется в хранилище до подтверждения и
+    отправляется, если соединение открыто. При восстановлении соединения
+    все неподтвержденные сообщения отправляются подряд, не дожидаясь
+    подтверждения каждого. Получатель собирает id принятых сообщений
+    и подтверждает их пачкой, отправитель удаляет подтвержденные
+    сообщения из хранилища одной операцией.
+
+    Формат в потоке "chat" (JSON):
+        {"type": "msg", "id": ..., "text": ...}
+        {"type": "ack", "ids": [...]}
+    Строки не в этом формате считаются обычным текстом без подтверждения.
+    """
+
+    def __init__(self, storage, peer_id: str):
+        self.storage = storage
+        self.peer_id = peer_id
+        self._send: Optional[Callable[[str], asyncio.Future]] = None
+        self._acks: List[str] = []
+        self._ack_handle: Optional[asyncio.TimerHandle] = None
+        # id недавно принятых сообщений для отсева повторных отправок
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_loaded = False
+
+    def bind(self, send: Optional[Callable[[str], asyncio.Future]]) -> None:
+        """Подключение функции отправки открытого соединения (None - отключено)"""
+        self._send = send
+        if send is None:
+            if self._ack_handle is not None:
+                self._ack_handle.cancel()
+                self._ack_handle = None
+            self._acks.clear()
+
+    def _transmit(self, envelope: dict) -> None:
+        if self._send is None:
+            return
+        try:
+            future = self._send(json.dumps(envelope, ensure_ascii=False))
+        except RuntimeError as e:
+            logger.debug(f"Отправка отложена: {e}")
+            return
+        # Ошибка отправки не теряет сообщение: оно остается в хранилище
+        future.add_done_callback(
+            lambda f: f.cancelled() or f.exception())
+
+    def send(self, message_id: str, text: str) -> None:
+        """Сохранение и отправка сообщения"""
+        self.storage.outbox_add(self.peer_id, message_id, text)
+        self._transmit({"type": "msg", "id": message_id, "text": text})
+
+    def resend_pending(self) -> int:
+        """Повторная отправка всех неподтвержденных сообщений"""
+        pending = self.storage.outbox_pending(self.peer_id)
+        for entry in pending:
+            self._transmit({"type": "msg", "id": entry["id"], "text": entry["text"]})
+        if pending:
+            logger.info(
+                f"Повторно отправлено сообщений {self.peer_id[:10]}...: {len(pending)}")
+        return len(pending)
+
+    def receive(self, raw: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Разбор входящей строки.
+
+        Возвращает (текст, id сообщения) для показа пользователю или None,
+        если это подтверждение или повтор уже принятого сообщения. Принятое
+        сообщение подтверждается через acknowledge() после его сохранения.
+        """
+        try:
+            envelope = json.loads(raw)
+        except json.JSONDecodeError:
+            return raw, None
+        if not isinstance(envelope, dict):
+            return raw, None
+
+        kind = envelope.get("type")
+        if kind == "ack":
+            ids = envelope.get("ids") or []
+            if ids:
+                self.storage.outbox_remove(self.peer_id, ids)
+            return None
+        if kind != "msg" or "id" not in envelope:
+            return raw, None
+
+        message_id = envelope["id"]
+        if self._is_duplicate(message_id):
+            # Подтверждение потерялось - повторяем его
+            self._queue_ack(message_id)
+            return None
+        return envelope.get("text", ""), message_id
+
+    def acknowledge(self, message_id: str) -> None:
+        """Подтверждение сохраненного сообщения"""
+        self._seen[message_id] = None
+        if len(self._seen) > OUTBOX_DEDUP_SIZE:
+            self._seen.popitem(last=False)
+        self._queue_ack(message_id)
+
+    def _is_duplicate(self, message_id: str) -> bool:
+        """Проверка, что сообщение с таким id уже принято"""
+        if not self._seen_loaded:
+            # После перезапуска повторы отсеиваются по последним сообщениям истории
+            self._seen_loaded = True
+            for message in self.storage.load_chat_history(
+                    self.peer_id, limit=OUTBOX_DEDUP_SIZE):
+                if "id" in message and not message.get("is_self"):
+                    self._seen[message["id"]] = None
+        if message_id in self._seen:
+            self._seen.move_to_end(message_id)
+            return True
+        return False
+
+    def _queue_ack(self, message_id: str) -> None:
+        self._acks.append(message_id)
+        if len(self._acks) >= OUTBOX_ACK_BATCH:
+            self._flush_acks()
+        elif self._ack_handle is None:
+            self._ack_handle = asyncio.get_event_loop().call_later(
+                OUTBOX_ACK_DELAY, self._flush_acks)
+
+    def _flush_acks(self) -> None:
+        """Отправка накопленных подтверждений одним сообщением"""
+        if self._ack_handle is not None:
+            self._ack_handle.cancel()
+            self._ack_handle = None
+        acks, self._acks = self._acks, []
+        if acks:
+            self._transmit({"type": "ack", "ids": acks})
+
+    def close(self) -> None:
+        """Отправка оставшихся подтверждений и отключение от соединения"""
+        self._flush_acks()
+        self.bind(None)
@@ -0,0 +1,114 @@
+import re
+import sqlite3
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from .expiry import message_expires_at
+
+logger = logging.getLogger(__name__)
+
+# Отдельная база с полнотекстовым индексом (FTS5). Строка индекса связана
+# с сообщением через таблицу indexed: (peer_id, seq) -> rowid, поэтому
+# удаление отдельных сообщений не требует просмотра всего индекса.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed (
+    rowid INTEGER PRIMARY KEY,
+    peer_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT,
+    expires_at REAL,
+    UNIQUE (peer_id, seq)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+    text, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+SQL_INSERT_INDEXED = (
+    "INSERT OR REPLACE INTO indexed (peer_id, seq, timestamp, expires_at) "
+    "VALUES (?, ?, ?, ?)")
+SQL_INSERT_FTS = "INSERT INTO message_fts (rowid, text) VALUES (?, ?)"
+SQL_FIND_ROWID = "SELECT rowid FROM indexed WHERE peer_id = ? AND seq = ?"
+SQL_CHAT_ROWIDS = "SELECT rowid FROM indexed WHERE peer_id = ?"
+SQL_DELETE_INDEXED = "DELETE FROM indexed WHERE rowid = ?"
+SQL_DELETE_FTS = "DELETE FROM message_fts WHERE rowid = ?"
+SQL_SEARCH = (
+    "SELECT i.peer_id, i.seq, i.timestamp, "
+    "snippet(message_fts, 0, '[', ']', '...', 12) "
+    "FROM message_fts JOIN indexed i ON i.rowid = message_fts.rowid "
+    "WHERE message_fts MATCH ? AND (i.expires_at IS NULL OR i.expires_at > ?) "
+    "ORDER BY bm25(message_fts) LIMIT ?")
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_query(text: str) -> str:
+    """Запрос FTS5: все слова обязательны и ищутся по префиксу"""
+    return " ".join(f'"{term}"*' for term in TOKEN_RE.findall(text))
+
+
+class SearchIndex:
+    """Полнотекстовый индекс сообщений всех чатов"""
+
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        self.is_new = not db_file.exists()
+        # Доступ из нескольких потоков сериализует блокировка Storage
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(indexed)")]
+        if "expires_at" not in columns:
+            # Индекс старого формата без сроков жизни строится заново
+            self.conn.executescript(
+                "DROP TABLE indexed; DROP TABLE message_fts;" + SCHEMA)
+            self.is_new = True
+
+    def _add(self, peer_id: str, message: Dict) -> None:
+        text = message.get("text")
+        if not text:
+            return
+        rowid = self.conn.execute(SQL_FIND_ROWID, (peer_id, message["seq"])).fetchone()
+        if rowid is not None:
+            self.conn.execute(SQL_DELETE_FTS, rowid)
+        cursor = self.conn.execute(SQL_INSERT_INDEXED, (
+            peer_id, message["seq"], message.get("timestamp"), message_expires_at(message)))
+        self.conn.execute(SQL_INSERT_FTS, (cursor.lastrowid, text))
+
+    def add(self, peer_id: str, messages: Iterable[Dict]) -> None:
+        """Индексация сохраненных сообщений чата"""
+        with self.conn:
+            for message in messages:
+                self._add(peer_id, message)
+
+    def remove(self, removed: Iterable[Tuple[str, Dict]]) -> None:
+        """Удаление сообщений (peer_id, сообщение) из индекса"""
+        with self.conn:
+            for peer_id, message in removed:
+                row = self.conn.execute(
+                    SQL_FIND_ROWID, (peer_id, message["seq"])).fetchone()
+                if row is not None:
+                    self.conn.execute(SQL_DELETE_FTS, row)
+                    self.conn.execute(SQL_DELETE_INDEXED, row)
+
+    def delete_chat(self, peer_id: str) -> None:
+        """Удаление всех сообщений чата из индекса"""
+        with self.conn:
+            rows = self.conn.execute(SQL_CHAT_ROWIDS, (peer_id,)).fetchall()
+            self.conn.executemany(SQL_DELETE_FTS, rows)
+            self.conn.executemany(SQL_DELETE_INDEXED, rows)
+
+    def search(self, text: str, limit: int) -> List[Dict]:
+        """Поиск неистекших сообщений, лучшие совпадения первыми"""
+        query = build_query(text)
+        if not query:
+            return []
+        return [{"peer_id": peer_id, "seq": seq, "timestamp": timestamp, "snippet": snippet}
+                for peer_id, seq, timestamp, snippet in
+                self.conn.execute(SQL_SEARCH, (query, time.time(), limit))]
+
+    def close(self) -> None:
+        """Закрытие базы индекса"""
+        self.conn.close()
@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import weakref
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Union
+from ..utils.config import SEND_HIGH_WATERMARK, SEND_LOW_WATERMARK
+from . import metrics
+
+# Приоритеты исходящих данных: меньшее значение уходит раньше
+PRIORITY_CHAT = 0
+PRIORITY_BULK = 1
+
+# Очереди живых соединений, для метрик буфера
+_queues: "weakref.WeakSet[SendQueue]" = weakref.WeakSet()
+
+WIRE_BYTES = metrics.Counter(
+    "p2p_wire_bytes_total", "Байт передано через data channel", ("direction", "stream"))
+BACKPRESSURE_WAITS = metrics.Counter(
+    "p2p_send_backpressure_total", "Ожиданий опустошения буфера SCTP")
+
+
+def _buffered_amount() -> Dict[Tuple[str], int]:
+    totals: Dict[Tuple[str], int] = {}
+    for queue in list(_queues):
+        for channel in queue._sent:
+            key = (channel.label,)
+            totals[key] = totals.get(key, 0) + channel.bufferedAmount
+    return totals
+
+
+metrics.Callback("p2p_buffered_amount_bytes", "bufferedAmount каналов по потокам",
+                 _buffered_amount, ("stream",))
+metrics.Callback("p2p_send_queue_length", "Данных в очередях отправки",
+                 lambda: sum(len(queue) for queue in list(_queues)))
+
+
+class SendQueue:
+    """Очередь исходящих данных соединения с учетом буфера SCTP.
+
+    Данные передаются в data channel, пока его bufferedAmount не выше
+    верхней границы; дальше отправка ждет события bufferedamountlow
+    (нижняя граница). Из очереди первыми уходят данные с меньшим
+    приоритетом, при равном - в порядке добавления. Future, возвращаемый
+    put(), завершается, когда данные ушли из буфера канала в транспорт.
+    """
+
+    def __init__(self, high_watermark: int = SEND_HIGH_WATERMARK,
+                 low_watermark: int = SEND_LOW_WATERMARK):
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self._queue: List[Tuple[int, int, object, Union[str, bytes], asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._buffer_low = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # По каналу: всего передано байт и ожидающие сброса (конец данных, future)
+        self._sent: Dict[object, int] = {}
+        self._flushing: Dict[object, Deque[Tuple[int, asyncio.Future]]] = {}
+        _queues.add(self)
+
+    def watch(self, channel) -> None:
+        """Подключение data channel к очереди"""
+        channel.bufferedAmountLowThreshold = self.low_watermark
+        self._sent[channel] = 0
+        self._flushing[channel] = deque()
+
+        @channel.on("bufferedamountlow")
+        def on_buffered_amount_low():
+            if channel in self._flushing:
+                self._resolve_flushed(channel)
+            self._buffer_low.set()
+
+    def detach(self, channel) -> List[Tuple[Union[str, bytes], asyncio.Future]]:
+        """Отключение канала оборвавшегося соединения.
+
+        Возвращает еще не переданные в канал данные с их future для
+        повторной отправки. Future данных, уже ушедших в буфер канала,
+        завершаются ошибкой: их доставка неизвестна.
+        """
+        taken = [(data, future) for _, _, ch, data, future in self._queue
+                 if ch is channel and not future.done()]
+        if taken:
+            self._queue = [entry for entry in self._queue if entry[2] is not channel]
+            heapq.heapify(self._queue)
+        self._sent.pop(channel, None)
+        for _, future in self._flushing.pop(channel, ()):
+            if not future.done():
+                future.set_exception(RuntimeError("Соединение прервано"))
+        # Отправка могла ждать опустошения буфера этого канала
+        self._buffer_low.set()
+        return taken
+
+    def put(self, channel, data: Union[str, bytes],
+            priority: int = PRIORITY_CHAT) -> asyncio.Future:
+        """Постановка данных в очередь отправки"""
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), channel, data, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return future
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    async def _run(self) -> None:
+        """Передача данных из очереди в каналы с учетом их буферов"""
+        while self._queue:
+            _, _, channel, data, future = self._queue[0]
+            if future.cancelled():
+                heapq.heappop(self._queue)
+                continue
+            if channel.readyState != "open":
+                heapq.heappop(self._queue)
+                future.set_exception(RuntimeError("Data channel закрыт"))
+                continue
+            if channel.bufferedAmount > self.high_watermark:
+                channel.bufferedAmountLowThreshold = self.low_watermark
+                self._buffer_low.clear()
+                BACKPRESSURE_WAITS.inc()
+                await self._buffer_low.wait()
+                continue
+
+            heapq.heappop(self._queue)
+            try:
+                channel.send(data)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            size = len(data.encode() if isinstance(data, str) else data)
+            self._sent[channel] += size
+            if metrics.enabled():
+                WIRE_BYTES.labels("out", channel.label).inc(size)
+            self._flushing[channel].append((self._sent[channel], future))
+            self._resolve_flushed(channel)
+
+        # Очередь пуста: оставшиеся future завершатся, когда буфер опустеет
+        for channel, flushing in self._flushing.items():
+            if flushing:
+                channel.bufferedAmountLowThreshold = 0
+                self._resolve_flushed(channel)
+
+    def _resolve_flushed(self, channel) -> None:
+        """Завершение future данных, уже ушедших из буфера канала"""
+        flushing = self._flushing[channel]
+        flushed = self._sent[channel] - channel.bufferedAmount
+        while flushing and flushing[0][0] <= flushed:
+            _, future = flushing.popleft()
+            if not future.done():
+                future.set_result(None)
+        if not flushing and not self._queue:
+            channel.bufferedAmountLowThreshold = self.low_watermark
+
+    def close(self) -> None:
+        """Отмена всех неотправленных и несброшенных данных"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        pending = [entry[4] for entry in self._queue]
+        for flushing in self._flushing.values():
+            pending.extend(future for _, future in flushing)
+            flushing.clear()
+        self._queue.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Соединение закрыто"))
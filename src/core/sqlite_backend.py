@@ -0,0 +1,232 @@
+import json
+import sqlite3
+import logging
+from pathlib import Path
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from .expiry import message_expires_at
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contacts (
+    public_key TEXT PRIMARY KEY,
+    added_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    peer_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    expires_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_peer_ts ON messages (peer_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_peer_seq ON messages (peer_id, seq);
+CREATE INDEX IF NOT EXISTS idx_messages_expires ON messages (expires_at)
+    WHERE expires_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    peer_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_peer ON outbox (peer_id, seq);
+"""
+
+# Запросы горячих путей. Текст запросов неизменен, поэтому sqlite3
+# компилирует каждый один раз и дальше берёт из кэша подготовленных выражений
+SQL_GET_SETTING = "SELECT value FROM settings WHERE key = ?"
+SQL_SAVE_SETTING = (
+    "INSERT INTO settings (key, value) VALUES (?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET value = excluded.value")
+SQL_GET_CONTACTS = "SELECT public_key, added_at FROM contacts ORDER BY rowid"
+SQL_ADD_CONTACT = "INSERT OR IGNORE INTO contacts (public_key, added_at) VALUES (?, ?)"
+SQL_DELETE_CONTACT = "DELETE FROM contacts WHERE public_key = ?"
+SQL_LOAD_MESSAGES = (
+    "SELECT seq, data FROM messages WHERE peer_id = ? "
+    "AND (expires_at IS NULL OR expires_at > ?) ORDER BY seq")
+SQL_LOAD_PAGE = (
+    "SELECT seq, data FROM messages WHERE peer_id = ? AND seq < ? "
+    "AND (expires_at IS NULL OR expires_at > ?) ORDER BY seq DESC LIMIT ?")
+SQL_INSERT_MESSAGE = (
+    "INSERT INTO messages (peer_id, timestamp, expires_at, data) VALUES (?, ?, ?, ?)")
+SQL_DELETE_CHAT = "DELETE FROM messages WHERE peer_id = ?"
+SQL_LIST_CHATS = "SELECT DISTINCT peer_id FROM messages ORDER BY peer_id"
+SQL_NEXT_EXPIRY = "SELECT MIN(expires_at) FROM messages WHERE expires_at IS NOT NULL"
+SQL_SELECT_EXPIRED = (
+    "SELECT seq, peer_id, data FROM messages "
+    "WHERE expires_at IS NOT NULL AND expires_at <= ? ORDER BY expires_at LIMIT ?")
+SQL_DELETE_SEQ = "DELETE FROM messages WHERE seq = ?"
+SQL_OUTBOX_ADD = "INSERT OR IGNORE INTO outbox (id, peer_id, data) VALUES (?, ?, ?)"
+SQL_OUTBOX_PENDING = "SELECT data FROM outbox WHERE peer_id = ? ORDER BY seq"
+SQL_OUTBOX_REMOVE = "DELETE FROM outbox WHERE peer_id = ? AND id = ?"
+
+MAX_SEQ = 2 ** 63 - 1
+
+
+class SQLiteBackend:
+    """Хранение настроек, контактов и истории чатов в одной базе SQLite"""
+
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        # Доступ из нескольких потоков сериализует блокировка Storage
+        self.conn = sqlite3.connect(
+            str(db_file), cached_statements=64, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        logger.info(f"Открыта база данных: {db_file}")
+
+    def get_setting(self, key: str, default: Any = None) -> Any:
+        """Получение значения настройки"""
+        row = self.conn.execute(SQL_GET_SETTING, (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def save_setting(self, key: str, value: Any) -> None:
+        """Сохранение значения настройки"""
+        with self.conn:
+            self.conn.execute(SQL_SAVE_SETTING, (key, json.dumps(value)))
+
+    # Контакты в базе меняются только через этот бэкенд
+    contacts_generation = 0
+
+    def get_contacts(self) -> List[Dict]:
+        """Получение списка контактов"""
+        return [{"public_key": public_key, "added_at": added_at}
+                for public_key, added_at in self.conn.execute(SQL_GET_CONTACTS)]
+
+    def add_contact(self, contact: Dict) -> bool:
+        """Добавление контакта, False если такой ключ уже есть"""
+        with self.conn:
+            cursor = self.conn.execute(
+                SQL_ADD_CONTACT, (contact["public_key"], contact["added_at"]))
+        return cursor.rowcount > 0
+
+    def delete_contact(self, public_key: str) -> None:
+        """Удаление контакта по публичному ключу"""
+        with self.conn:
+            self.conn.execute(SQL_DELETE_CONTACT, (public_key,))
+
+    def load_messages(self, peer_id: str) -> List[Dict]:
+        """Загрузка неистекших сообщений чата"""
+        rows = self.conn.execute(SQL_LOAD_MESSAGES, (peer_id, time.time()))
+        return [{**json.loads(data), "seq": seq} for seq, data in rows]
+
+    def load_page(self, peer_id: str, before: Optional[int],
+                  limit: Optional[int]) -> List[Dict]:
+        """Загрузка страницы сообщений, предшествующих курсору before"""
+        rows = self.conn.execute(SQL_LOAD_PAGE, (
+            peer_id,
+            before if before is not None else MAX_SEQ,
+            time.time(),
+            -1 if limit is None else limit
+        )).fetchall()
+        return [{**json.loads(data), "seq": seq} for seq, data in reversed(rows)]
+
+    def _insert(self, peer_id: str, message: Dict) -> Dict:
+        message = {k: v for k, v in message.items() if k != "seq"}
+        cursor = self.conn.execute(SQL_INSERT_MESSAGE, (
+            peer_id,
+            message.get("timestamp") or datetime.now().isoformat(),
+            message_expires_at(message),
+            json.dumps(message, ensure_ascii=False)
+        ))
+        return {**message, "seq": cursor.lastrowid}
+
+    def append_message(self, peer_id: str, message: Dict) -> Dict:
+        """Добавление сообщения в конец истории"""
+        with self.conn:
+            return self._insert(peer_id, message)
+
+    def replace_messages(self, peer_id: str, messages: List[Dict]) -> None:
+        """Полная замена истории чата"""
+        with self.conn:
+            self.conn.execute(SQL_DELETE_CHAT, (peer_id,))
+            for message in messages:
+                self._insert(peer_id, message)
+
+    def list_chats(self) -> List[str]:
+        """Получение списка всех чатов"""
+        return [row[0] for row in self.conn.execute(SQL_LIST_CHATS)]
+
+    def delete_chat(self, peer_id: str) -> None:
+        """Удаление чата"""
+        with self.conn:
+            self.conn.execute(SQL_DELETE_CHAT, (peer_id,))
+
+    def next_expiry(self) -> Optional[float]:
+        """Ближайший момент истечения сообщения"""
+        return self.conn.execute(SQL_NEXT_EXPIRY).fetchone()[0]
+
+    def purge_expired(self, now: float, limit: Optional[int] = None) -> List[Tuple[str, Dict]]:
+        """Удаление пачки истекших сообщений по индексу expires_at"""
+        rows = self.conn.execute(
+            SQL_SELECT_EXPIRED, (now, -1 if limit is None else limit)).fetchall()
+        if not rows:
+            return []
+        with self.conn:
+            self.conn.executemany(SQL_DELETE_SEQ, [(seq,) for seq, _, _ in rows])
+        return [(peer_id, {**json.loads(data), "seq": seq})
+                for seq, peer_id, data in rows]
+
+    def delete_expired(self) -> None:
+        """Удаление истекших сообщений во всех чатах"""
+        removed = self.purge_expired(time.time())
+        if removed:
+            logger.info(f"Удалено истекших сообщений: {len(removed)}")
+
+    def outbox_add(self, peer_id: str, entry: Dict) -> None:
+        """Добавление сообщения в очередь доставки"""
+        with self.conn:
+            self.conn.execute(SQL_OUTBOX_ADD, (
+                entry["id"], peer_id, json.dumps(entry, ensure_ascii=False)))
+
+    def outbox_pending(self, peer_id: str) -> List[Dict]:
+        """Неподтвержденные сообщения в порядке отправки"""
+        return [json.loads(data) for (data,) in
+                self.conn.execute(SQL_OUTBOX_PENDING, (peer_id,))]
+
+    def outbox_remove(self, peer_id: str, ids: List[str]) -> None:
+        """Удаление подтвержденных сообщений из очереди доставки"""
+        with self.conn:
+            self.conn.executemany(
+                SQL_OUTBOX_REMOVE, [(peer_id, message_id) for message_id in ids])
+
+    def import_from(self, backend) -> None:
+        """Перенос данных из другого бэкенда (при первом запуске).
+
+        При ошибке база удаляется и исключение пробрасывается: иначе
+        следующий запуск счел бы перенос выполненным и не увидел историю.
+        """
+        try:
+            with self.conn:
+                for key, value in backend.settings.data.items():
+                    self.conn.execute(SQL_SAVE_SETTING, (key, json.dumps(value)))
+                for contact in backend.get_contacts():
+                    self.conn.execute(
+                        SQL_ADD_CONTACT, (contact["public_key"], contact["added_at"]))
+                for peer_id in backend.list_chats():
+                    for message in backend.load_messages(peer_id):
+                        self._insert(peer_id, message)
+                for peer_id in backend.outbox_peers():
+                    for entry in backend.outbox_pending(peer_id):
+                        self.conn.execute(SQL_OUTBOX_ADD, (
+                            entry["id"], peer_id, json.dumps(entry, ensure_ascii=False)))
+            logger.info("Данные перенесены в базу SQLite")
+        except Exception as e:
+            logger.error(f"Ошибка переноса данных в SQLite: {e}")
+            self.close()
+            for suffix in ("", "-wal", "-shm"):
+                self.db_file.with_name(self.db_file.name + suffix).unlink(missing_ok=True)
+            raise
+        finally:
+            backend.close()
+
+    def close(self) -> None:
+        """Закрытие соединения с базой"""
+        self.conn.close()
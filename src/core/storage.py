@@ -1,74 +1,466 @@
+import hashlib
+import hmac
 import json
+import os
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-from datetime import datetime, timedelta
-from ..utils.config import CHATS_DIR, KEYS_DIR, DEFAULT_MESSAGE_EXPIRY
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+from ..utils.config import (
+    CHATS_DIR, KEYS_DIR, DEFAULT_MESSAGE_EXPIRY, CHAT_COMPACT_INTERVAL,
+    DEFAULT_THEME, STORAGE_BACKEND, DATABASE_FILE, EXPIRY_BATCH_SIZE, OUTBOX_DIR,
+    SEARCH_DB_FILE, SEARCH_RESULTS_LIMIT, SETTINGS_FILE, CONTACTS_FILE,
+    CHAT_GARBAGE_THRESHOLD, EXPIRY_INDEX_GARBAGE,
+    ensure_directories
+)
+from ..utils.fileio import atomic_write_json, fsync_batcher, io_stats
+from .chatlog import ChatLog
+from .expiry import ExpiryIndex, ExpiryScheduler, message_expires_at
+from .search import SearchIndex
+from .jsonfile import CachedJsonFile
+from .contacts import ContactIndex
+from . import metrics
 import base64
 import logging
 
 logger = logging.getLogger(__name__)
 
+STORAGE_SECONDS = metrics.Histogram(
+    "p2p_storage_seconds", "Длительность операций хранилища", ("op",))
+
+
+def _files_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    if not path.is_dir():
+        return 0
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+metrics.Callback("p2p_storage_file_bytes", "Размер файлов хранилища", lambda: {
+    ("chats",): _files_size(CHATS_DIR),
+    ("outbox",): _files_size(OUTBOX_DIR),
+    ("search",): _files_size(SEARCH_DB_FILE),
+    ("database",): _files_size(DATABASE_FILE),
+}, ("area",))
+metrics.Callback("p2p_storage_io_total", "fsync и восстановления файлов хранилища",
+                 lambda: {(event,): count for event, count in io_stats.items()},
+                 ("event",), kind="counter")
+
+
+def new_message_id() -> str:
+    """Id сообщения: время создания в мс (12 hex) и случайная часть (20 hex)"""
+    return f"{int(time.time() * 1000):012x}{uuid.uuid4().hex[:20]}"
+
+
+def message_id_time(message_id: str) -> float:
+    """Время создания сообщения по его id, секунды epoch"""
+    try:
+        return int(message_id[:12], 16) / 1000
+    except ValueError:
+        return 0.0
+
+
+def message_time(message: Dict) -> float:
+    """Время создания сообщения: по id, у старых сообщений без id - по timestamp"""
+    if "id" in message:
+        return message_id_time(message["id"])
+    try:
+        return datetime.fromisoformat(message["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def _chat_dir_name(peer_id: str) -> str:
+    """Имя директории журнала чата (base64 может содержать '/')"""
+    return peer_id.replace("/", "_")
+
+
+def _peer_id_from_dir(name: str) -> str:
+    """Восстановление peer_id по имени директории журнала"""
+    return name.replace("_", "/")
+
+
+class FileBackend:
+    """Хранение настроек и контактов в JSON, истории чатов - в журналах"""
+
+    def __init__(self):
+        self.settings_file = SETTINGS_FILE
+        self.contacts_file = CONTACTS_FILE
+        # Настройки и контакты читаются из памяти, запись отложенная
+        self.settings = CachedJsonFile(self.settings_file, dict)
+        self.contacts = CachedJsonFile(self.contacts_file, lambda: {"contacts": []})
+        self._chat_logs: Dict[str, ChatLog] = {}
+        # Следующий seq удаленных чатов: новый журнал продолжает нумерацию
+        self.deleted_seqs = CachedJsonFile(CHATS_DIR / "deleted_chats.seq", dict)
+        self._appends_since_compaction: Dict[str, int] = {}
+        self._outbox_logs: Dict[str, ChatLog] = {}
+        self.expiry_index = ExpiryIndex(CHATS_DIR / "expiry.idx")
+        if not self.expiry_index.exists:
+            self._rebuild_expiry_index()
+        # Истекшие записи, оставшиеся в журналах чатов до уплотнения
+        self._garbage: Dict[str, int] = dict(self.expiry_index.garbage)
+        # Уведомление об удаленных при уплотнении сообщениях [(peer_id, сообщение)]
+        self.messages_removed: Optional[Callable[[List[Tuple[str, Dict]]], None]] = None
+
+    def get_setting(self, key: str, default: Any = None) -> Any:
+        """Получение значения настройки"""
+        return self.settings.get(key, default)
+
+    def save_setting(self, key: str, value: Any) -> None:
+        """Сохранение значения настройки"""
+        self.settings.set(key, value)
+
+    def get_contacts(self) -> List[Dict]:
+        """Получение списка контактов"""
+        return list(self.contacts.data.get("contacts", []))
+
+    @property
+    def contacts_generation(self) -> int:
+        """Меняется, когда файл контактов перечитан после внешнего изменения"""
+        self.contacts.data  # обращение к data проверяет mtime файла
+        return self.contacts.generation
+
+    def add_contact(self, contact: Dict) -> bool:
+        """Добавление контакта (дубликаты отсекает индекс контактов Storage)"""
+        self.contacts.data.setdefault("contacts", []).append(contact)
+        self.contacts.mark_dirty()
+        return True
+
+    def delete_contact(self, public_key: str) -> None:
+        """Удаление контакта по публичному ключу"""
+        contacts = self.contacts.data.get("contacts", [])
+        # Оставляем только те контакты, которые не совпадают с удаляемым
+        new_contacts = [c for c in contacts if c["public_key"] != public_key]
+        if len(new_contacts) != len(contacts):
+            self.contacts.data["contacts"] = new_contacts
+            self.contacts.mark_dirty()
+
+    def _chat_log(self, peer_id: str) -> ChatLog:
+        """Получение журнала чата с миграцией старого JSON-файла"""
+        log = self._chat_logs.get(peer_id)
+        if log is not None:
+            return log
+
+        log = ChatLog(CHATS_DIR / _chat_dir_name(peer_id),
+                      first_seq=self.deleted_seqs.get(peer_id, 1))
+        legacy_file = CHATS_DIR / f"{peer_id}.json"
+        if legacy_file.exists():
+            try:
+                with open(legacy_file, "r") as f:
+                    messages = json.load(f).get("messages", [])
+                for message in messages:
+                    expires_at = message_expires_at(message)
+                    if expires_at is not None:
+                        message["expires_at"] = expires_at
+                log.rewrite(messages)
+                self._index_messages(peer_id, log.read_all())
+                legacy_file.unlink()
+                logger.info(
+                    f"История чата {peer_id[:10]}... перенесена в журнал ({len(messages)} сообщений)")
+            except (json.JSONDecodeError, IOError) as e:
+                logger.error(f"Ошибка миграции истории чата {peer_id[:10]}...: {e}")
+        self._chat_logs[peer_id] = log
+        return log
+
+    def _has_chat(self, peer_id: str) -> bool:
+        return (CHATS_DIR / _chat_dir_name(peer_id)).exists() or \
+            (CHATS_DIR / f"{peer_id}.json").exists()
+
+    def _index_messages(self, peer_id: str, messages: List[Dict]) -> None:
+        """Добавление сроков жизни сообщений в индекс"""
+        for message in messages:
+            expires_at = message_expires_at(message)
+            if expires_at is not None:
+                self.expiry_index.push(expires_at, peer_id, message["seq"])
+
+    def _rebuild_expiry_index(self) -> None:
+        """Построение индекса сроков жизни по всем журналам"""
+        entries = []
+        for peer_id in self.list_chats():
+            for message in self._chat_log(peer_id):
+                expires_at = message_expires_at(message)
+                if expires_at is not None:
+                    entries.append((expires_at, peer_id, message["seq"]))
+        self.expiry_index.reset(entries)
+        logger.info(f"Построен индекс сроков жизни: {len(entries)} сообщений")
+
+    @staticmethod
+    def _is_alive(message: Dict, now: float) -> bool:
+        """Проверка, что срок жизни сообщения не истёк"""
+        expires_at = message_expires_at(message)
+        return expires_at is None or now < expires_at
+
+    def load_messages(self, peer_id: str) -> List[Dict]:
+        """Загрузка неистекших сообщений чата"""
+        if not self._has_chat(peer_id):
+            return []
+
+        # Истекшие, но ещё не удалённые планировщиком сообщения пропускаются
+        now = time.time()
+        return [m for m in self._chat_log(peer_id) if self._is_alive(m, now)]
+
+    def load_page(self, peer_id: str, before: Optional[int],
+                  limit: Optional[int]) -> List[Dict]:
+        """Загрузка страницы сообщений, предшествующих курсору before"""
+        if not self._has_chat(peer_id):
+            return []
+
+        now = time.time()
+        return self._chat_log(peer_id).read_page(
+            before, limit, lambda m: self._is_alive(m, now))
+
+    def replace_messages(self, peer_id: str, messages: List[Dict]) -> None:
+        """Полная замена истории чата.
+
+        Сообщения получают новые seq после последнего выданного, поэтому
+        старые записи индекса сроков жизни не указывают на другие сообщения.
+        Такие записи безвредны: при удалении по индексу отсутствующие seq
+        просто пропускаются.
+        """
+        log = self._chat_log(peer_id)
+        first_seq = log.next_seq
+        log.rewrite([{**message, "seq": first_seq + i}
+                     for i, message in enumerate(messages)])
+        self._index_messages(peer_id, log.read_all())
+
+    def append_message(self, peer_id: str, message: Dict) -> Dict:
+        """Добавление сообщения в конец истории"""
+        log = self._chat_log(peer_id)
+        stored = log.append(message)
+        self._index_messages(peer_id, [stored])
+
+        # Периодическое уплотнение журнала
+        appended = self._appends_since_compaction.get(peer_id, 0) + 1
+        if appended >= CHAT_COMPACT_INTERVAL:
+            self._compact_chat(peer_id, time.time())
+            appended = 0
+        self._appends_since_compaction[peer_id] = appended
+        return stored
+
+    def list_chats(self) -> List[str]:
+        """Получение списка всех чатов"""
+        chats = {_peer_id_from_dir(d.name)
+                 for d in CHATS_DIR.iterdir() if d.is_dir()}
+        # Ещё не перенесённые чаты в старом формате
+        chats.update(f.stem for f in CHATS_DIR.glob("*.json"))
+        return sorted(chats)
+
+    def delete_chat(self, peer_id: str) -> None:
+        """Удаление чата"""
+        log = self._chat_logs.pop(peer_id, None)
+        self._appends_since_compaction.pop(peer_id, None)
+        self._garbage.pop(peer_id, None)
+        chat_dir = CHATS_DIR / _chat_dir_name(peer_id)
+        if log is None and chat_dir.exists():
+            log = self._chat_log(peer_id)
+            self._chat_logs.pop(peer_id)
+        if log is not None:
+            self.deleted_seqs.set(peer_id, log.next_seq)
+            self.deleted_seqs.flush()
+            log.destroy()
+        # Записи индекса сроков не должны указать на сообщения нового чата
+        self.expiry_index.drop_peer(peer_id)
+        chat_file = CHATS_DIR / f"{peer_id}.json"
+        if chat_file.exists():
+            chat_file.unlink()
+
+    def next_expiry(self) -> Optional[float]:
+        """Ближайший момент истечения сообщения"""
+        return self.expiry_index.next_expiry()
+
+    def purge_expired(self, now: float, limit: Optional[int] = None) -> List[Tuple[str, Dict]]:
+        """Удаление пачки истекших сообщений по индексу.
+
+        Истекшее сообщение уже не читается (load_messages и load_page его
+        пропускают), поэтому журнал не перезаписывается на каждой пачке:
+        чат уплотняется, когда в нем накопится CHAT_GARBAGE_THRESHOLD
+        истекших записей. Возвращаются только сообщения, которые есть в
+        журнале и действительно истекли: запись индекса может устареть.
+        """
+        due = self.expiry_index.pop_due(now, limit)
+        if not due:
+            return []
+
+        removed = []
+        for peer_id in {peer_id for _, peer_id, _ in due}:
+            if not self._has_chat(peer_id):
+                self._garbage.pop(peer_id, None)
+                continue
+            found = self._chat_log(peer_id).find(
+                seq for _, due_peer, seq in due if due_peer == peer_id)
+            expired = [m for m in found.values() if not self._is_alive(m, now)]
+            removed.extend((peer_id, message) for message in expired)
+            self._garbage[peer_id] = self._garbage.get(peer_id, 0) + len(expired)
+            if self._garbage[peer_id] >= CHAT_GARBAGE_THRESHOLD:
+                self._compact_chat(peer_id, now)
+
+        if self.expiry_index.garbage_total >= EXPIRY_INDEX_GARBAGE:
+            # После перезаписи индекса мусор в журналах не восстановить
+            # из него при запуске - сначала уплотняем все такие чаты
+            for peer_id in list(self._garbage):
+                self._compact_chat(peer_id, now)
+            self.expiry_index.save()
+        return removed
+
+    def _compact_chat(self, peer_id: str, now: float) -> None:
+        """Уплотнение журнала чата с удалением истекших сообщений"""
+        self._garbage.pop(peer_id, None)
+        if not self._has_chat(peer_id):
+            return
+        removed = self._chat_log(peer_id).compact(lambda m: self._is_alive(m, now))
+        if removed and self.messages_removed:
+            self.messages_removed([(peer_id, message) for message in removed])
+        logger.info(
+            f"Журнал чата {peer_id[:10]}... уплотнён, удалено {len(removed)} сообщений")
+
+    def delete_expired(self) -> None:
+        """Удаление истекших сообщений во всех чатах"""
+        self.purge_expired(time.time())
+
+    def _outbox_log(self, peer_id: str) -> ChatLog:
+        """Журнал неподтвержденных исходящих сообщений контакта"""
+        log = self._outbox_logs.get(peer_id)
+        if log is None:
+            log = ChatLog(OUTBOX_DIR / _chat_dir_name(peer_id))
+            self._outbox_logs[peer_id] = log
+        return log
+
+    def outbox_add(self, peer_id: str, entry: Dict) -> None:
+        """Добавление сообщения в очередь доставки"""
+        self._outbox_log(peer_id).append(entry)
+
+    def outbox_pending(self, peer_id: str) -> List[Dict]:
+        """Неподтвержденные сообщения в порядке отправки"""
+        if peer_id not in self._outbox_logs and \
+                not (OUTBOX_DIR / _chat_dir_name(peer_id)).exists():
+            return []
+        return self._outbox_log(peer_id).read_all()
+
+    def outbox_remove(self, peer_id: str, ids: List[str]) -> None:
+        """Удаление подтвержденных сообщений из очереди доставки"""
+        pending = self.outbox_pending(peer_id)
+        acked = set(ids)
+        kept = [entry for entry in pending if entry["id"] not in acked]
+        if len(kept) == len(pending):
+            return
+        if kept:
+            self._outbox_log(peer_id).rewrite(kept)
+        else:
+            self._outbox_logs.pop(peer_id).destroy()
+
+    def outbox_peers(self) -> List[str]:
+        """Контакты с неподтвержденными сообщениями"""
+        if not OUTBOX_DIR.exists():
+            return []
+        return sorted(_peer_id_from_dir(d.name)
+                      for d in OUTBOX_DIR.iterdir() if d.is_dir())
+
+    def close(self) -> None:
+        """Запись отложенных изменений и закрытие открытых журналов"""
+        self.settings.close()
+        self.contacts.close()
+        self.deleted_seqs.close()
+        for log in self._chat_logs.values():
+            log.close()
+        for log in self._outbox_logs.values():
+            log.close()
+        self.expiry_index.close()
+
 
 class Storage:
     def __init__(self):
         self._ensure_directories()
-        self.settings_file = Path("data") / "settings.json"
-        self.contacts_file = Path("data") / "contacts.json"
-        self._ensure_settings_file()
-        self._ensure_contacts_file()
+        # Бэкенд используется из GUI и из потока планировщика сроков жизни
+        self._lock = threading.RLock()
+        self.backend = self._create_backend()
+        self.search_index = SearchIndex(SEARCH_DB_FILE)
+        if self.search_index.is_new:
+            self._rebuild_search_index()
+        if isinstance(self.backend, FileBackend):
+            # Уплотнение журнала удаляет сообщения и из поискового индекса
+            self.backend.messages_removed = self.search_index.remove
+        # Контакты индексируются по ключу и обслуживаются из памяти
+        self.contact_index = ContactIndex(self.backend.get_contacts())
+        self._contacts_generation = self.backend.contacts_generation
+        self._ensure_settings()
+        self._message_key = bytes.fromhex(self.get_setting("message_key"))
         self.crypto = None  # Будет установлен из MainWindow
+        # Вызывается после перезаписи истории чата: seq сообщений в нем
+        # изменились, и открытые представления должны загрузить его заново
+        self.history_replaced: Optional[Callable[[str], None]] = None
+        self.expiry_scheduler = ExpiryScheduler(self, EXPIRY_BATCH_SIZE)
+        self.expiry_scheduler.start()
 
     def _ensure_directories(self) -> None:
         """Создание необходимых директорий"""
         try:
-            logger.info(f"Создание директории для ключей: {KEYS_DIR}")
-            KEYS_DIR.mkdir(parents=True, exist_ok=True)
-            logger.info(f"Создание директории для чатов: {CHATS_DIR}")
-            CHATS_DIR.mkdir(parents=True, exist_ok=True)
-            logger.info(f"Создание директории data: {Path('data')}")
-            Path("data").mkdir(parents=True, exist_ok=True)
+            ensure_directories()
         except Exception as e:
             logger.error(f"Ошибка при создании директорий: {e}")
             raise
 
-    def _ensure_settings_file(self) -> None:
-        """Создание файла настроек, если он не существует"""
-        if not self.settings_file.exists():
+    def _create_backend(self):
+        """Создание бэкенда хранилища согласно STORAGE_BACKEND"""
+        if STORAGE_BACKEND == "files":
+            return FileBackend()
+        if STORAGE_BACKEND == "sqlite":
+            from .sqlite_backend import SQLiteBackend
+            is_new = not DATABASE_FILE.exists()
+            backend = SQLiteBackend(DATABASE_FILE)
+            if is_new:
+                backend.import_from(FileBackend())
+            return backend
+        raise ValueError(f"Неизвестный бэкенд хранилища: {STORAGE_BACKEND}")
+
+    def _rebuild_search_index(self) -> None:
+        """Индексация всех сохраненных сообщений (при создании индекса)"""
+        count = 0
+        for peer_id in self.backend.list_chats():
+            messages = self.backend.load_messages(peer_id)
+            self.search_index.add(peer_id, messages)
+            count += len(messages)
+        logger.info(f"Построен поисковый индекс: {count} сообщений")
+
+    def _ensure_settings(self) -> None:
+        """Запись настроек по умолчанию, если они ещё не заданы"""
+        if self.get_setting("theme") is None:
             # Устанавливаем светлую тему по умолчанию
-            self.save_setting("theme", "light")
-
-    def _ensure_contacts_file(self) -> None:
-        """Создание файла контактов, если он не существует"""
-        if not self.contacts_file.exists():
-            with open(self.contacts_file, "w") as f:
-                json.dump({"contacts": []}, f, indent=2)
+            self.save_setting("theme", DEFAULT_THEME)
+        if self.get_setting("message_key") is None:
+            # Ключ метки собственных сообщений, известен только этой копии
+            self.save_setting("message_key", os.urandom(32).hex())
+
+    def _own_tag(self, prefix: str, text: str) -> str:
+        return hashlib.blake2b(f"{prefix}:{text}".encode(), key=self._message_key,
+                               digest_size=6).hexdigest()
+
+    def _own_message_id(self, text: str) -> str:
+        """Id собственного сообщения: время, 8 hex случайной части и метка"""
+        prefix = new_message_id()[:20]
+        return prefix + self._own_tag(prefix, text)
+
+    def is_own_message(self, message_id: str, text: str) -> bool:
+        """Проверка по метке в id, что сообщение с этим текстом написано нами.
+
+        Метку нельзя подделать без ключа message_key из настроек, поэтому
+        авторство сообщений из синхронизации определяется локально.
+        """
+        if not isinstance(message_id, str) or len(message_id) != 32:
+            return False
+        return hmac.compare_digest(message_id[20:], self._own_tag(message_id[:20], text))
 
     def get_setting(self, key: str, default: Any = None) -> Any:
         """Получение значения настройки"""
-        if not self.settings_file.exists():
-            return default
-
-        try:
-            with open(self.settings_file, "r") as f:
-                settings = json.load(f)
-                return settings.get(key, default)
-        except (json.JSONDecodeError, IOError):
-            return default
+        with self._lock:
+            return self.backend.get_setting(key, default)
 
     def save_setting(self, key: str, value: Any) -> None:
         """Сохранение значения настройки"""
-        settings = {}
-        if self.settings_file.exists():
-            try:
-                with open(self.settings_file, "r") as f:
-                    settings = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                pass
-
-        settings[key] = value
-
-        with open(self.settings_file, "w") as f:
-            json.dump(settings, f, indent=2)
+        with self._lock:
+            self.backend.save_setting(key, value)
 
     def save_keys(self, public_key: str, verify_key: str, private_key: str, signing_key: str) -> None:
         """Сохранение ключей"""
@@ -99,8 +491,7 @@ class Storage:
                 "created_at": datetime.now().isoformat()
             }
 
-            with open(keys_file, "w") as f:
-                json.dump(keys_data, f, indent=2)
+            atomic_write_json(keys_file, keys_data)
 
             logger.info("Ключи успешно сохранены")
         except Exception as e:
@@ -144,78 +535,148 @@ class Storage:
             return False
 
     def save_chat_history(self, peer_id: str, messages: List[Dict]) -> None:
-        """Сохранение истории чата"""
-        chat_file = CHATS_DIR / f"{peer_id}.json"
-        chat_data = {
-            "peer_id": peer_id,
-            "messages": messages,
-            "last_updated": datetime.now().isoformat()
-        }
-
-        with open(chat_file, "w") as f:
-            json.dump(chat_data, f, indent=2)
-
-    def load_chat_history(self, peer_id: str) -> List[Dict]:
-        """Загрузка истории чата"""
-        chat_file = CHATS_DIR / f"{peer_id}.json"
-        if not chat_file.exists():
-            return []
-
-        with open(chat_file, "r") as f:
-            data = json.load(f)
-            messages = data.get("messages", [])
-
-            # Удаляем истекшие сообщения
-            current_time = datetime.now()
-            valid_messages = []
-
-            for message in messages:
-                if "expiry" in message:
-                    expiry_time = datetime.fromisoformat(
-                        message["timestamp"]) + timedelta(seconds=message["expiry"])
-                    if current_time < expiry_time:
-                        valid_messages.append(message)
-                else:
-                    valid_messages.append(message)
-
-            # Если были удалены сообщения, сохраняем обновленную историю
-            if len(valid_messages) != len(messages):
-                self.save_chat_history(peer_id, valid_messages)
-
-            return valid_messages
-
-    def add_message(self, peer_id: str, message: Dict, expiry: Optional[int] = None) -> None:
+        """Сохранение истории чата (сообщения получают новые seq)"""
+        with self._lock:
+            self.backend.replace_messages(peer_id, messages)
+            self.search_index.delete_chat(peer_id)
+            self.search_index.add(peer_id, self.backend.load_messages(peer_id))
+        if self.history_replaced:
+            try:
+                self.history_replaced(peer_id)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика перезаписи истории: {e}")
+
+    @metrics.timed(STORAGE_SECONDS.labels("load_chat_history"))
+    def load_chat_history(self, peer_id: str, before: Optional[int] = None,
+                          limit: Optional[int] = None) -> List[Dict]:
+        """Загрузка истории чата.
+
+        Возвращаются сообщения с seq меньше курсора before (seq самого
+        старого уже загруженного сообщения; без before - вся история), не
+        более limit последних (без limit - все), в хронологическом порядке.
+        """
+        with self._lock:
+            if limit is None and before is None:
+                return self.backend.load_messages(peer_id)
+            return self.backend.load_page(peer_id, before, limit)
+
+    @metrics.timed(STORAGE_SECONDS.labels("add_message"))
+    def add_message(self, peer_id: str, message: Dict, expiry: Optional[int] = None) -> Dict:
         """Добавление нового сообщения в историю"""
-        messages = self.load_chat_history(peer_id)
+        expiry = expiry or DEFAULT_MESSAGE_EXPIRY
+        now = time.time()
+        if message.get("is_self"):
+            message_id = self._own_message_id(message.get("text", ""))
+        else:
+            message_id = new_message_id()
         message_data = {
+            "id": message_id,
             **message,
-            "timestamp": datetime.now().isoformat(),
-            "expiry": expiry or DEFAULT_MESSAGE_EXPIRY
+            "timestamp": datetime.fromtimestamp(now).isoformat(),
+            "expiry": expiry,
+            "expires_at": now + expiry
         }
-        messages.append(message_data)
-        self.save_chat_history(peer_id, messages)
+        with self._lock:
+            stored = self.backend.append_message(peer_id, message_data)
+            self.search_index.add(peer_id, [stored])
+        self.expiry_scheduler.schedule(message_data["expires_at"])
+        return stored
+
+    @metrics.timed(STORAGE_SECONDS.labels("import_messages"))
+    def import_messages(self, peer_id: str, messages: List[Dict]) -> int:
+        """Добавление сообщений с их исходным временем (синхронизация с собеседником).
+
+        Сообщения встают в историю по времени создания из id: если все они
+        новее последнего сохраненного, они дописываются в конец, иначе
+        история чата перезаписывается слиянием. Уже истекшие сообщения
+        пропускаются. Возвращает число добавленных.
+        """
+        now = time.time()
+        added = []
+        earliest = None
+        for message in messages:
+            expires_at = message_expires_at(message)
+            if expires_at is not None:
+                if expires_at <= now:
+                    continue
+                earliest = expires_at if earliest is None else min(earliest, expires_at)
+            added.append(message)
+        if not added:
+            return 0
+        added.sort(key=message_time)
+
+        with self._lock:
+            last = self.backend.load_page(peer_id, None, 1)
+            if not last or message_time(last[-1]) <= message_time(added[0]):
+                stored = [self.backend.append_message(peer_id, m) for m in added]
+                self.search_index.add(peer_id, stored)
+            else:
+                merged = self.backend.load_messages(peer_id) + added
+                self.save_chat_history(peer_id, sorted(merged, key=message_time))
+        if earliest is not None:
+            self.expiry_scheduler.schedule(earliest)
+        return len(added)
 
     def get_all_chats(self) -> List[str]:
         """Получение списка всех чатов"""
-        return [f.stem for f in CHATS_DIR.glob("*.json")]
+        with self._lock:
+            return self.backend.list_chats()
 
     def delete_chat(self, peer_id: str) -> None:
         """Удаление чата"""
-        chat_file = CHATS_DIR / f"{peer_id}.json"
-        if chat_file.exists():
-            chat_file.unlink()
+        with self._lock:
+            self.backend.delete_chat(peer_id)
+            self.search_index.delete_chat(peer_id)
 
     def clear_all_chats(self) -> None:
         """Очистка всех чатов"""
-        for chat_file in CHATS_DIR.glob("*.json"):
-            chat_file.unlink()
+        for peer_id in self.get_all_chats():
+            self.delete_chat(peer_id)
 
     def cleanup_expired_messages(self) -> None:
         """Очистка всех истекших сообщений"""
-        for chat_file in CHATS_DIR.glob("*.json"):
-            peer_id = chat_file.stem
-            # Это автоматически удалит истекшие сообщения
-            self.load_chat_history(peer_id)
+        with self._lock:
+            removed = self.backend.purge_expired(time.time())
+            self.search_index.remove(removed)
+
+    def next_expiry(self) -> Optional[float]:
+        """Ближайший момент истечения сообщения по индексу"""
+        with self._lock:
+            return self.backend.next_expiry()
+
+    @metrics.timed(STORAGE_SECONDS.labels("purge_expired"))
+    def purge_expired(self, limit: Optional[int] = None) -> int:
+        """Удаление пачки истекших сообщений, возвращает их количество"""
+        with self._lock:
+            removed = self.backend.purge_expired(time.time(), limit)
+            self.search_index.remove(removed)
+            return len(removed)
+
+    @metrics.timed(STORAGE_SECONDS.labels("search_messages"))
+    def search_messages(self, query: str, limit: int = SEARCH_RESULTS_LIMIT) -> List[Dict]:
+        """Полнотекстовый поиск по всем чатам.
+
+        Слова запроса обязательны и ищутся по префиксу. Результаты
+        упорядочены по релевантности (bm25): peer_id, seq, timestamp и
+        фрагмент текста с выделенными совпадениями.
+        """
+        with self._lock:
+            return self.search_index.search(query, limit)
+
+    def outbox_add(self, peer_id: str, message_id: str, text: str) -> None:
+        """Сохранение исходящего сообщения до подтверждения доставки"""
+        with self._lock:
+            self.backend.outbox_add(peer_id, {"id": message_id, "text": text})
+
+    def outbox_pending(self, peer_id: str) -> List[Dict]:
+        """Неподтвержденные исходящие сообщения контакта"""
+        with self._lock:
+            return self.backend.outbox_pending(peer_id)
+
+    def outbox_remove(self, peer_id: str, ids: List[str]) -> None:
+        """Удаление подтвержденных сообщений из очереди доставки"""
+        with self._lock:
+            self.backend.outbox_remove(peer_id, ids)
 
     def add_contact(self, public_key: str) -> None:
         """Добавление нового контакта"""
@@ -224,60 +685,63 @@ class Storage:
             if not public_key or len(public_key) < 32:
                 raise ValueError("Неверный формат публичного ключа")
 
-            # Загружаем существующие контакты
-            contacts = []
-            if self.contacts_file.exists():
-                with open(self.contacts_file, "r") as f:
-                    data = json.load(f)
-                    contacts = data.get("contacts", [])
-
-            # Проверяем, не существует ли уже такой контакт
-            for contact in contacts:
-                if contact["public_key"] == public_key:
-                    raise ValueError("Контакт уже существует")
-
-            # Добавляем новый контакт
-            contacts.append({
+            contact = {
                 "public_key": public_key,
                 "added_at": datetime.now().isoformat()
-            })
-
-            # Сохраняем обновленный список контактов
-            with open(self.contacts_file, "w") as f:
-                json.dump({"contacts": contacts}, f, indent=2)
+            }
+            with self._lock:
+                self._refresh_contacts()
+                if public_key in self.contact_index:
+                    raise ValueError("Контакт уже существует")
+                self.backend.add_contact(contact)
+                self.contact_index.add(contact)
 
             logger.info(f"Контакт успешно добавлен: {public_key[:10]}...")
         except Exception as e:
             logger.error(f"Ошибка при добавлении контакта: {e}")
             raise
 
+    def _refresh_contacts(self) -> None:
+        """Пересборка индекса контактов, если бэкенд перечитал их с диска"""
+        generation = self.backend.contacts_generation
+        if generation != self._contacts_generation:
+            self._contacts_generation = generation
+            self.contact_index.replace(self.backend.get_contacts())
+
     def get_contacts(self) -> List[Dict]:
         """Получение списка контактов"""
-        if not self.contacts_file.exists():
-            return []
+        with self._lock:
+            self._refresh_contacts()
+            return self.contact_index.all()
 
-        try:
-            with open(self.contacts_file, "r") as f:
-                data = json.load(f)
-                return data.get("contacts", [])
-        except Exception as e:
-            logger.error(f"Ошибка при получении контактов: {e}")
-            return []
+    def get_contact(self, public_key: str) -> Optional[Dict]:
+        """Контакт по публичному ключу"""
+        with self._lock:
+            self._refresh_contacts()
+            return self.contact_index.get(public_key)
 
     def delete_contact(self, public_key: str) -> None:
         """Удаление контакта по публичному ключу"""
-        if not self.contacts_file.exists():
-            return
         try:
-            with open(self.contacts_file, "r") as f:
-                data = json.load(f)
-                contacts = data.get("contacts", [])
-            # Оставляем только те контакты, которые не совпадают с удаляемым
-            new_contacts = [
-                c for c in contacts if c["public_key"] != public_key]
-            with open(self.contacts_file, "w") as f:
-                json.dump({"contacts": new_contacts}, f, indent=2)
+            with self._lock:
+                self._refresh_contacts()
+                if public_key not in self.contact_index:
+                    return
+                self.backend.delete_contact(public_key)
+                self.contact_index.remove(public_key)
             logger.info(f"Контакт удалён: {public_key[:10]}...")
         except Exception as e:
             logger.error(f"Ошибка при удалении контакта: {e}")
             raise
+
+    def io_stats(self) -> Dict[str, int]:
+        """Счетчики fsync и восстановления поврежденных файлов"""
+        return dict(io_stats)
+
+    def close(self) -> None:
+        """Закрытие хранилища"""
+        self.expiry_scheduler.stop()
+        with self._lock:
+            self.backend.close()
+            self.search_index.close()
+        fsync_batcher.flush()
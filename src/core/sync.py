@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set
+from ..utils.config import DEFAULT_MESSAGE_EXPIRY, MESSAGE_EXPIRY, SYNC_BATCH_SIZE
+from .storage import message_id_time
+
+logger = logging.getLogger(__name__)
+
+
+def _id_hash(message_id: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(message_id.encode(), digest_size=8).digest(), "big")
+
+
+def day_bucket(message_id: str) -> str:
+    return datetime.fromtimestamp(
+        message_id_time(message_id), timezone.utc).strftime("%Y-%m-%d")
+
+
+def hour_bucket(message_id: str) -> str:
+    return datetime.fromtimestamp(
+        message_id_time(message_id), timezone.utc).strftime("%Y-%m-%dT%H")
+
+
+def bucket_hashes(ids: Iterable[str], bucket) -> Dict[str, str]:
+    """Хэши корзин: XOR хэшей id сообщений, не зависит от порядка"""
+    hashes: Dict[str, int] = {}
+    for message_id in ids:
+        key = bucket(message_id)
+        hashes[key] = hashes.get(key, 0) ^ _id_hash(message_id)
+    return {key: f"{value:016x}" for key, value in hashes.items()}
+
+
+def differing(local: Dict[str, str], remote: Dict[str, str]) -> Set[str]:
+    """Корзины, содержимое которых различается (или есть только у одной стороны)"""
+    return {key for key in local.keys() | remote.keys()
+            if local.get(key) != remote.get(key)}
+
+
+def clamp_lifetime(message: Dict, now: float) -> Dict:
+    """Срок жизни принятого сообщения: не больше MESSAGE_EXPIRY от создания (по id)"""
+    created = min(message_id_time(message["id"]), now)
+    try:
+        expiry = int(message.get("expiry") or DEFAULT_MESSAGE_EXPIRY)
+    except (TypeError, ValueError):
+        expiry = DEFAULT_MESSAGE_EXPIRY
+    expiry = max(1, min(expiry, MESSAGE_EXPIRY))
+    expires_at = created + expiry
+    claimed = message.get("expires_at")
+    if isinstance(claimed, (int, float)) and claimed < expires_at:
+        expires_at = claimed
+    return {
+        "timestamp": datetime.fromtimestamp(created).isoformat(),
+        "expiry": expiry,
+        "expires_at": expires_at
+    }
+
+
+class HistorySync:
+    """Согласование истории чата с собеседником по потоку "sync".
+
+    Сообщения группируются в корзины по дням и часам (время берется из id,
+    поэтому у обеих сторон сообщение попадает в одну корзину). Стороны
+    обмениваются хэшами дней, затем хэшами часов в различающихся днях,
+    затем списками id в различающихся часах, и передают только
+    недостающие сообщения. Объем обмена пропорционален расхождению.
+
+        A -> B  sync_days     {день: хэш}
+        B -> A  sync_hours    различающиеся дни и хэши их часов у B
+        A -> B  sync_ids      различающиеся часы и id сообщений A в них
+        B -> A  sync_want     id, которых нет у B
+        B -> A  sync_messages сообщения, которых нет у A
+        A -> B  sync_messages запрошенные сообщения
+
+    Все сообщения потока шифруются так же, как чат. Полученным данным не
+    доверяется: авторство определяется по метке в id, срок жизни
+    ограничивается.
+    """
+
+    def __init__(self, storage, peer_id: str, mux, crypto, peer_public_key: bytes,
+                 outbox=None):
+        self.storage = storage
+        self.peer_id = peer_id
+        self.mux = mux
+        self.crypto = crypto
+        self.peer_public_key = peer_public_key
+        self.outbox = outbox
+        self._messages: Optional[Dict[str, Dict]] = None
+        self._sending: Optional[asyncio.Task] = None
+        mux.register("sync", self.attach)
+
+    def attach(self, channel) -> None:
+        """Подключение канала потока sync"""
+        @channel.on("open")
+        def on_open():
+            self._on_open()
+
+        @channel.on("message")
+        def on_message(message):
+            if isinstance(message, str):
+                logger.warning(
+                    f"Отклонено незашифрованное сообщение синхронизации от {self.peer_id[:10]}...")
+                return
+            try:
+                _, payload = self.crypto.decrypt_payload(message, self.peer_public_key)
+                self._on_message(json.loads(payload))
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации с {self.peer_id[:10]}...: {e}")
+
+        if channel.readyState == "open":
+            self._on_open()
+
+    def _on_open(self) -> None:
+        # Согласование начинает сторона, создавшая предложение
+        if self.mux.initiator:
+            self.start()
+
+    def _local(self) -> Dict[str, Dict]:
+        """Сообщения чата с id, загружаются один раз за сеанс"""
+        if self._messages is None:
+            self._messages = {m["id"]: m for m in
+                              self.storage.load_chat_history(self.peer_id) if "id" in m}
+        return self._messages
+
+    def _send(self, message: Dict) -> asyncio.Future:
+        payload = json.dumps(message, ensure_ascii=False).encode()
+        return self.mux.send(
+            "sync", self.crypto.encrypt_payload(payload, self.peer_public_key))
+
+    def start(self) -> None:
+        """Начало согласования: отправка хэшей дней"""
+        self._messages = None
+        self._send({"type": "sync_days",
+                    "days": bucket_hashes(self._local(), day_bucket)})
+
+    def _on_message(self, message: Dict) -> None:
+        kind = message.get("type")
+        if kind == "sync_days":
+            # Новый сеанс согласования - перечитываем историю
+            self._messages = None
+        local = self._local()
+
+        if kind == "sync_days":
+            days = differing(bucket_hashes(local, day_bucket), message["days"])
+            if not days:
+                logger.info(f"История с {self.peer_id[:10]}... совпадает")
+                return
+            ids = [i for i in local if day_bucket(i) in days]
+            self._send({"type": "sync_hours", "days": sorted(days),
+                        "hours": bucket_hashes(ids, hour_bucket)})
+
+        elif kind == "sync_hours":
+            days = set(message["days"])
+            ids = [i for i in local if day_bucket(i) in days]
+            hours = differing(bucket_hashes(ids, hour_bucket), message["hours"])
+            self._send({"type": "sync_ids", "hours": sorted(hours),
+                        "ids": [i for i in ids if hour_bucket(i) in hours]})
+
+        elif kind == "sync_ids":
+            hours = set(message["hours"])
+            remote = set(message["ids"])
+            mine = {i for i in local if hour_bucket(i) in hours}
+            want = sorted(remote - mine)
+            if want:
+                self._send({"type": "sync_want", "ids": want})
+            self._send_messages(sorted(mine - remote))
+            logger.info(
+                f"Синхронизация с {self.peer_id[:10]}...: недостает {len(want)}, "
+                f"отправляется {len(mine - remote)}")
+
+        elif kind == "sync_want":
+            self._send_messages([i for i in message["ids"] if i in local])
+
+        elif kind == "sync_messages":
+            self._import(message["messages"])
+
+    def _send_messages(self, ids: List[str]) -> None:
+        """Отправка сообщений пачками с ожиданием сброса каждой"""
+        if not ids:
+            return
+        local = self._local()
+        messages = [self._wire_message(local[i]) for i in ids]
+
+        async def send():
+            for start in range(0, len(messages), SYNC_BATCH_SIZE):
+                await self._send({"type": "sync_messages",
+                                  "messages": messages[start:start + SYNC_BATCH_SIZE]})
+
+        previous = self._sending
+
+        async def send_after_previous():
+            if previous is not None:
+                await asyncio.wait([previous])
+            await send()
+
+        self._sending = asyncio.ensure_future(send_after_previous())
+
+    @staticmethod
+    def _wire_message(message: Dict) -> Dict:
+        """Сообщение для передачи: авторство получатель определяет сам"""
+        return {
+            "id": message["id"],
+            "text": message.get("text", ""),
+            "expiry": message.get("expiry"),
+            "expires_at": message.get("expires_at")
+        }
+
+    def _import(self, messages: List[Dict]) -> None:
+        """Сохранение полученных сообщений, которых еще нет локально"""
+        local = self._local()
+        now = time.time()
+        new = []
+        for message in messages:
+            message_id, text = message.get("id"), message.get("text")
+            if not isinstance(message_id, str) or not isinstance(text, str) \
+                    or message_id in local:
+                continue
+            stored = {"id": message_id, "text": text, **clamp_lifetime(message, now)}
+            if self.storage.is_own_message(message_id, text):
+                # Наше сообщение, которого не было в этой копии истории
+                stored["is_self"] = True
+            else:
+                stored["sender"] = self.peer_id
+            new.append(stored)
+            local[message_id] = stored
+
+        added = self.storage.import_messages(self.peer_id, new)
+        if self.outbox is not None:
+            # Полученные сообщения подтверждаются, чтобы они не пришли повторно
+            for message in new:
+                if not message.get("is_self"):
+                    self.outbox.acknowledge(message["id"])
+        logger.info(f"Синхронизация с {self.peer_id[:10]}...: добавлено {added} сообщений")
@@ -0,0 +1,78 @@
+import struct
+from typing import List, NamedTuple, Union
+from ..utils.config import NONCE_SIZE
+
+# Кадр зашифрованного сообщения:
+# версия (1 байт) | флаги (1 байт) | nonce | шифртекст
+# Отправителя подтверждает Box (общий ключ Curve25519 и MAC Poly1305),
+# отдельной подписи нет. Заголовок повторяется в начале открытого текста,
+# чтобы изменение флагов в пути обнаруживалось при расшифровке.
+WIRE_VERSION = 2
+HEADER = struct.Struct(">BB")
+NONCE_OFFSET = HEADER.size
+CIPHERTEXT_OFFSET = NONCE_OFFSET + NONCE_SIZE
+
+# Флаги кадра
+FLAG_BATCH = 0x01  # В кадре несколько сообщений, каждое с префиксом длины
+
+BATCH_LENGTH = struct.Struct(">I")
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+class Frame(NamedTuple):
+    flags: int
+    nonce: memoryview
+    ciphertext: memoryview
+
+
+def header(flags: int) -> bytes:
+    """Заголовок кадра: версия и флаги"""
+    return HEADER.pack(WIRE_VERSION, flags)
+
+
+def encode_frame(flags: int, nonce: bytes, ciphertext: bytes) -> bytes:
+    """Сборка бинарного кадра"""
+    return b"".join((header(flags), nonce, ciphertext))
+
+
+def decode_frame(data: BytesLike) -> Frame:
+    """Разбор бинарного кадра без копирования полей"""
+    view = memoryview(data)
+    if len(view) < CIPHERTEXT_OFFSET:
+        raise ValueError("Слишком короткий кадр сообщения")
+    version, flags = HEADER.unpack_from(view)
+    if version != WIRE_VERSION:
+        raise ValueError(f"Неподдерживаемая версия кадра: {version}")
+    return Frame(
+        flags,
+        view[NONCE_OFFSET:CIPHERTEXT_OFFSET],
+        view[CIPHERTEXT_OFFSET:]
+    )
+
+
+def pack_batch(messages: List[str]) -> bytes:
+    """Упаковка нескольких сообщений в данные одного кадра"""
+    parts = []
+    for message in messages:
+        data = message.encode()
+        parts.append(BATCH_LENGTH.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def unpack_batch(data: BytesLike) -> List[str]:
+    """Разбор данных кадра с несколькими сообщениями"""
+    view = memoryview(data)
+    messages = []
+    offset = 0
+    while offset < len(view):
+        if offset + BATCH_LENGTH.size > len(view):
+            raise ValueError("Обрезанная пачка сообщений")
+        (length,) = BATCH_LENGTH.unpack_from(view, offset)
+        offset += BATCH_LENGTH.size
+        if offset + length > len(view):
+            raise ValueError("Обрезанная пачка сообщений")
+        messages.append(bytes(view[offset:offset + length]).decode())
+        offset += length
+    return messages
@@ -0,0 +1,448 @@
+"""Фоновый режим без графического интерфейса.
+
+Ядро чата (ключи, хранилище, пул P2P соединений) работает в одном цикле
+asyncio, а управление идет через локальный сокет. Протокол - JSON по
+строке на сообщение (NDJSON):
+
+    -> {"id": 1, "cmd": "send", "peer_id": "...", "text": "привет"}
+    <- {"id": 1, "ok": true, "result": {"id": "...", "seq": 42}}
+
+После команды subscribe в то же соединение приходят события без id:
+
+    <- {"event": "message", "peer_id": "...", "id": "...", "text": "..."}
+
+Событие history_replaced означает, что история чата перезаписана при
+синхронизации и seq в ней изменились: курсоры history нужно сбросить.
+
+Если оборвалось соединение, начатое командой offer, демон присылает
+новое предложение {"event": "renegotiate", "peer_id": ..., "offer": ...};
+ответ собеседника (команда answer на его стороне) передается командой
+accept, как при первом соединении.
+
+Unix-сокет доступен только владельцу (0600). Локальный TCP-порт открыт
+любому пользователю машины, поэтому там первой командой должна быть
+
+    -> {"id": 1, "cmd": "auth", "token": "..."}
+
+с токеном из файла daemon.token в каталоге данных (тоже 0600); иначе
+демон отвечает ошибкой и закрывает соединение.
+
+PySide6 не загружается, поэтому демон подходит для серверов и ботов.
+С --metrics метрики доступны командой metrics и по HTTP
+(GET /metrics на 127.0.0.1, формат Prometheus).
+"""
+import os
+import sys
+import hmac
+import json
+import base64
+import secrets
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set
+from src.core import metrics
+from src.core.crypto import CryptoManager
+from src.core.network import ConnectionManager, P2PConnection
+from src.core.storage import Storage
+from src.utils.config import (
+    DAEMON_SOCKET, DAEMON_PORT, DAEMON_SUBSCRIBER_BUFFER, DAEMON_TOKEN_FILE,
+    DEFAULT_MESSAGE_EXPIRY, HISTORY_PAGE_SIZE, MAX_MESSAGE_SIZE, METRICS_PORT
+)
+
+# Строка команды вмещает сообщение максимального размера с экранированием
+COMMAND_LINE_LIMIT = 4 * MAX_MESSAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonError(Exception):
+    """Ошибка выполнения команды, возвращается клиенту"""
+
+
+class ChatDaemon:
+    """Сеансы с контактами и обработка команд клиентов"""
+
+    def __init__(self, crypto: CryptoManager, storage: Storage,
+                 token: Optional[str] = None):
+        self.crypto = crypto
+        self.storage = storage
+        # Если задан, клиент должен начать с команды auth
+        self.token = token
+        self.connections = ConnectionManager(crypto, storage)
+        self.connections.message_stored = self._on_message
+        self.connections.file_received = self._on_file
+        self.connections.connection_closed = self._on_closed
+        storage.history_replaced = self._on_history_replaced
+        # Контакты, соединения с которыми удерживаются демоном
+        self._sessions: Set[str] = set()
+        self._subscribers: Set[asyncio.StreamWriter] = set()
+        # Ответы на предложения восстановления, ожидаемые от клиентов
+        self._renegotiations: Dict[str, asyncio.Future] = {}
+        self._commands: Dict[str, Callable] = {
+            "identity": self.cmd_identity,
+            "peers": self.cmd_peers,
+            "contacts": self.cmd_contacts,
+            "add_contact": self.cmd_add_contact,
+            "offer": self.cmd_offer,
+            "answer": self.cmd_answer,
+            "accept": self.cmd_accept,
+            "send": self.cmd_send,
+            "history": self.cmd_history,
+            "search": self.cmd_search,
+            "disconnect": self.cmd_disconnect,
+            "metrics": self.cmd_metrics,
+        }
+
+    # --- Сеансы ---
+
+    def _session(self, peer_id: str) -> P2PConnection:
+        """Соединение с контактом, удерживаемое до disconnect"""
+        if peer_id in self._sessions:
+            connection = self.connections.get(peer_id)
+            if connection is not None and not connection.is_closed:
+                return connection
+            self._sessions.discard(peer_id)
+            self.connections.release(peer_id)
+
+        connection = self.connections.acquire(peer_id)
+        self._sessions.add(peer_id)
+        return connection
+
+    def _on_message(self, peer_id: str, stored: Dict) -> None:
+        # Пул уже сохранил сообщение
+        self.publish({"event": "message", "peer_id": peer_id, "id": stored["id"],
+                      "seq": stored["seq"], "text": stored["text"],
+                      "timestamp": stored["timestamp"]})
+
+    def _on_file(self, peer_id: str, path: Path, stored: Dict) -> None:
+        self.publish({"event": "file", "peer_id": peer_id, "path": str(path)})
+
+    def _on_history_replaced(self, peer_id: str) -> None:
+        self.publish({"event": "history_replaced", "peer_id": peer_id})
+
+    def _on_closed(self, peer_id: str) -> None:
+        self.publish({"event": "closed", "peer_id": peer_id})
+
+    async def _renegotiate(self, peer_id: str, offer: str) -> str:
+        """Передача предложения восстановления клиентам и ожидание ответа"""
+        if not self._subscribers:
+            raise DaemonError("Нет подписчиков для передачи предложения")
+        previous = self._renegotiations.get(peer_id)
+        if previous is not None:
+            previous.cancel()
+        future = self._renegotiations[peer_id] = asyncio.get_event_loop().create_future()
+        self.publish({"event": "renegotiate", "peer_id": peer_id, "offer": offer})
+        try:
+            return await future
+        finally:
+            if self._renegotiations.get(peer_id) is future:
+                del self._renegotiations[peer_id]
+
+    # --- Подписки ---
+
+    def publish(self, event: Dict) -> None:
+        """Рассылка события подписчикам"""
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        for writer in list(self._subscribers):
+            if writer.is_closing():
+                self._subscribers.discard(writer)
+            elif writer.transport.get_write_buffer_size() > DAEMON_SUBSCRIBER_BUFFER:
+                # Подписчик не читает события - отключаем, а не копим память
+                logger.warning("Подписчик отключен: переполнен буфер событий")
+                self._subscribers.discard(writer)
+                writer.close()
+            else:
+                writer.write(line)
+
+    # --- Команды ---
+
+    async def cmd_identity(self, request: Dict) -> Dict:
+        return {"public_key": base64.b64encode(self.crypto.get_public_key()).decode()}
+
+    async def cmd_peers(self, request: Dict) -> list:
+        return [{"peer_id": peer_id,
+                 "connected": connection.is_connected,
+                 "reconnecting": connection.is_reconnecting,
+                 "closed": connection.is_closed}
+                for peer_id in sorted(self._sessions)
+                for connection in [self.connections.get(peer_id)]
+                if connection is not None]
+
+    async def cmd_contacts(self, request: Dict) -> list:
+        return self.storage.get_contacts()
+
+    async def cmd_add_contact(self, request: Dict) -> None:
+        try:
+            self.storage.add_contact(_required(request, "peer_id"))
+        except ValueError as e:
+            raise DaemonError(str(e))
+
+    async def cmd_offer(self, request: Dict) -> Dict:
+        peer_id = _required(request, "peer_id")
+        connection = self._session(peer_id)
+        # Инициатор соединения восстанавливает его после обрыва
+        connection.renegotiate = lambda offer: self._renegotiate(peer_id, offer)
+        return {"offer": await connection.create_offer()}
+
+    async def cmd_answer(self, request: Dict) -> Dict:
+        connection = self._session(_required(request, "peer_id"))
+        return {"answer": await connection.handle_offer(_required(request, "offer"))}
+
+    async def cmd_accept(self, request: Dict) -> None:
+        peer_id = _required(request, "peer_id")
+        answer = _required(request, "answer")
+        pending = self._renegotiations.get(peer_id)
+        if pending is not None and not pending.done():
+            pending.set_result(answer)
+            return
+        connection = self._session(peer_id)
+        await connection.handle_answer(answer)
+
+    async def cmd_send(self, request: Dict) -> Dict:
+        peer_id = _required(request, "peer_id")
+        text = _required(request, "text")
+        if not isinstance(text, str):
+            raise DaemonError("Поле text должно быть строкой")
+        connection = self._session(peer_id)
+        # Как в окне чата: сообщение сохраняется и доставляется через очередь
+        stored = self.storage.add_message(
+            peer_id, {"text": text, "is_self": True},
+            request.get("expiry") or DEFAULT_MESSAGE_EXPIRY)
+        connection.outbox.send(stored["id"], text)
+        return {"id": stored["id"], "seq": stored["seq"]}
+
+    async def cmd_history(self, request: Dict) -> list:
+        return self.storage.load_chat_history(
+            _required(request, "peer_id"), request.get("before"),
+            request.get("limit") or HISTORY_PAGE_SIZE)
+
+    async def cmd_search(self, request: Dict) -> list:
+        return self.storage.search_messages(_required(request, "query"))
+
+    async def cmd_disconnect(self, request: Dict) -> None:
+        peer_id = _required(request, "peer_id")
+        if peer_id in self._sessions:
+            self._sessions.discard(peer_id)
+            self.connections.release(peer_id)
+            connection = self.connections.get(peer_id)
+            if connection is not None:
+                connection.renegotiate = None
+
+    async def cmd_metrics(self, request: Dict) -> Dict:
+        return {"enabled": metrics.enabled(), "text": metrics.render()}
+
+    # --- Клиенты ---
+
+    async def handle_client(self, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+        """Обработка команд одного клиента"""
+        authenticated = self.token is None
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Строка длиннее COMMAND_LINE_LIMIT: границы команд потеряны
+                    await self._respond(writer, {"id": None, "ok": False,
+                                                 "error": "Слишком длинная команда"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                if not authenticated:
+                    response = self._authenticate(line)
+                    await self._respond(writer, response)
+                    if not response["ok"]:
+                        break
+                    authenticated = True
+                    continue
+                await self._respond(writer, await self._execute(line, writer))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, response: Dict) -> None:
+        writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+        await writer.drain()
+
+    def _authenticate(self, line: bytes) -> Dict:
+        """Проверка первой команды соединения: auth с токеном демона"""
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            request = None
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "Требуется команда auth"}
+        token = request.get("token")
+        if (request.get("cmd") == "auth" and isinstance(token, str)
+                and hmac.compare_digest(token.encode(), self.token.encode())):
+            return {"id": request.get("id"), "ok": True, "result": None}
+        logger.warning("Отклонен клиент без верного токена")
+        return {"id": request.get("id"), "ok": False, "error": "Требуется команда auth"}
+
+    async def _execute(self, line: bytes, writer: asyncio.StreamWriter) -> Dict:
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise DaemonError("Команда должна быть JSON-объектом")
+            request_id = request.get("id")
+            cmd = request.get("cmd")
+            if cmd == "subscribe":
+                self._subscribers.add(writer)
+                return {"id": request_id, "ok": True, "result": None}
+            handler = self._commands.get(cmd)
+            if handler is None:
+                raise DaemonError(f"Неизвестная команда: {cmd}")
+            return {"id": request_id, "ok": True, "result": await handler(request)}
+        except (DaemonError, json.JSONDecodeError) as e:
+            return {"id": request_id, "ok": False, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Ошибка выполнения команды: {e}")
+            return {"id": request_id, "ok": False, "error": str(e)}
+
+    async def close(self) -> None:
+        """Закрытие соединений и подписок"""
+        for writer in list(self._subscribers):
+            writer.close()
+        self._subscribers.clear()
+        await self.connections.close_all()
+
+
+def _required(request: Dict, field: str) -> Any:
+    value = request.get(field)
+    if value in (None, ""):
+        raise DaemonError(f"Не указано поле {field}")
+    return value
+
+
+def write_token(path: Path) -> str:
+    """Новый токен клиентов TCP-порта в файле, доступном только владельцу"""
+    token = secrets.token_urlsafe(32)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Права задаются при создании: старый файл мог быть доступен другим
+    path.unlink(missing_ok=True)
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def load_identity(crypto: CryptoManager, storage: Storage) -> None:
+    """Загрузка ключей; при первом запуске они создаются"""
+    if storage.load_keys():
+        return
+    crypto.generate_keys()
+    storage.save_keys(*(base64.b64encode(key).decode() for key in (
+        crypto.get_public_key(), crypto.get_verify_key(),
+        crypto.get_private_key(), crypto.get_signing_key())))
+    logger.info("Созданы новые ключи")
+
+
+async def handle_metrics_request(reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+    """Ответ на HTTP-запрос метрик: GET /metrics, остальное - 404"""
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+            body = metrics.render().encode("utf-8")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"Not Found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+                     .encode("latin-1") + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: Path, port: Optional[int],
+                metrics_port: Optional[int] = None) -> None:
+    """Запуск демона до остановки процесса"""
+    crypto = CryptoManager()
+    storage = Storage()
+    storage.crypto = crypto
+    load_identity(crypto, storage)
+    unix = port is None and hasattr(asyncio, "start_unix_server")
+    daemon = ChatDaemon(crypto, storage, None if unix else write_token(DAEMON_TOKEN_FILE))
+
+    if unix:
+        socket_path.unlink(missing_ok=True)
+        # Сокет создается сразу с правами 0600, без окна до chmod
+        previous_umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(
+                daemon.handle_client, str(socket_path), limit=COMMAND_LINE_LIMIT)
+        finally:
+            os.umask(previous_umask)
+        logger.info(f"Демон слушает {socket_path}")
+    else:
+        # Без Unix-сокетов (Windows) - только локальный TCP с токеном
+        server = await asyncio.start_server(
+            daemon.handle_client, "127.0.0.1", port or DAEMON_PORT,
+            limit=COMMAND_LINE_LIMIT)
+        logger.info(f"Демон слушает 127.0.0.1:{port or DAEMON_PORT}, "
+                    f"токен в {DAEMON_TOKEN_FILE}")
+
+    metrics_server = None
+    if metrics_port is not None:
+        metrics.enable()
+        metrics_server = await asyncio.start_server(
+            handle_metrics_request, "127.0.0.1", metrics_port)
+        logger.info(f"Метрики: http://127.0.0.1:{metrics_port}/metrics")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        await daemon.close()
+        crypto.shutdown()
+        storage.close()
+        if unix:
+            socket_path.unlink(missing_ok=True)
+        else:
+            DAEMON_TOKEN_FILE.unlink(missing_ok=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="P2P Chat без графического интерфейса")
+    parser.add_argument("--socket", type=Path, default=DAEMON_SOCKET,
+                        help="путь Unix-сокета для команд")
+    parser.add_argument("--port", type=int, default=None,
+                        help="слушать локальный TCP-порт вместо Unix-сокета "
+                             "(клиенты входят с токеном из daemon.token)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="собирать метрики и отдавать их по HTTP")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help=f"порт HTTP для /metrics (по умолчанию {METRICS_PORT})")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    try:
+        asyncio.run(serve(args.socket, args.port,
+                          args.metrics_port if args.metrics else None))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
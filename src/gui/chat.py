@@ -1,14 +1,136 @@
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
-    QTextEdit, QLabel, QLineEdit, QMessageBox
+    QLabel, QLineEdit, QMessageBox, QListView, QFileDialog,
+    QStyledItemDelegate, QStyle, QAbstractItemView
 )
-from PySide6.QtCore import Qt, Signal, Slot, QTimer
+from PySide6.QtCore import (
+    Qt, Signal, Slot, QAbstractListModel, QModelIndex, QRect, QSize
+)
+from PySide6.QtGui import QFont, QFontMetrics
 from src.core.crypto import CryptoManager
 from src.core.network import P2PConnection
 from src.core.storage import Storage
-from src.utils.config import CHAT_HISTORY_LIMIT, DEFAULT_MESSAGE_EXPIRY
+from src.utils.config import DEFAULT_MESSAGE_EXPIRY, HISTORY_PAGE_SIZE
 import asyncio
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+
+class MessageListModel(QAbstractListModel):
+    """Модель сообщений чата в хронологическом порядке"""
+
+    SenderRole = Qt.UserRole + 1
+    SeqRole = Qt.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._messages: List[Dict] = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._messages)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self._messages[index.row()]
+        if role == Qt.DisplayRole:
+            return message["text"]
+        if role == self.SenderRole:
+            return message["sender"]
+        if role == self.SeqRole:
+            return message["seq"]
+        return None
+
+    def append_message(self, sender: str, text: str, seq: int) -> None:
+        """Добавление сообщения в конец"""
+        row = len(self._messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._messages.append({"sender": sender, "text": text, "seq": seq})
+        self.endInsertRows()
+
+    def prepend_messages(self, messages: List[Dict]) -> None:
+        """Добавление страницы более старых сообщений в начало"""
+        if not messages:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self._messages[:0] = messages
+        self.endInsertRows()
+
+    def clear(self) -> None:
+        """Удаление всех сообщений"""
+        self.beginResetModel()
+        self._messages = []
+        self.endResetModel()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    """Отрисовка сообщения: жирное имя отправителя и текст с переносами.
+
+    Высота строки зависит только от текста и ширины области, поэтому
+    она кэшируется по (seq, ширина) и считается один раз.
+    """
+
+    PADDING = 6
+
+    def __init__(self, view: QListView):
+        super().__init__(view)
+        self._view = view
+        self._heights: Dict[int, int] = {}
+        self._cached_width = -1
+
+    def clear_cache(self) -> None:
+        """Сброс высот: seq сообщений изменились после перезаписи истории"""
+        self._heights.clear()
+
+    def _sender_label(self, sender: str) -> str:
+        return "Вы:" if sender == "me" else f"{sender}:"
+
+    def _text_rect(self, width: int) -> QRect:
+        return QRect(0, 0, max(width - 2 * self.PADDING, 1), 0)
+
+    def sizeHint(self, option, index) -> QSize:
+        width = self._view.viewport().width()
+        if width != self._cached_width:
+            # Ширина изменилась - переносы строк пересчитываются заново
+            self._heights.clear()
+            self._cached_width = width
+
+        seq = index.data(MessageListModel.SeqRole)
+        height = self._heights.get(seq)
+        if height is None:
+            bold = QFont(option.font)
+            bold.setBold(True)
+            sender_height = QFontMetrics(bold).height()
+            text_height = option.fontMetrics.boundingRect(
+                self._text_rect(width), Qt.TextWordWrap,
+                index.data(Qt.DisplayRole)).height()
+            height = sender_height + text_height + 2 * self.PADDING
+            self._heights[seq] = height
+        return QSize(width, height)
+
+    def paint(self, painter, option, index) -> None:
+        painter.save()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+            painter.setPen(option.palette.highlightedText().color())
+        else:
+            painter.setPen(option.palette.text().color())
+
+        rect = option.rect.adjusted(
+            self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        bold = QFont(option.font)
+        bold.setBold(True)
+        painter.setFont(bold)
+        sender_height = QFontMetrics(bold).height()
+        painter.drawText(rect, Qt.AlignLeft | Qt.AlignTop,
+                         self._sender_label(index.data(MessageListModel.SenderRole)))
+
+        painter.setFont(option.font)
+        painter.drawText(rect.adjusted(0, sender_height, 0, 0),
+                         Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap,
+                         index.data(Qt.DisplayRole))
+        painter.restore()
 
 
 class ChatWindow(QWidget):
@@ -23,28 +145,16 @@ class ChatWindow(QWidget):
         self.storage = storage
         self.connection = connection
 
-        # Создаем локальный цикл событий для этого окна
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
+        # Курсор постраничной загрузки: seq самого старого показанного сообщения
+        self._oldest_seq = None
+        self._history_exhausted = False
 
-        # Таймер для обработки асинхронных задач
-        self.async_timer = QTimer()
-        self.async_timer.timeout.connect(self._process_async_tasks)
-        self.async_timer.start(50)  # Проверяем каждые 50 мс
+        # Общий цикл событий приложения
+        self.loop = asyncio.get_event_loop()
 
         self._create_ui()
         self._load_history()
 
-    def _process_async_tasks(self):
-        """Обработка асинхронных задач"""
-        try:
-            # Обрабатываем все ожидающие задачи
-            pending = asyncio.all_tasks(self.loop)
-            if pending:
-                self.loop.run_until_complete(asyncio.gather(*pending))
-        except Exception as e:
-            print(f"Ошибка в обработке асинхронных задач: {e}")
-
     def _create_ui(self):
         """Создание пользовательского интерфейса"""
         layout = QVBoxLayout(self)
@@ -54,9 +164,21 @@ class ChatWindow(QWidget):
         header.setAlignment(Qt.AlignCenter)
         layout.addWidget(header)
 
-        # История сообщений
-        self.history = QTextEdit()
-        self.history.setReadOnly(True)
+        # История сообщений: отрисовываются только видимые строки
+        self.messages_model = MessageListModel(self)
+        self.history = QListView()
+        self.history.setModel(self.messages_model)
+        self.history.setItemDelegate(MessageDelegate(self.history))
+        self.history.setUniformItemSizes(False)
+        self.history.setWordWrap(True)
+        self.history.setResizeMode(QListView.Adjust)
+        self.history.setLayoutMode(QListView.Batched)
+        self.history.setBatchSize(200)
+        self.history.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.history.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.history.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.history.verticalScrollBar().valueChanged.connect(
+            self._on_history_scrolled)
         layout.addWidget(self.history)
 
         # Поле ввода
@@ -70,21 +192,64 @@ class ChatWindow(QWidget):
         send_button.clicked.connect(self.send_message)
         input_layout.addWidget(send_button)
 
+        file_button = QPushButton("Файл...")
+        file_button.clicked.connect(self.send_file)
+        input_layout.addWidget(file_button)
+
         layout.addLayout(input_layout)
 
     def _load_history(self):
-        """Загрузка истории сообщений"""
-        messages = self.storage.load_chat_history(self.peer_id)
-        for msg in messages:
-            self._add_message_to_history(
-                msg.get("sender", self.peer_id), msg.get("text", ""))
-
-    def on_message_received(self, peer_id: str, message: str):
-        """Обработка полученного сообщения"""
+        """Загрузка последней страницы истории сообщений"""
+        messages = self.storage.load_chat_history(
+            self.peer_id, limit=HISTORY_PAGE_SIZE)
+        self._history_exhausted = len(messages) < HISTORY_PAGE_SIZE
+        if messages:
+            self._oldest_seq = messages[0]["seq"]
+        self.messages_model.prepend_messages(
+            [self._model_message(msg) for msg in messages])
+        self.history.scrollToBottom()
+
+    def _model_message(self, msg: dict) -> dict:
+        sender = "me" if msg.get("is_self") else msg.get("sender", self.peer_id)
+        return {"sender": sender, "text": msg.get("text", ""), "seq": msg["seq"]}
+
+    def _on_history_scrolled(self, value: int):
+        """Подгрузка более старой страницы при прокрутке к началу"""
+        scrollbar = self.history.verticalScrollBar()
+        if value == scrollbar.minimum() and scrollbar.maximum() > 0:
+            self._load_older_page()
+
+    def _load_older_page(self):
+        """Добавление в начало истории страницы более старых сообщений"""
+        if self._history_exhausted or self._oldest_seq is None:
+            return
+
+        messages = self.storage.load_chat_history(
+            self.peer_id, before=self._oldest_seq, limit=HISTORY_PAGE_SIZE)
+        self._history_exhausted = len(messages) < HISTORY_PAGE_SIZE
+        if not messages:
+            return
+        self._oldest_seq = messages[0]["seq"]
+
+        # Оставляем видимым сообщение, которое было верхним до подгрузки
+        self.messages_model.prepend_messages(
+            [self._model_message(msg) for msg in messages])
+        self.history.scrollTo(self.messages_model.index(len(messages), 0),
+                              QAbstractItemView.PositionAtTop)
+
+    def on_message_received(self, peer_id: str, stored: Dict):
+        """Показ полученного сообщения (уже сохранено пулом соединений)"""
         if peer_id == self.peer_id:
-            self._add_message_to_history(peer_id, message)
-            self.storage.add_message(
-                self.peer_id, {"sender": peer_id, "text": message})
+            self._add_message_to_history(peer_id, stored["text"], stored["seq"])
+
+    def on_history_replaced(self, peer_id: str):
+        """Загрузка истории заново: после слияния прежние seq недействительны"""
+        if peer_id != self.peer_id:
+            return
+        self._oldest_seq = None
+        self.messages_model.clear()
+        self.history.itemDelegate().clear_cache()
+        self._load_history()
 
     def on_connection_closed(self, peer_id: str):
         """Обработка закрытия соединения"""
@@ -99,6 +264,26 @@ class ChatWindow(QWidget):
         if not text:
             return
 
+        outbox = self.connection.outbox
+        if outbox is None:
+            self._send_direct(text)
+            return
+
+        # Сообщение сохраняется сразу и будет доставлено, когда контакт
+        # окажется в сети
+        message = {
+            "text": text,
+            "is_self": True,
+            "timestamp": datetime.now().isoformat()
+        }
+        stored = self.storage.add_message(
+            self.peer_id, message, DEFAULT_MESSAGE_EXPIRY)
+        outbox.send(stored["id"], text)
+        self._add_message_to_history("me", text, stored["seq"])
+        self.message_input.clear()
+
+    def _send_direct(self, text: str):
+        """Отправка без очереди доставки: только при открытом соединении"""
         try:
             # Создаем задачу для отправки сообщения
             async def send():
@@ -110,9 +295,9 @@ class ChatWindow(QWidget):
                         "is_self": True,
                         "timestamp": datetime.now().isoformat()
                     }
-                    self.storage.add_message(
+                    stored = self.storage.add_message(
                         self.peer_id, message, DEFAULT_MESSAGE_EXPIRY)
-                    self._add_message_to_history("me", text)
+                    self._add_message_to_history("me", text, stored["seq"])
                     # Очищаем поле ввода
                     self.message_input.clear()
                 except Exception as e:
@@ -120,27 +305,44 @@ class ChatWindow(QWidget):
                     QMessageBox.critical(self, "Ошибка",
                                          f"Не удалось отправить сообщение: {str(e)}")
 
-            # Запускаем задачу в локальном цикле событий
+            # Запускаем задачу в общем цикле событий
             self.loop.create_task(send())
 
         except Exception as e:
             QMessageBox.critical(self, "Ошибка",
                                  f"Не удалось отправить сообщение: {str(e)}")
 
-    def _add_message_to_history(self, sender: str, text: str):
+    def send_file(self):
+        """Выбор и отправка файла"""
+        path, _ = QFileDialog.getOpenFileName(self, "Отправить файл")
+        if not path:
+            return
+
+        async def send():
+            try:
+                await self.connection.send_file(Path(path))
+                text = f"Файл: {Path(path).name}"
+                message = {
+                    "text": text,
+                    "is_self": True,
+                    "timestamp": datetime.now().isoformat()
+                }
+                stored = self.storage.add_message(
+                    self.peer_id, message, DEFAULT_MESSAGE_EXPIRY)
+                self._add_message_to_history("me", text, stored["seq"])
+            except Exception as e:
+                QMessageBox.critical(self, "Ошибка",
+                                     f"Не удалось отправить файл: {str(e)}")
+
+        self.loop.create_task(send())
+
+    def _add_message_to_history(self, sender: str, text: str, seq: int):
         """Добавление сообщения в историю"""
-        if sender == "me":
-            self.history.append(f"<b>Вы:</b> {text}")
-        else:
-            self.history.append(f"<b>{sender}:</b> {text}")
-
-        # Ограничение истории
-        if self.history.document().blockCount() > CHAT_HISTORY_LIMIT:
-            cursor = self.history.textCursor()
-            cursor.movePosition(cursor.Start)
-            cursor.movePosition(cursor.Down, cursor.KeepAnchor,
-                                self.history.document().blockCount() - CHAT_HISTORY_LIMIT)
-            cursor.removeSelectedText()
+        scrollbar = self.history.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.messages_model.append_message(sender, text, seq)
+        if at_bottom:
+            self.history.scrollToBottom()
 
     def closeEvent(self, event):
         """Обработка закрытия окна"""
@@ -1,8 +1,10 @@
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton,
-    QLabel, QLineEdit, QMessageBox, QListWidget
+    QLabel, QLineEdit, QMessageBox, QListWidget, QListWidgetItem
 )
 from PySide6.QtCore import Qt
+from typing import Dict
+from src.core.contacts import CONTACT_ADDED, CONTACT_REMOVED
 from src.core.storage import Storage
 import logging
 
@@ -17,7 +19,14 @@ class ContactsDialog(QDialog):
         self.setMinimumSize(400, 500)
         self._create_ui()
         self._apply_theme()
+        self._contact_items: Dict[str, QListWidgetItem] = {}
         self.load_contacts()
+        self.storage.contact_index.subscribe(self._on_contacts_changed)
+
+    def done(self, result):
+        """Отписка от изменений контактов при закрытии диалога"""
+        self.storage.contact_index.unsubscribe(self._on_contacts_changed)
+        super().done(result)
 
     def _apply_theme(self):
         """Применение текущей темы"""
@@ -179,13 +188,29 @@ class ContactsDialog(QDialog):
         try:
             contacts = self.storage.get_contacts()
             self.contacts_list.clear()
+            self._contact_items.clear()
             for contact in contacts:
-                self.contacts_list.addItem(contact["public_key"])
+                self._add_contact_item(contact)
         except Exception as e:
             logger.error(f"Ошибка при загрузке контактов: {e}")
             QMessageBox.critical(
                 self, "Ошибка", "Не удалось загрузить контакты")
 
+    def _add_contact_item(self, contact: dict):
+        item = QListWidgetItem(contact["public_key"])
+        self._contact_items[contact["public_key"]] = item
+        self.contacts_list.addItem(item)
+
+    def _on_contacts_changed(self, event: str, contact: dict):
+        """Обновление одной строки списка при изменении контактов"""
+        key = contact["public_key"]
+        if event == CONTACT_ADDED and key not in self._contact_items:
+            self._add_contact_item(contact)
+        elif event == CONTACT_REMOVED:
+            item = self._contact_items.pop(key, None)
+            if item is not None:
+                self.contacts_list.takeItem(self.contacts_list.row(item))
+
     def add_contact(self):
         """Добавление нового контакта"""
         key = self.key_input.text().strip()
@@ -197,7 +222,6 @@ class ContactsDialog(QDialog):
         try:
             self.storage.add_contact(key)
             self.key_input.clear()
-            self.load_contacts()
             QMessageBox.information(self, "Успех", "Контакт успешно добавлен")
         except Exception as e:
             logger.error(f"Ошибка при добавлении контакта: {e}")
@@ -215,7 +239,6 @@ class ContactsDialog(QDialog):
         key = current_item.text()
         try:
             self.storage.delete_contact(key)
-            self.load_contacts()
             QMessageBox.information(self, "Успех", "Контакт успешно удален")
         except Exception as e:
             logger.error(f"Ошибка при удалении контакта: {e}")
@@ -1,18 +1,16 @@
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QLineEdit, QListWidget,
+    QPushButton, QLabel, QLineEdit, QListWidget, QListWidgetItem,
     QMessageBox, QSplitter, QDialog
 )
 from PySide6.QtCore import Qt, QTimer
 import asyncio
-from typing import Optional
+from typing import Dict, Optional
+from src.core.contacts import CONTACT_ADDED, CONTACT_REMOVED
 from src.core.crypto import CryptoManager
-from src.core.network import P2PConnection
+from src.core.network import P2PConnection, ConnectionManager
 from src.core.storage import Storage
-from src.gui.chat import ChatWindow
-from src.gui.login import LoginWindow
 from src.utils.config import WINDOW_MIN_WIDTH, WINDOW_MIN_HEIGHT
-from src.utils.themes import apply_theme
 from PySide6.QtGui import QAction
 from PySide6.QtCore import Slot
 
@@ -55,36 +53,40 @@ class MainWindow(QMainWindow):
         self.crypto = CryptoManager()
         self.storage = Storage()
         self.storage.crypto = self.crypto  # Добавляем crypto в storage
-        self.connection = P2PConnection(self.crypto)
+        self.connections = ConnectionManager(self.crypto, self.storage)
         self.current_connection: Optional[P2PConnection] = None
-
-        # Настройка асинхронного цикла событий
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-
-        # Таймер для обработки асинхронных задач
-        self.async_timer = QTimer()
-        self.async_timer.timeout.connect(self._process_async_tasks)
-        self.async_timer.start(50)  # Проверяем каждые 50 мс
+        self.current_peer_id: Optional[str] = None
+        self.current_chat = None
+        # Пул сохраняет принятые сообщения всех контактов, окно чата их только показывает
+        self.connections.message_stored = self._on_message_stored
+        self.connections.file_received = \
+            lambda peer_id, path, stored: self._on_message_stored(peer_id, stored)
+        self.connections.connection_closed = self._on_connection_closed
+        self.storage.history_replaced = self._on_history_replaced
+
+        # Общий цикл событий приложения (QEventLoop из main.py)
+        self.loop = asyncio.get_event_loop()
+        self._shutting_down = False
+        self._shutdown_done = False
 
         # Создание UI
         self._create_ui()
         self._create_menu()
 
-        # Проверка наличия ключей
+        # Строки списка контактов по ключу: изменения применяются построчно
+        self._contact_items: Dict[str, QListWidgetItem] = {}
+        self.storage.contact_index.subscribe(self._on_contacts_changed)
+        self.load_contacts()
+
+        # Ключи загружаются после показа окна: загрузка PyNaCl не
+        # задерживает первую отрисовку
+        QTimer.singleShot(0, self._load_identity)
+
+    def _load_identity(self):
+        """Загрузка ключей, при их отсутствии - окно входа"""
         if not self.storage.load_keys():
             self.show_login_window()
 
-    def _process_async_tasks(self):
-        """Обработка асинхронных задач"""
-        try:
-            # Обрабатываем все ожидающие задачи
-            pending = asyncio.all_tasks(self.loop)
-            if pending:
-                self.loop.run_until_complete(asyncio.gather(*pending))
-        except Exception as e:
-            print(f"Ошибка в обработке асинхронных задач: {e}")
-
     def _create_ui(self):
         """Создание пользовательского интерфейса"""
         # Главный виджет
@@ -102,6 +104,23 @@ class MainWindow(QMainWindow):
         left_panel = QWidget()
         left_layout = QVBoxLayout(left_panel)
 
+        # Поиск по сообщениям всех чатов
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Поиск сообщений...")
+        self.search_input.textChanged.connect(self._schedule_search)
+        left_layout.addWidget(self.search_input)
+
+        # Запрос выполняется после паузы в наборе
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(200)
+        self._search_timer.timeout.connect(self.run_search)
+
+        self.search_results = QListWidget()
+        self.search_results.itemClicked.connect(self.on_search_result_selected)
+        self.search_results.hide()
+        left_layout.addWidget(self.search_results)
+
         # Список контактов
         self.contacts_list = QListWidget()
         self.contacts_list.itemClicked.connect(self.on_contact_selected)
@@ -148,6 +167,10 @@ class MainWindow(QMainWindow):
         theme_action.triggered.connect(self.toggle_theme)
         settings_menu.addAction(theme_action)
 
+        settings_action = QAction("Параметры...", self)
+        settings_action.triggered.connect(self.show_settings)
+        settings_menu.addAction(settings_action)
+
         # Меню Помощь
         help_menu = menubar.addMenu("Помощь")
 
@@ -157,6 +180,7 @@ class MainWindow(QMainWindow):
 
     def show_login_window(self):
         """Показать окно входа"""
+        from src.gui.login import LoginWindow
         self.login_window = LoginWindow(self.crypto, self.storage)
         self.login_window.login_successful.connect(self.on_login_successful)
         self.login_window.show()
@@ -170,8 +194,24 @@ class MainWindow(QMainWindow):
     def load_contacts(self):
         """Загрузка списка контактов"""
         self.contacts_list.clear()
-        contacts = self.storage.get_contacts()
-        self.contacts_list.addItems([c["public_key"] for c in contacts])
+        self._contact_items.clear()
+        for contact in self.storage.get_contacts():
+            self._add_contact_item(contact)
+
+    def _add_contact_item(self, contact: dict):
+        item = QListWidgetItem(contact["public_key"])
+        self._contact_items[contact["public_key"]] = item
+        self.contacts_list.addItem(item)
+
+    def _on_contacts_changed(self, event: str, contact: dict):
+        """Обновление одной строки списка при изменении контактов"""
+        key = contact["public_key"]
+        if event == CONTACT_ADDED and key not in self._contact_items:
+            self._add_contact_item(contact)
+        elif event == CONTACT_REMOVED:
+            item = self._contact_items.pop(key, None)
+            if item is not None:
+                self.contacts_list.takeItem(self.contacts_list.row(item))
 
     def show_add_contact_dialog(self):
         """Показать диалог добавления контакта"""
@@ -181,7 +221,6 @@ class MainWindow(QMainWindow):
             if key:
                 try:
                     self.storage.add_contact(key)
-                    self.load_contacts()
                     QMessageBox.information(
                         self, "Успех", "Контакт успешно добавлен")
                     self.open_chat(key)  # Открыть чат сразу после добавления
@@ -194,33 +233,82 @@ class MainWindow(QMainWindow):
         peer_id = item.text()
         self.open_chat(peer_id)
 
+    def _schedule_search(self, text: str):
+        """Перезапуск отложенного поиска при изменении запроса"""
+        if not text.strip():
+            self._search_timer.stop()
+            self.search_results.clear()
+            self.search_results.hide()
+            return
+        self._search_timer.start()
+
+    def run_search(self):
+        """Поиск сообщений по индексу и вывод результатов"""
+        results = self.storage.search_messages(self.search_input.text())
+        self.search_results.clear()
+        if not results:
+            self.search_results.addItem("Ничего не найдено")
+        for result in results:
+            item = QListWidgetItem(
+                f"{result['peer_id'][:10]}...: {result['snippet']}")
+            item.setData(Qt.UserRole, result["peer_id"])
+            item.setToolTip(result["timestamp"] or "")
+            self.search_results.addItem(item)
+        self.search_results.show()
+
+    def on_search_result_selected(self, item):
+        """Открытие чата с найденным сообщением"""
+        peer_id = item.data(Qt.UserRole)
+        if peer_id:
+            self.open_chat(peer_id)
+
     def open_chat(self, peer_id: str):
         """Открыть чат с контактом"""
         # Очищаем правую панель
         for i in reversed(range(self.chat_widget.layout().count())):
             self.chat_widget.layout().itemAt(i).widget().setParent(None)
 
-        # Создаем новое соединение для чата
-        self.current_connection = P2PConnection(self.crypto)
+        # Берем соединение из пула: при повторном открытии чата
+        # рукопожатие не повторяется
+        if self.current_peer_id:
+            # Соединение остается в пуле и продолжает сохранять сообщения
+            self.connections.release(self.current_peer_id)
+            self.current_peer_id = None
+            self.current_chat = None
+        try:
+            self.current_connection = self.connections.acquire(peer_id)
+        except Exception as e:
+            QMessageBox.critical(
+                self, "Ошибка", f"Не удалось установить соединение: {str(e)}")
+            return
+        self.current_peer_id = peer_id
 
         # Создаем новое окно чата
+        from src.gui.chat import ChatWindow
         chat_window = ChatWindow(peer_id, self.crypto,
                                  self.storage, self.current_connection)
+        self.current_chat = chat_window
 
-        # Устанавливаем обработчики событий
-        self.current_connection.set_callbacks(
-            lambda msg: chat_window.on_message_received(peer_id, msg),
-            lambda: chat_window.on_connection_closed(peer_id)
-        )
+        self.chat_widget.layout().addWidget(chat_window)
 
-        # Инициализируем соединение
-        try:
-            self.loop.create_task(self.current_connection.create_connection())
-        except Exception as e:
-            QMessageBox.critical(
-                self, "Ошибка", f"Не удалось установить соединение: {str(e)}")
+    def _on_message_stored(self, peer_id: str, stored: Dict):
+        """Показ сохраненного пулом сообщения, если открыт чат с контактом"""
+        if self.current_chat is not None:
+            self.current_chat.on_message_received(peer_id, stored)
 
-        self.chat_widget.layout().addWidget(chat_window)
+    def _on_history_replaced(self, peer_id: str):
+        """Перезагрузка открытого чата, история которого перезаписана"""
+        if self.current_chat is not None:
+            self.current_chat.on_history_replaced(peer_id)
+
+    def _on_connection_closed(self, peer_id: str):
+        if self.current_chat is not None:
+            self.current_chat.on_connection_closed(peer_id)
+
+    def show_settings(self):
+        """Окно настроек: ключи и статистика"""
+        from src.gui.settings import SettingsDialog
+        SettingsDialog(self.storage, self).exec()
 
     def toggle_theme(self):
         """Переключение темы"""
@@ -229,6 +317,7 @@ class MainWindow(QMainWindow):
         new_theme = "dark" if current_theme == "light" else "light"
 
         # Применяем новую тему
+        from src.utils.themes import apply_theme
         self.setPalette(apply_theme(new_theme))
 
         # Сохраняем выбор темы
@@ -241,13 +330,28 @@ class MainWindow(QMainWindow):
                           "Версия 1.0\n\n"
                           "Безопасный P2P мессенджер с end-to-end шифрованием")
 
+    async def _shutdown(self):
+        """Асинхронное закрытие соединений перед выходом"""
+        try:
+            await self.connections.close_all()
+            self.crypto.shutdown()
+        except Exception as e:
+            print(f"Ошибка при закрытии окна: {e}")
+        self._shutdown_done = True
+        self.close()
+
     def closeEvent(self, event):
         """Обработка закрытия окна"""
+        if not self._shutdown_done:
+            # Соединения закрываются в цикле событий, окно закроется после
+            event.ignore()
+            if not self._shutting_down:
+                self._shutting_down = True
+                self.loop.create_task(self._shutdown())
+            return
         try:
-            if self.current_connection:
-                self.loop.run_until_complete(self.current_connection.close())
-            self.async_timer.stop()
-            self.loop.close()
+            self.storage.contact_index.unsubscribe(self._on_contacts_changed)
+            self.storage.close()
         except Exception as e:
             print(f"Ошибка при закрытии окна: {e}")
         event.accept()
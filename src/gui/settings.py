@@ -4,10 +4,11 @@ from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton,
     QLabel, QLineEdit, QMessageBox, QTabWidget,
     QWidget, QScrollArea, QFrame, QApplication,
-    QGroupBox
+    QGroupBox, QTableWidget, QTableWidgetItem, QHeaderView, QCheckBox
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QFont, QIcon
+from src.core import metrics
 from src.core.storage import Storage
 from src.utils.config import KEYS_DIR
 
@@ -292,11 +293,10 @@ class SettingsDialog(QDialog):
         # Получаем ключи
         try:
             logger.info("Загрузка ключей из хранилища")
-            keys = self.storage.get_keys()
+            keys = self.get_keys()
             if not keys:
                 logger.warning("Ключи не найдены в хранилище")
                 QMessageBox.warning(self, "Предупреждение", "Ключи не найдены")
-                return
 
             logger.info(f"Загружено {len(keys)} ключей")
             # Добавляем поля для каждого ключа
@@ -311,7 +311,6 @@ class SettingsDialog(QDialog):
             error_msg = f"Не удалось загрузить ключи: {str(e)}"
             logger.error(error_msg, exc_info=True)
             ErrorMessageBox("Ошибка", error_msg, self).exec()
-            return
 
         # Добавляем скролл в layout
         scroll.setWidget(scroll_content)
@@ -319,6 +318,7 @@ class SettingsDialog(QDialog):
 
         # Добавляем вкладку
         tab_widget.addTab(keys_tab, "Ключи")
+        tab_widget.addTab(self._create_stats_tab(), "Статистика")
 
         # Кнопки внизу окна
         button_layout = QHBoxLayout()
@@ -343,6 +343,45 @@ class SettingsDialog(QDialog):
 
         layout.addLayout(button_layout)
 
+    def _create_stats_tab(self) -> QWidget:
+        """Вкладка с текущими значениями метрик"""
+        stats_tab = QWidget()
+        stats_layout = QVBoxLayout(stats_tab)
+
+        self.metrics_checkbox = QCheckBox("Собирать статистику")
+        self.metrics_checkbox.setChecked(metrics.enabled())
+        self.metrics_checkbox.toggled.connect(self._toggle_metrics)
+        stats_layout.addWidget(self.metrics_checkbox)
+
+        self.metrics_table = QTableWidget(0, 2)
+        self.metrics_table.setHorizontalHeaderLabels(["Метрика", "Значение"])
+        self.metrics_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.metrics_table.verticalHeader().setVisible(False)
+        self.metrics_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        stats_layout.addWidget(self.metrics_table)
+
+        # Значения обновляются раз в секунду, пока окно открыто
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self._refresh_metrics)
+        self.metrics_timer.start(1000)
+        self._refresh_metrics()
+        return stats_tab
+
+    def _toggle_metrics(self, checked: bool):
+        """Включение и выключение сбора метрик"""
+        if checked:
+            metrics.enable()
+        else:
+            metrics.disable()
+
+    def _refresh_metrics(self):
+        """Обновление таблицы метрик"""
+        rows = metrics.snapshot()
+        self.metrics_table.setRowCount(len(rows))
+        for row, (name, value) in enumerate(rows):
+            self.metrics_table.setItem(row, 0, QTableWidgetItem(name))
+            self.metrics_table.setItem(row, 1, QTableWidgetItem(value))
+
     def get_keys(self) -> dict:
         """Получить все ключи из файла"""
         keys_file = KEYS_DIR / "keys.json"
@@ -1,10 +1,9 @@
+# Первым импортом: отсчет времени запуска начинается здесь
+from src.utils import startup
 import sys
 import asyncio
 import logging
 from pathlib import Path
-from PySide6.QtWidgets import QApplication
-from PySide6.QtCore import QTimer
-from src.gui.main_window import MainWindow
 
 
 def get_app_dir() -> Path:
@@ -28,20 +27,42 @@ logging.basicConfig(
 
 
 def main():
+    if "--profile-startup" in sys.argv:
+        sys.argv.remove("--profile-startup")
+        startup.enable()
+
+    # Qt и окно импортируются здесь, чтобы профиль учитывал их загрузку;
+    # aiortc и PyNaCl загружаются позже, при первом использовании
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QTimer
+    from qasync import QEventLoop
+    from src.gui.main_window import MainWindow
+    from src.utils.config import STARTUP_BUDGET_MS
+    startup.mark("модули интерфейса загружены")
+
     # Создаем приложение
     app = QApplication(sys.argv)
 
+    # Единый цикл asyncio, работающий внутри цикла событий Qt:
+    # сетевые события обрабатываются сразу, без опроса по таймеру
+    loop = QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    app_closed = asyncio.Event()
+    app.aboutToQuit.connect(app_closed.set)
+    startup.mark("QApplication создан")
+
     # Создаем главное окно
     window = MainWindow()
     window.show()
+    startup.mark("главное окно создано")
 
-    # Настраиваем обработку асинхронных задач
-    timer = QTimer()
-    # Пустой обработчик для обработки событий
-    timer.timeout.connect(lambda: None)
-    timer.start(100)  # Проверяем каждые 100 мс
+    if startup.enabled():
+        # Отчет после первой итерации цикла событий, когда окно отрисовано
+        QTimer.singleShot(0, lambda: startup.report(STARTUP_BUDGET_MS))
 
-    return app.exec()
+    with loop:
+        loop.run_until_complete(app_closed.wait())
+    return 0
 
 
 if __name__ == "__main__":
@@ -15,14 +15,23 @@ def get_app_dir() -> Path:
 
 # Базовые пути
 BASE_DIR = get_app_dir()
-DATA_DIR = BASE_DIR / "data"
+# P2P_CHAT_DATA_DIR переносит данные в другое место (бенчмарки, второй профиль)
+DATA_DIR = Path(os.environ.get("P2P_CHAT_DATA_DIR", BASE_DIR / "data"))
 KEYS_DIR = DATA_DIR / "keys"
 CHATS_DIR = DATA_DIR / "chats"
 CONFIG_DIR = DATA_DIR / "config"
+DOWNLOADS_DIR = DATA_DIR / "downloads"
+OUTBOX_DIR = DATA_DIR / "outbox"
+SETTINGS_FILE = DATA_DIR / "settings.json"
+CONTACTS_FILE = DATA_DIR / "contacts.json"
+
+
+
+def ensure_directories() -> None:
+    """Создание необходимых директорий (при запуске, а не при импорте)"""
+    for directory in [DATA_DIR, KEYS_DIR, CHATS_DIR, CONFIG_DIR]:
+        directory.mkdir(parents=True, exist_ok=True)
 
-# Создаем необходимые директории
-for directory in [DATA_DIR, KEYS_DIR, CHATS_DIR, CONFIG_DIR]:
-    directory.mkdir(parents=True, exist_ok=True)
 
 # Настройки сети
 DEFAULT_PORT = 5000
@@ -30,16 +39,44 @@ STUN_SERVERS = [
     "stun:stun.l.google.com:19302",
     "stun:stun1.l.google.com:19302"
 ]
+MAX_PEER_CONNECTIONS = 16  # Лимит одновременно открытых соединений в пуле
+PEER_IDLE_TIMEOUT = 10 * 60  # Закрытие неиспользуемого соединения, секунды
+IDLE_CHECK_INTERVAL = 30  # Период проверки простаивающих соединений, секунды
+RECEIVE_DELIVERY_CHUNK = 200  # Сообщений, передаваемых в GUI между уступками циклу
+SEND_HIGH_WATERMARK = 1024 * 1024  # Отправка ждет, пока буфер канала выше этого
+SEND_LOW_WATERMARK = 256 * 1024  # и продолжается, когда буфер опустится ниже этого
+MESSAGE_BATCH_WINDOW = 0  # Окно сбора исходящих сообщений в один кадр, секунды (0 - выключено)
+MESSAGE_BATCH_MAX_SIZE = 48 * 1024  # Пачка отправляется сразу при таком объеме текста
+OUTBOX_ACK_DELAY = 0.05  # Окно сбора подтверждений доставки в один кадр, секунды
+OUTBOX_ACK_BATCH = 200  # Подтверждения отправляются сразу при таком их количестве
+OUTBOX_DEDUP_SIZE = 1024  # Запоминаемых id принятых сообщений для отсева повторов
+SYNC_BATCH_SIZE = 200  # Сообщений в одном кадре синхронизации истории
+RECONNECT_ATTEMPTS = 6  # Попыток восстановить оборвавшееся соединение
+RECONNECT_BASE_DELAY = 0.25  # Пауза перед второй попыткой, дальше удваивается, секунды
+RECONNECT_MAX_DELAY = 10.0  # Предел паузы между попытками, секунды
+RECONNECT_ATTEMPT_TIMEOUT = 10.0  # Ожидание ответа и открытия канала в попытке, секунды
+RECONNECT_WAIT_TIMEOUT = 60.0  # Ожидание нового предложения от собеседника, секунды
+
+# Настройки передачи файлов
+FILE_CHUNK_SIZE = 16 * 1024  # Размер фрагмента файла до шифрования
+FILE_SEND_WINDOW = 64  # Фрагментов файла в очереди отправки одновременно
+FILE_STATE_SAVE_INTERVAL = 64  # Сохранение прогресса приема каждые N фрагментов
+FILE_MAX_SIZE = 4 * 1024 ** 3  # Максимальный размер принимаемого файла
+FILE_REPLY_TIMEOUT = 60  # Ожидание ответа получателя на предложение и завершение (сек)
 
 # Настройки криптографии
 CURVE = "curve25519"
 KEY_SIZE = 32  # bytes
 NONCE_SIZE = 24  # bytes for XChaCha20-Poly1305
+CRYPTO_CACHE_SIZE = 256  # Собеседников в кэше общих ключей
+CRYPTO_WORKERS = min(os.cpu_count() or 2, 8)  # Потоков пакетной расшифровки
+CRYPTO_PARALLEL_THRESHOLD = 64  # Меньшие пачки расшифровываются в текущем потоке
 
 # Настройки GUI
 WINDOW_MIN_WIDTH = 800
 WINDOW_MIN_HEIGHT = 600
-CHAT_HISTORY_LIMIT = 1000
+HISTORY_PAGE_SIZE = 50  # Сообщений на одну подгружаемую страницу истории
+STARTUP_BUDGET_MS = 300  # Цель: окно на экране за это время от запуска
 DEFAULT_THEME = "light"
 
 # Настройки безопасности
@@ -47,6 +84,31 @@ MESSAGE_EXPIRY = 7 * 24 * 60 * 60  # 7 дней в секундах
 MAX_MESSAGE_SIZE = 1024 * 1024  # 1MB
 DEFAULT_MESSAGE_EXPIRY = 24 * 60 * 60  # 24 часа в секундах
 
+# Настройки хранилища
+STORAGE_BACKEND = "files"  # "files" - JSON и журналы чатов, "sqlite" - единая база
+DATABASE_FILE = DATA_DIR / "p2p-chat.db"
+SEARCH_DB_FILE = DATA_DIR / "search.db"  # Полнотекстовый индекс сообщений
+SEARCH_RESULTS_LIMIT = 50
+JSON_FLUSH_DELAY = 0.5  # Задержка записи измененных настроек и контактов, сек
+JSON_CHECK_INTERVAL = 1.0  # Период проверки внешних изменений этих файлов, сек
+FSYNC_BATCH_WINDOW = 0.02  # Окно группового fsync дописываний в журналы, сек
+CHAT_SEGMENT_SIZE = 1024 * 1024  # Максимальный размер сегмента журнала чата
+CHAT_COMPACT_INTERVAL = 1000  # Уплотнение журнала каждые N добавленных сообщений
+EXPIRY_BATCH_SIZE = 500  # Истекших сообщений, удаляемых за одно пробуждение
+EXPIRY_MIN_INTERVAL = 5.0  # Минимальный интервал между пробуждениями удаления, сек
+CHAT_GARBAGE_THRESHOLD = 500  # Истекших записей в журнале чата до его уплотнения
+EXPIRY_INDEX_GARBAGE = 10000  # Извлеченных записей индекса сроков до его перезаписи
+
+# Метрики (src/core/metrics.py)
+METRICS_ENABLED = os.environ.get("P2P_CHAT_METRICS") == "1"  # Сбор с запуска
+METRICS_PORT = 9464  # HTTP-порт /metrics демона (--metrics)
+
+# Настройки фонового режима (src/daemon.py)
+DAEMON_SOCKET = DATA_DIR / "daemon.sock"  # Unix-сокет для команд клиентов
+DAEMON_PORT = 5050  # Локальный TCP-порт, если Unix-сокеты недоступны
+DAEMON_TOKEN_FILE = DATA_DIR / "daemon.token"  # Токен клиентов TCP-порта (0600)
+DAEMON_SUBSCRIBER_BUFFER = 4 * 1024 * 1024  # Предел неотправленных событий подписчику
+
 # Настройки сборки
 BUILD_DIR = BASE_DIR / "build"
 DIST_DIR = BASE_DIR / "dist"
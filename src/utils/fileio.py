@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+from .config import FSYNC_BATCH_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Счетчики записи и восстановления после сбоев:
+#   fsyncs              - выполненные fsync
+#   synced_writes       - записи, ставшие устойчивыми через групповой fsync
+#   truncated_records   - оборванные записи, отсеченные в конце журнала
+#   compactions_redone  - уплотнения журнала, доведенные до конца при запуске
+#   compactions_undone  - уплотнения журнала, отмененные при запуске
+#   corrupt_files       - поврежденные файлы, замененные или перестроенные
+io_stats: Counter = Counter()
+
+
+def fsync_dir(path: Path) -> None:
+    """fsync директории, чтобы переименование в ней пережило сбой"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        # Windows не открывает директории, там rename фиксируется сам
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Запись файла целиком: временный файл, fsync, переименование.
+
+    При сбое на диске остается либо старое, либо новое содержимое.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path.parent)
+    io_stats["fsyncs"] += 2
+
+
+def atomic_write_json(path: Path, data: Any, **kwargs) -> None:
+    """Атомарная запись JSON-документа"""
+    kwargs.setdefault("indent", 2)
+    atomic_write_bytes(path, json.dumps(data, **kwargs).encode("utf-8"))
+
+
+class FsyncBatcher:
+    """Групповой fsync дописываемых файлов.
+
+    Запись только сбрасывается в ОС и регистрирует файл, а fsync всех
+    зарегистрированных файлов выполняется одним проходом через окно
+    window: сколько бы сообщений ни пришло за окно, каждый файл
+    синхронизируется один раз. Перед закрытием файла его нужно
+    передать в release().
+    """
+
+    def __init__(self, window: float = FSYNC_BATCH_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending: Dict[int, BinaryIO] = {}
+        self._writes = 0
+        self._timer: Optional[threading.Timer] = None
+
+    def schedule(self, f: BinaryIO) -> None:
+        """Файл дописан и должен быть синхронизирован в ближайшем окне"""
+        with self._lock:
+            self._pending[id(f)] = f
+            self._writes += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _sync(self, f: BinaryIO) -> None:
+        try:
+            os.fsync(f.fileno())
+            io_stats["fsyncs"] += 1
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка fsync {getattr(f, 'name', f)}: {e}")
+
+    def release(self, f: BinaryIO) -> None:
+        """Синхронизация файла перед закрытием, если он ожидает fsync"""
+        with self._lock:
+            if self._pending.pop(id(f), None) is not None:
+                self._sync(f)
+
+    def flush(self) -> None:
+        """fsync всех ожидающих файлов"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for f in self._pending.values():
+                self._sync(f)
+            self._pending.clear()
+            io_stats["synced_writes"] += self._writes
+            self._writes = 0
+
+
+# Общий на процесс: журналы всех чатов синхронизируются одним проходом
+fsync_batcher = FsyncBatcher()
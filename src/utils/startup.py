@@ -0,0 +1,97 @@
+"""Профилирование запуска (флаг --profile-startup).
+
+Замеряет время импорта каждого модуля и отметки этапов запуска
+от загрузки этого модуля, который main.py импортирует первым.
+"""
+import sys
+import time
+import builtins
+import importlib.util
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+_START = time.perf_counter()
+
+_original_import = None
+# Собственное время импорта модулей (без вложенных импортов), секунды
+_self_times: Dict[str, float] = {}
+# Стек импортов: [имя, время начала, время вложенных импортов]
+_stack: List[list] = []
+_marks: List[Tuple[str, float]] = []
+
+
+def elapsed_ms() -> float:
+    """Миллисекунды с начала запуска"""
+    return (time.perf_counter() - _START) * 1000
+
+
+def _resolve(name: str, globals_: Optional[dict], level: int) -> str:
+    if level and globals_:
+        try:
+            return importlib.util.resolve_name(
+                "." * level + name, globals_.get("__package__") or "")
+        except (ImportError, ValueError):
+            pass
+    return name
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    module_name = _resolve(name, globals, level)
+    if module_name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    frame = [module_name, time.perf_counter(), 0.0]
+    _stack.append(frame)
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _stack.pop()
+        total = time.perf_counter() - frame[1]
+        _self_times[module_name] = _self_times.get(module_name, 0.0) + total - frame[2]
+        if _stack:
+            _stack[-1][2] += total
+
+
+def enable() -> None:
+    """Включение замера импортов"""
+    global _original_import
+    if _original_import is None:
+        _original_import = builtins.__import__
+        builtins.__import__ = _timed_import
+
+
+def enabled() -> bool:
+    return _original_import is not None
+
+
+def mark(stage: str) -> None:
+    """Отметка завершения этапа запуска"""
+    if enabled():
+        _marks.append((stage, elapsed_ms()))
+
+
+def report(budget_ms: float, limit: int = 15) -> None:
+    """Вывод разбивки времени запуска в stderr и отключение замера"""
+    global _original_import
+    if not enabled():
+        return
+    builtins.__import__ = _original_import
+    _original_import = None
+
+    total_ms = elapsed_ms()
+    by_package: Dict[str, float] = defaultdict(float)
+    for module_name, seconds in _self_times.items():
+        by_package[module_name.split(".")[0]] += seconds
+
+    out = sys.stderr
+    print("Профиль запуска:", file=out)
+    for stage, at_ms in _marks:
+        print(f"  {at_ms:8.1f} мс  {stage}", file=out)
+    print(f"Импорт по пакетам ({len(_self_times)} модулей, "
+          f"{sum(_self_times.values()) * 1000:.1f} мс):", file=out)
+    for package, seconds in sorted(
+            by_package.items(), key=lambda item: item[1], reverse=True)[:limit]:
+        print(f"  {seconds * 1000:8.1f} мс  {package}", file=out)
+    verdict = "в пределах" if total_ms <= budget_ms else "ПРЕВЫШАЕТ"
+    print(f"Окно показано через {total_ms:.1f} мс - {verdict} "
+          f"бюджета {budget_ms:.0f} мс", file=out)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Данные тестов - во временном каталоге, до импорта конфигурации
+os.environ["P2P_CHAT_DATA_DIR"] = tempfile.mkdtemp(prefix="p2p-chat-tests-")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.chdir(os.environ["P2P_CHAT_DATA_DIR"])
@@ -0,0 +1,142 @@
+import json
+import pathlib
+from datetime import datetime, timedelta
+import pytest
+from src.core.chatlog import COMPACT_MARKER, ChatLog
+from src.core.storage import Storage
+from src.utils.config import CHATS_DIR
+
+
+class Crash(Exception):
+    pass
+
+
+def filled_log(directory, count=20, segment_size=200):
+    log = ChatLog(directory, segment_size=segment_size)
+    for i in range(count):
+        log.append({"text": f"m{i}"})
+    log.close()
+    return log
+
+
+def texts(messages):
+    return [m["text"] for m in messages]
+
+
+def test_segments_and_order(tmp_path):
+    filled_log(tmp_path, 20)
+    assert len(list(tmp_path.glob("*.log"))) > 1
+    log = ChatLog(tmp_path, segment_size=200)
+    assert texts(log.read_all()) == [f"m{i}" for i in range(20)]
+    assert log.append({"text": "m20"})["seq"] == 21
+
+
+def test_torn_tail_truncated(tmp_path):
+    filled_log(tmp_path, 5, segment_size=1024)
+    segment = sorted(tmp_path.glob("*.log"))[-1]
+    intact = segment.stat().st_size
+    with open(segment, "ab") as f:
+        f.write(b"\x00\x00\x01\x00oborvano")
+    log = ChatLog(tmp_path, segment_size=1024)
+    assert segment.stat().st_size == intact
+    assert texts(log.read_all()) == [f"m{i}" for i in range(5)]
+
+
+def test_bad_crc_cuts_last_record(tmp_path):
+    filled_log(tmp_path, 5, segment_size=1024)
+    segment = sorted(tmp_path.glob("*.log"))[-1]
+    data = bytearray(segment.read_bytes())
+    data[-2] ^= 0xFF
+    segment.write_bytes(bytes(data))
+    log = ChatLog(tmp_path, segment_size=1024)
+    assert texts(log.read_all()) == [f"m{i}" for i in range(4)]
+    assert log.append({"text": "new"})["seq"] == 5
+
+
+def test_read_page_across_segments(tmp_path):
+    log = filled_log(tmp_path, 20)
+    assert texts(log.read_page(None, 3, lambda m: True)) == ["m17", "m18", "m19"]
+    assert texts(log.read_page(12, 4, lambda m: True)) == ["m7", "m8", "m9", "m10"]
+    odd = log.read_page(12, 3, lambda m: m["seq"] % 2)
+    assert [m["seq"] for m in odd] == [7, 9, 11]
+    assert len(log.read_page(12, None, lambda m: True)) == 11
+    log.append({"text": "m20"})
+    assert texts(log.read_page(None, 2, lambda m: True)) == ["m19", "m20"]
+
+
+def rewrite_with_crash(directory, monkeypatch, crash_at):
+    """Уплотнение, прерванное на crash_at-й операции unlink/replace"""
+    log = filled_log(directory)
+    kept = [m for m in log.read_all() if m["seq"] % 3]
+    calls = {"count": 0}
+    original_unlink, original_replace = pathlib.Path.unlink, pathlib.Path.replace
+
+    def counted(original):
+        def operation(self, *args, **kwargs):
+            if calls["count"] == crash_at:
+                raise Crash()
+            calls["count"] += 1
+            return original(self, *args, **kwargs)
+        return operation
+
+    monkeypatch.setattr(pathlib.Path, "unlink", counted(original_unlink))
+    monkeypatch.setattr(pathlib.Path, "replace", counted(original_replace))
+    crashed = False
+    try:
+        log.rewrite(kept)
+    except Crash:
+        crashed = True
+    finally:
+        monkeypatch.undo()
+    return kept, crashed
+
+
+def test_rewrite_survives_crash_at_every_step(tmp_path, monkeypatch):
+    everything = [f"m{i}" for i in range(20)]
+    step = 0
+    while True:
+        directory = tmp_path / str(step)
+        kept, crashed = rewrite_with_crash(directory, monkeypatch, step)
+        committed = (directory / COMPACT_MARKER).exists() or not crashed
+        result = texts(ChatLog(directory, segment_size=200).read_all())
+        assert result == (texts(kept) if committed else everything), step
+        assert not (directory / COMPACT_MARKER).exists()
+        assert not list(directory.glob("*.new"))
+        if not crashed:
+            break
+        step += 1
+    assert step > 3
+
+
+def test_legacy_json_history_migrated():
+    peer_id = "legacy-peer"
+    legacy = CHATS_DIR / f"{peer_id}.json"
+    CHATS_DIR.mkdir(parents=True, exist_ok=True)
+    legacy.write_text(json.dumps({"messages": [
+        {"text": "старое", "expiry": 60,
+         "timestamp": (datetime.now() + timedelta(days=1)).isoformat()},
+        {"text": "без срока"}]}))
+    storage = Storage()
+    try:
+        history = storage.load_chat_history(peer_id)
+        assert texts(history) == ["старое", "без срока"]
+        assert history[0]["expires_at"] > 0
+        assert not legacy.exists()
+        assert [r["seq"] for r in storage.search_messages("старое")] == [history[0]["seq"]]
+    finally:
+        storage.close()
+
+
+def test_rewrite_crash_before_marker_keeps_old_log(tmp_path, monkeypatch):
+    log = filled_log(tmp_path)
+
+    def crash(*args, **kwargs):
+        raise Crash()
+
+    monkeypatch.setattr("src.core.chatlog.atomic_write_json", crash)
+    with pytest.raises(Crash):
+        log.rewrite(log.read_all()[:5])
+    monkeypatch.undo()
+    assert texts(ChatLog(tmp_path, segment_size=200).read_all()) == \
+        [f"m{i}" for i in range(20)]
+    assert not list(tmp_path.glob("*.new"))
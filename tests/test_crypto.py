@@ -0,0 +1,84 @@
+import pytest
+from src.core.crypto import CryptoManager
+from src.core.wire import FLAG_BATCH
+
+
+@pytest.fixture
+def alice():
+    crypto = CryptoManager()
+    crypto.generate_keys()
+    return crypto
+
+
+@pytest.fixture
+def bob():
+    crypto = CryptoManager()
+    crypto.generate_keys()
+    return crypto
+
+
+def test_round_trip_between_peers(alice, bob):
+    frame = alice.encrypt_message("привет", bob.get_public_key())
+    assert bob.decrypt_message(frame, alice.get_public_key()) == "привет"
+
+
+def test_batch_round_trip_between_peers(alice, bob):
+    messages = [f"сообщение {i}" for i in range(10)]
+    frame = alice.encrypt_messages(messages, bob.get_public_key())
+    assert bob.decrypt_texts(frame, alice.get_public_key()) == messages
+
+
+def test_parallel_decrypt_keeps_order(alice, bob):
+    frames = [alice.encrypt_message(str(i), bob.get_public_key()) for i in range(200)]
+    decrypted = bob.decrypt_messages(frames, alice.get_public_key())
+    bob.shutdown()
+    assert decrypted == [[str(i)] for i in range(200)]
+
+
+def test_frame_from_other_sender_rejected(alice, bob):
+    mallory = CryptoManager()
+    mallory.generate_keys()
+    frame = mallory.encrypt_message("подделка", bob.get_public_key())
+    with pytest.raises(ValueError):
+        bob.decrypt_message(frame, alice.get_public_key())
+    assert bob.decrypt_messages([frame], alice.get_public_key()) == [[]]
+
+
+def test_tampered_flags_rejected(alice, bob):
+    frame = bytearray(alice.encrypt_message("текст", bob.get_public_key()))
+    frame[1] ^= FLAG_BATCH
+    with pytest.raises(ValueError):
+        bob.decrypt_texts(bytes(frame), alice.get_public_key())
+
+
+def test_tampered_ciphertext_rejected(alice, bob):
+    frame = bytearray(alice.encrypt_message("текст", bob.get_public_key()))
+    frame[-1] ^= 0xFF
+    with pytest.raises(ValueError):
+        bob.decrypt_message(bytes(frame), alice.get_public_key())
+
+
+def test_box_cache_reused_and_bounded(bob):
+    alice = CryptoManager(cache_size=2)
+    alice.generate_keys()
+    carol, dave = CryptoManager(), CryptoManager()
+    carol.generate_keys()
+    dave.generate_keys()
+    peers = [bob.get_public_key(), carol.get_public_key(), dave.get_public_key()]
+
+    box = alice._box(peers[0])
+    assert alice._box(peers[0]) is box
+    alice._box(peers[1])
+    alice._box(peers[0])
+    # Лимит 2: вытесняется давно использованный ключ carol
+    alice._box(peers[2])
+    assert list(alice._boxes) == [peers[0], peers[2]]
+
+    alice.invalidate_peer(peers[0])
+    assert alice._box(peers[0]) is not box
+    frame = alice.encrypt_message("после сброса", peers[0])
+    assert bob.decrypt_message(frame, alice.get_public_key()) == "после сброса"
+
+    # Новые собственные ключи - кэш общих ключей недействителен
+    alice.generate_keys()
+    assert not alice._boxes
@@ -0,0 +1,163 @@
+import asyncio
+import base64
+import json
+import pytest
+import pytest_asyncio
+from src.core.crypto import CryptoManager
+from src.core.network import P2PConnection
+from src.core.storage import Storage
+from src.daemon import ChatDaemon, load_identity, write_token
+
+
+class Client:
+    """Клиент протокола демона (NDJSON) поверх пары потоков"""
+
+    def __init__(self, reader, writer):
+        self.writer = writer
+        self._next_id = 0
+        self._responses = {}
+        self.events = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if "event" in message:
+                self.events.put_nowait(message)
+            else:
+                self._responses.pop(message["id"]).set_result(message)
+
+    async def call(self, cmd: str, **params):
+        self._next_id += 1
+        future = self._responses[self._next_id] = asyncio.get_event_loop().create_future()
+        self.writer.write((json.dumps({"id": self._next_id, "cmd": cmd, **params}) + "\n")
+                          .encode())
+        message = await asyncio.wait_for(future, 15)
+        assert message["ok"], message.get("error")
+        return message["result"]
+
+    def close(self):
+        self._task.cancel()
+        self.writer.close()
+
+
+@pytest_asyncio.fixture
+async def daemon(tmp_path):
+    crypto = CryptoManager()
+    storage = Storage()
+    storage.crypto = crypto
+    load_identity(crypto, storage)
+    daemon = ChatDaemon(crypto, storage)
+    server = await asyncio.start_unix_server(daemon.handle_client, str(tmp_path / "d.sock"))
+    reader, writer = await asyncio.open_unix_connection(str(tmp_path / "d.sock"))
+    client = Client(reader, writer)
+    yield daemon, client
+    client.close()
+    server.close()
+    await daemon.close()
+    storage.close()
+
+
+async def wait_until(predicate, timeout: float = 15.0):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_event_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_offer_answer_through_daemon(daemon):
+    chat_daemon, client = daemon
+    identity = await client.call("identity")
+
+    peer_crypto = CryptoManager()
+    peer_crypto.generate_keys()
+    peer_id = base64.b64encode(peer_crypto.get_public_key()).decode()
+    peer = P2PConnection(peer_crypto, base64.b64decode(identity["public_key"]),
+                         ice_servers=[])
+    received = []
+    peer.set_callbacks(lambda text, message_id: received.append(json.loads(text)), None)
+
+    await client.call("subscribe")
+    offer = (await client.call("offer", peer_id=peer_id))["offer"]
+    await client.call("accept", peer_id=peer_id, answer=await peer.handle_offer(offer))
+    await wait_until(lambda: peer.is_connected)
+
+    sent = await client.call("send", peer_id=peer_id, text="из демона")
+    await wait_until(lambda: received)
+    assert received[0]["id"] == sent["id"]
+    assert received[0]["text"] == "из демона"
+
+    peer.send_message("из соединения")
+    event = await asyncio.wait_for(client.events.get(), 15)
+    assert event["event"] == "message"
+    assert event["text"] == "из соединения"
+
+    peers = await client.call("peers")
+    assert peers == [{"peer_id": peer_id, "connected": True,
+                      "reconnecting": False, "closed": False}]
+    await peer.close()
+
+
+@pytest.mark.asyncio
+async def test_answer_through_daemon(daemon):
+    chat_daemon, client = daemon
+    identity = await client.call("identity")
+
+    peer_crypto = CryptoManager()
+    peer_crypto.generate_keys()
+    peer_id = base64.b64encode(peer_crypto.get_public_key()).decode()
+    peer = P2PConnection(peer_crypto, base64.b64decode(identity["public_key"]),
+                         ice_servers=[])
+
+    answer = (await client.call("answer", peer_id=peer_id,
+                                offer=await peer.create_offer()))["answer"]
+    await peer.handle_answer(answer)
+    await wait_until(lambda: peer.is_connected)
+    await wait_until(lambda: chat_daemon.connections.get(peer_id).is_connected)
+    await peer.close()
+
+
+@pytest.mark.asyncio
+async def test_bad_commands_answered_with_errors(daemon, tmp_path):
+    chat_daemon, client = daemon
+    with pytest.raises(AssertionError, match="строкой"):
+        await client.call("send", peer_id="K" * 44, text=["не", "строка"])
+
+    server = await asyncio.start_unix_server(
+        chat_daemon.handle_client, str(tmp_path / "small.sock"), limit=64)
+    reader, writer = await asyncio.open_unix_connection(str(tmp_path / "small.sock"))
+    writer.write(b'{"id": 1, "cmd": "identity", "pad": "' + b"x" * 200 + b'"}\n')
+    response = json.loads(await asyncio.wait_for(reader.readline(), 15))
+    assert response["ok"] is False
+    assert await reader.readline() == b""
+    writer.close()
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_tcp_requires_token(tmp_path):
+    token = write_token(tmp_path / "daemon.token")
+    assert (tmp_path / "daemon.token").stat().st_mode & 0o777 == 0o600
+    storage = Storage()
+    chat_daemon = ChatDaemon(CryptoManager(), storage, token)
+    server = await asyncio.start_server(chat_daemon.handle_client, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b'{"id": 1, "cmd": "contacts"}\n')
+    assert json.loads(await reader.readline())["ok"] is False
+    assert await reader.readline() == b""
+    writer.close()
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    client = Client(reader, writer)
+    await client.call("auth", token=token)
+    assert isinstance(await client.call("contacts"), list)
+    client.close()
+    server.close()
+    await chat_daemon.close()
+    storage.close()
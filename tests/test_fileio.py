@@ -0,0 +1,63 @@
+import json
+import os
+import time
+import pytest
+from src.utils import fileio
+from src.utils.fileio import FsyncBatcher, atomic_write_bytes, atomic_write_json, io_stats
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """Номера дескрипторов, переданные в fsync"""
+    calls = []
+    original = os.fsync
+
+    def fsync(fd):
+        calls.append(fd)
+        original(fd)
+
+    monkeypatch.setattr(fileio.os, "fsync", fsync)
+    return calls
+
+
+def test_batcher_syncs_each_file_once_per_window(tmp_path, fsyncs):
+    batcher = FsyncBatcher(window=0.05)
+    synced = io_stats["synced_writes"]
+    with open(tmp_path / "a", "ab") as a, open(tmp_path / "b", "ab") as b:
+        for f in (a, a, a, b):
+            f.write(b"x")
+            f.flush()
+            batcher.schedule(f)
+        assert fsyncs == []
+        deadline = time.monotonic() + 5
+        while io_stats["synced_writes"] - synced < 4 or batcher._pending:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert sorted(fd for fd in fsyncs if fd in (a.fileno(), b.fileno())) == \
+            sorted([a.fileno(), b.fileno()])
+
+
+def test_release_syncs_pending_file_before_close(tmp_path, fsyncs):
+    batcher = FsyncBatcher(window=60)
+    with open(tmp_path / "a", "ab") as a, open(tmp_path / "b", "ab") as b:
+        batcher.schedule(a)
+        batcher.release(a)
+        batcher.release(b)
+        assert fsyncs == [a.fileno()]
+        batcher.flush()
+        assert fsyncs == [a.fileno()]
+
+
+def test_atomic_write_keeps_old_content_on_failure(tmp_path, monkeypatch):
+    path = tmp_path / "state.json"
+    atomic_write_json(path, {"v": 1})
+    assert json.loads(path.read_text()) == {"v": 1}
+    assert not list(tmp_path.glob("*.tmp"))
+
+    def crash(src, dst):
+        raise OSError("сбой перед переименованием")
+
+    monkeypatch.setattr(fileio.os, "replace", crash)
+    with pytest.raises(OSError):
+        atomic_write_bytes(path, b"oborvano")
+    assert json.loads(path.read_text()) == {"v": 1}
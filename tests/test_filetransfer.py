@@ -0,0 +1,112 @@
+import asyncio
+import json
+import pytest
+from src.core.filetransfer import CHUNK_HEADER, FileTransferManager, IncomingTransfer
+from src.utils.config import FILE_CHUNK_SIZE, FILE_MAX_SIZE, FILE_REPLY_TIMEOUT
+
+TRANSFER_ID = bytes(range(16))
+
+
+class Mux:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, name, data):
+        self.sent.append(data)
+
+
+def offer(size, chunk_size=4, chunks=None):
+    return {"type": "file_offer", "transfer_id": TRANSFER_ID.hex(), "name": "a.bin",
+            "size": size, "chunk_size": chunk_size,
+            "chunks": -(-size // chunk_size) if chunks is None else chunks}
+
+
+@pytest.mark.parametrize("message", [
+    offer(FILE_MAX_SIZE + 1),
+    offer(10, chunks=100),
+    offer(10, chunk_size=0, chunks=0),
+])
+def test_bad_offer_rejected(tmp_path, message):
+    manager = FileTransferManager(None, Mux(), downloads_dir=tmp_path)
+    manager._on_control(message)
+    assert json.loads(manager.mux.sent[0])["type"] == "file_reject"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_chunks_outside_declared_file_rejected(tmp_path):
+    transfer = IncomingTransfer(offer(10), tmp_path)
+    with pytest.raises(ValueError):
+        transfer.write_chunk(3, memoryview(b"xx"))
+    with pytest.raises(ValueError):
+        transfer.write_chunk(2, memoryview(b"xxxx"))
+    transfer.write_chunk(2, memoryview(b"xx"))
+    transfer.close()
+    assert transfer.part_path.stat().st_size == 10
+
+
+def test_chunk_of_accepted_offer_written(tmp_path):
+    manager = FileTransferManager(None, Mux(), downloads_dir=tmp_path)
+    manager._on_control(offer(6))
+    assert json.loads(manager.mux.sent[0])["type"] == "file_accept"
+    manager._on_chunk(CHUNK_HEADER.pack(TRANSFER_ID, 0) + b"abcd")
+    manager._on_chunk(CHUNK_HEADER.pack(TRANSFER_ID, 1) + b"ef")
+    manager._on_control({"type": "file_complete", "transfer_id": TRANSFER_ID.hex()})
+    assert (tmp_path / "a.bin").read_bytes() == b"abcdef"
+
+
+class QueuedMux:
+    """Поток file, в котором данные уходят только по команде теста"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, name, data):
+        future = asyncio.get_event_loop().create_future()
+        self.sent.append((data, future))
+        return future
+
+    def controls(self):
+        return [json.loads(data)["type"] for data, _ in self.sent if isinstance(data, str)]
+
+
+class OpenChannel:
+    readyState = "open"
+
+
+def sender(mux, tmp_path, reply_timeout=FILE_REPLY_TIMEOUT):
+    manager = FileTransferManager(None, mux, downloads_dir=tmp_path,
+                                  reply_timeout=reply_timeout)
+    manager.channel = OpenChannel()
+    path = tmp_path / "out.bin"
+    path.write_bytes(b"x" * (FILE_CHUNK_SIZE * 2 + 1))
+    return manager, path
+
+
+@pytest.mark.asyncio
+async def test_silent_receiver_times_out(tmp_path):
+    manager, path = sender(QueuedMux(), tmp_path, reply_timeout=0.05)
+    with pytest.raises(RuntimeError, match="не ответил"):
+        await manager.send_file(path)
+    assert manager._accepted == {}
+
+
+@pytest.mark.asyncio
+async def test_complete_sent_after_all_chunks_flushed(tmp_path):
+    mux = QueuedMux()
+    manager, path = sender(mux, tmp_path)
+    task = asyncio.ensure_future(manager.send_file(path))
+    await asyncio.sleep(0)
+    transfer_id = json.loads(mux.sent[0][0])["transfer_id"]
+    manager._on_control({"type": "file_accept", "transfer_id": transfer_id,
+                         "resume_from": 0})
+    await asyncio.sleep(0.01)
+    chunks = [future for data, future in mux.sent if isinstance(data, bytes)]
+    assert len(chunks) == 3
+    assert mux.controls() == ["file_offer"]
+
+    for future in chunks:
+        future.set_result(None)
+    await asyncio.sleep(0.01)
+    assert mux.controls() == ["file_offer", "file_complete"]
+    manager._on_control({"type": "file_done", "transfer_id": transfer_id})
+    await asyncio.wait_for(task, 5)
@@ -0,0 +1,64 @@
+import pytest
+from src.core import metrics
+
+
+@pytest.fixture
+def registry():
+    """Метрики теста регистрируются отдельно и убираются после него"""
+    was_enabled = metrics.enabled()
+    saved = list(metrics._registry)
+    metrics._registry.clear()
+    yield
+    metrics._registry[:] = saved
+    if not was_enabled:
+        metrics.disable()
+
+
+def test_updates_ignored_while_disabled(registry):
+    metrics.disable()
+    counter = metrics.Counter("test_events_total", "События")
+    histogram = metrics.Histogram("test_seconds", "Время", buckets=(1,))
+    counter.inc()
+    histogram.observe(0.5)
+    assert histogram.time() is metrics._NULL_TIMER
+    assert "test_events_total 0\n" in metrics.render()
+    assert "test_seconds_count 0\n" in metrics.render()
+
+
+def test_prometheus_text_format(registry):
+    metrics.enable()
+    counter = metrics.Counter("test_bytes_total", "Байты", ("direction",))
+    gauge = metrics.Gauge("test_queue", "Очередь")
+    histogram = metrics.Histogram("test_seconds", "Время", buckets=(0.5, 0.1))
+    metrics.Callback("test_buffered", "Буфер", lambda: {('a"b',): 3}, ("stream",))
+    counter.labels("out").inc(10)
+    counter.labels("out").inc(2.5)
+    gauge.set(4)
+    gauge.dec()
+    for value in (0.05, 0.2, 0.3, 7):
+        histogram.observe(value)
+
+    assert metrics.render() == "\n".join([
+        "# HELP test_bytes_total Байты",
+        "# TYPE test_bytes_total counter",
+        'test_bytes_total{direction="out"} 12.5',
+        "# HELP test_queue Очередь",
+        "# TYPE test_queue gauge",
+        "test_queue 3",
+        "# HELP test_seconds Время",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="0.5"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 7.55",
+        "test_seconds_count 4",
+        "# HELP test_buffered Буфер",
+        "# TYPE test_buffered gauge",
+        'test_buffered{stream="a\\"b"} 3',
+    ]) + "\n"
+    assert ("test_seconds", "4 шт., среднее 1.8875") in metrics.snapshot()
+
+    metrics.reset()
+    assert 'test_bytes_total{direction="out"} 0' in metrics.render()
+    with pytest.raises(ValueError):
+        counter.labels("out", "лишняя")
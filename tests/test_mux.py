@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from src.core.mux import ChannelMux
+from src.core.sendqueue import SendQueue
+
+
+class Channel:
+    """Data channel потока; отправленное пишется в общий журнал"""
+
+    readyState = "open"
+    bufferedAmount = 0
+    bufferedAmountLowThreshold = 0
+
+    def __init__(self, label, log):
+        self.label = label
+        self.log = log
+
+    def on(self, event):
+        return lambda handler: handler
+
+    def send(self, data):
+        self.log.append((self.label, data))
+
+    def close(self):
+        self.readyState = "closed"
+
+
+@pytest.fixture
+def mux():
+    mux = ChannelMux(SendQueue())
+    mux.log = []
+    for name in ("chat", "file", "presence", "sync"):
+        mux.handle_datachannel(Channel(name, mux.log))
+    yield mux
+    mux.send_queue.close()
+
+
+@pytest.mark.asyncio
+async def test_chat_overtakes_queued_bulk_data(mux):
+    futures = [mux.send("file", b"f1"), mux.send("sync", "s1"),
+               mux.send("file", b"f2"), mux.send("chat", "c1"),
+               mux.send("presence", "p1"), mux.send("chat", "c2")]
+    await asyncio.gather(*futures)
+    # Сначала интерактивные потоки, внутри приоритета - порядок добавления
+    assert mux.log == [("chat", "c1"), ("presence", "p1"), ("chat", "c2"),
+                       ("file", b"f1"), ("sync", "s1"), ("file", b"f2")]
+
+
+def test_unknown_or_closed_stream_rejected(mux):
+    mux.handle_datachannel(Channel("video", mux.log))
+    assert "video" not in mux.channels
+    mux.channels["file"].close()
+    with pytest.raises(RuntimeError):
+        mux.send("file", b"x")
+    with pytest.raises(ValueError):
+        mux.register("video", lambda channel: None)
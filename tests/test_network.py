@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import json
+import time
+import pytest
+from src.core.crypto import CryptoManager
+from src.core.network import ConnectionManager, P2PConnection
+from src.core.storage import Storage
+
+CONNECT_TIMEOUT = 15.0
+
+
+async def connect_pair(batch_window: float = 0.0):
+    """Два зашифрованных соединения через loopback"""
+    alice_crypto, bob_crypto = CryptoManager(), CryptoManager()
+    alice_crypto.generate_keys()
+    bob_crypto.generate_keys()
+    alice = P2PConnection(alice_crypto, bob_crypto.get_public_key(),
+                          batch_window=batch_window, ice_servers=[])
+    bob = P2PConnection(bob_crypto, alice_crypto.get_public_key(),
+                        batch_window=batch_window, ice_servers=[])
+    await alice.handle_answer(await bob.handle_offer(await alice.create_offer()))
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while not (alice.is_connected and bob.is_connected):
+        assert time.monotonic() < deadline, "пиры не соединились"
+        await asyncio.sleep(0.01)
+    return alice, bob
+
+
+async def wait_until(predicate, timeout: float = CONNECT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+
+async def exchange(batch_window: float, count: int):
+    alice, bob = await connect_pair(batch_window)
+    received = []
+    done = asyncio.get_event_loop().create_future()
+
+    def on_message(text, message_id):
+        received.append(text)
+        if len(received) == count and not done.done():
+            done.set_result(None)
+
+    bob.set_callbacks(on_message, None)
+    try:
+        for i in range(count):
+            alice.send_message(f"сообщение {i}")
+        await asyncio.wait_for(done, 30)
+    finally:
+        await alice.close()
+        await bob.close()
+    return received
+
+
+@pytest.mark.asyncio
+async def test_encrypted_messages_delivered_in_order():
+    received = await exchange(0.0, 500)
+    assert received == [f"сообщение {i}" for i in range(500)]
+
+
+@pytest.mark.asyncio
+async def test_batched_encrypted_messages_delivered_in_order():
+    received = await exchange(0.002, 500)
+    assert received == [f"сообщение {i}" for i in range(500)]
+
+
+@pytest.mark.asyncio
+async def test_pool_stores_and_acks_messages_without_open_chat():
+    crypto = CryptoManager()
+    crypto.generate_keys()
+    storage = Storage()
+    manager = ConnectionManager(crypto, storage)
+    peer_crypto = CryptoManager()
+    peer_crypto.generate_keys()
+    peer_id = base64.b64encode(peer_crypto.get_public_key()).decode()
+    peer = P2PConnection(peer_crypto, crypto.get_public_key(), ice_servers=[])
+    received = []
+    peer.set_callbacks(lambda text, message_id: received.append(json.loads(text)), None)
+    try:
+        connection = manager.acquire(peer_id)
+        await peer.handle_answer(await connection.handle_offer(await peer.create_offer()))
+        await wait_until(lambda: connection.is_connected and peer.is_connected)
+        # Чат с контактом закрыт, соединение осталось в пуле
+        manager.release(peer_id)
+
+        peer.send_message(json.dumps({"type": "msg", "id": "m1", "text": "в фоне"}))
+        await wait_until(lambda: received)
+        assert received == [{"type": "ack", "ids": ["m1"]}]
+        history = storage.load_chat_history(peer_id)
+        assert [(m["id"], m["text"]) for m in history] == [("m1", "в фоне")]
+    finally:
+        await peer.close()
+        await manager.close_all()
+        storage.close()
+
+
+@pytest.mark.asyncio
+async def test_received_message_not_delayed_and_errors_isolated():
+    alice_crypto, bob_crypto = CryptoManager(), CryptoManager()
+    alice_crypto.generate_keys()
+    bob_crypto.generate_keys()
+    bob = P2PConnection(bob_crypto, alice_crypto.get_public_key(), ice_servers=[])
+    received = []
+
+    def on_message(text, message_id):
+        if text == "сбой":
+            raise RuntimeError("ошибка обработчика")
+        received.append(text)
+
+    bob.set_callbacks(on_message, None)
+    frames = [alice_crypto.encrypt_message(text, bob_crypto.get_public_key())
+              for text in ("первое", "сбой", "третье")]
+    bob._on_channel_message(frames[0])
+    # Одиночный кадр уходит на расшифровку в этом же проходе цикла, без окна
+    assert not isinstance(bob._rx_flush_handle, asyncio.TimerHandle)
+    bob._on_channel_message(frames[1])
+    bob._on_channel_message(frames[2])
+    await wait_until(lambda: len(received) == 2, timeout=5)
+    assert received == ["первое", "третье"]
+    await bob.close()
+
+
+def pool(**kwargs):
+    crypto = CryptoManager()
+    crypto.generate_keys()
+    return ConnectionManager(crypto, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_pool_evicts_least_recently_used_idle_connection():
+    manager = pool(max_connections=2)
+    try:
+        first = manager.acquire("a")
+        manager.release("a")
+        manager.acquire("b")
+        manager.release("b")
+        # Повторное использование делает "a" самым недавним
+        assert manager.acquire("a") is first
+        manager.acquire("c")
+        assert "b" not in manager
+        assert "a" in manager and "c" in manager
+
+        # Используемые соединения не вытесняются даже сверх лимита
+        manager.acquire("d")
+        assert len(manager) == 3
+        manager.release("a")
+        manager.acquire("e")
+        assert "a" not in manager
+        assert len(manager) == 3
+    finally:
+        await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_pool_sweeps_idle_connections(monkeypatch):
+    monkeypatch.setattr("src.core.network.IDLE_CHECK_INTERVAL", 0.01)
+    manager = pool(idle_timeout=0.05)
+    try:
+        idle = manager.acquire("idle")
+        manager.acquire("used")
+        manager.release("idle")
+        await wait_until(lambda: "idle" not in manager, 5)
+        await wait_until(lambda: idle.is_closed, 5)
+        assert "used" in manager
+    finally:
+        await manager.close_all()
+
+
+def lone_connection():
+    crypto = CryptoManager()
+    crypto.generate_keys()
+    return P2PConnection(crypto, ice_servers=[])
+
+
+@pytest.mark.asyncio
+async def test_renegotiation_backs_off_between_attempts(monkeypatch):
+    monkeypatch.setattr("src.core.network.RECONNECT_ATTEMPTS", 5)
+    monkeypatch.setattr("src.core.network.RECONNECT_BASE_DELAY", 1.0)
+    monkeypatch.setattr("src.core.network.RECONNECT_MAX_DELAY", 3.0)
+    monkeypatch.setattr("src.core.network.random.uniform", lambda low, high: high)
+    delays = []
+    original_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await original_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    connection = lone_connection()
+    attempts = []
+
+    async def restart():
+        attempts.append("restart")
+
+    async def create_offer():
+        return "offer"
+
+    async def renegotiate(offer):
+        if len(attempts) < 4:
+            raise ConnectionError("собеседник недоступен")
+        return "answer"
+
+    async def handle_answer(answer):
+        pass
+
+    async def wait_opened(timeout):
+        return True
+
+    connection._restart = restart
+    connection.create_offer = create_offer
+    connection.renegotiate = renegotiate
+    connection.handle_answer = handle_answer
+    connection._wait_opened = wait_opened
+    assert await connection._renegotiate_with_backoff()
+    assert len(attempts) == 4
+    # Пауза удваивается и упирается в RECONNECT_MAX_DELAY
+    assert delays == [1.0, 2.0, 3.0]
+
+
+@pytest.mark.asyncio
+async def test_restart_skips_already_settled_futures():
+    connection = lone_connection()
+    settled = asyncio.get_event_loop().create_future()
+    settled.cancel()
+    pending = asyncio.get_event_loop().create_future()
+    connection.mux.clear = lambda: {"file": [(b"a", settled), (b"b", pending)]}
+    await connection._restart()
+    assert settled.cancelled()
+    with pytest.raises(RuntimeError):
+        pending.result()
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_reconnect_closes_connection(monkeypatch):
+    monkeypatch.setattr("src.core.network.RECONNECT_WAIT_TIMEOUT", 0.01)
+    connection = lone_connection()
+    closed = []
+    connection.set_callbacks(None, lambda: closed.append(True))
+    await connection._reconnect()
+    assert connection.is_closed
+    assert closed == [True]
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from src.core.sendqueue import SendQueue
+
+
+class Channel:
+    """Data channel с управляемым тестом буфером SCTP"""
+
+    readyState = "open"
+
+    def __init__(self, label="chat"):
+        self.label = label
+        self.bufferedAmount = 0
+        self.bufferedAmountLowThreshold = 0
+        self.sent = []
+        self.handlers = {}
+
+    def on(self, event):
+        def register(handler):
+            self.handlers[event] = handler
+            return handler
+        return register
+
+    def send(self, data):
+        self.sent.append(data)
+        self.bufferedAmount += len(data)
+
+    def drain(self, amount):
+        self.bufferedAmount = max(0, self.bufferedAmount - amount)
+        if self.bufferedAmount <= self.bufferedAmountLowThreshold:
+            self.handlers["bufferedamountlow"]()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_send_waits_between_watermarks():
+    queue = SendQueue(high_watermark=100, low_watermark=40)
+    channel = Channel()
+    queue.watch(channel)
+    futures = [queue.put(channel, bytes([i]) * 60) for i in range(3)]
+    await settle()
+    # Третий кадр ждет: в буфере 120 байт, больше верхней границы
+    assert len(channel.sent) == 2
+    assert not any(f.done() for f in futures)
+
+    channel.drain(50)
+    await settle()
+    assert len(channel.sent) == 2
+
+    # Ниже нижней границы: первый кадр ушел в транспорт, третий в канале
+    channel.drain(40)
+    await settle()
+    assert len(channel.sent) == 3
+    assert [f.done() for f in futures] == [True, False, False]
+
+    channel.drain(channel.bufferedAmount)
+    await settle()
+    assert all(f.done() for f in futures)
+    assert channel.bufferedAmountLowThreshold == 40
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_close_fails_unsent_data():
+    queue = SendQueue(high_watermark=10, low_watermark=5)
+    channel = Channel()
+    queue.watch(channel)
+    sent, waiting = queue.put(channel, b"x" * 20), queue.put(channel, b"y")
+    await settle()
+    queue.close()
+    for future in (sent, waiting):
+        with pytest.raises(RuntimeError):
+            future.result()
@@ -0,0 +1,77 @@
+import time
+import pytest
+from src.core.sqlite_backend import SQLiteBackend
+from src.core.storage import FileBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(tmp_path / "chat.db")
+    yield backend
+    backend.close()
+
+
+def texts(messages):
+    return [m["text"] for m in messages]
+
+
+def test_append_and_pages_agree(backend):
+    backend.append_message("p", {"text": "a", "timestamp": "2024-01-01T00:00:02"})
+    backend.append_message("p", {"text": "b"})
+    backend.append_message("p", {"text": "c", "timestamp": "2024-01-01T00:00:01"})
+    backend.append_message("other", {"text": "x"})
+    everything = backend.load_messages("p")
+    assert texts(everything) == ["a", "b", "c"]
+    assert texts(backend.load_page("p", None, 2)) == ["b", "c"]
+    assert texts(backend.load_page("p", everything[2]["seq"], None)) == ["a", "b"]
+    assert backend.list_chats() == ["other", "p"]
+
+
+def test_purge_expired(backend):
+    backend.append_message("p", {"text": "живое", "expires_at": time.time() + 60})
+    stale = backend.append_message("p", {"text": "истекшее", "expires_at": time.time() - 1})
+    assert backend.next_expiry() == stale["expires_at"]
+    removed = backend.purge_expired(time.time())
+    assert [(peer_id, m["seq"]) for peer_id, m in removed] == [("p", stale["seq"])]
+    assert texts(backend.load_messages("p")) == ["живое"]
+
+
+def test_outbox(backend):
+    backend.outbox_add("p", {"id": "1", "text": "a"})
+    backend.outbox_add("p", {"id": "2", "text": "b"})
+    backend.outbox_add("p", {"id": "1", "text": "a"})
+    assert [e["id"] for e in backend.outbox_pending("p")] == ["1", "2"]
+    backend.outbox_remove("p", ["1"])
+    assert [e["id"] for e in backend.outbox_pending("p")] == ["2"]
+
+
+def test_import_from_file_backend(backend):
+    files = FileBackend()
+    files.save_setting("theme", "dark")
+    files.add_contact({"public_key": "K" * 44, "added_at": "2024-01-01T00:00:00"})
+    files.append_message("import-peer", {"text": "из журнала"})
+    files.outbox_add("import-peer", {"id": "o1", "text": "в очереди"})
+    backend.import_from(files)
+    assert backend.get_setting("theme") == "dark"
+    assert "K" * 44 in [c["public_key"] for c in backend.get_contacts()]
+    assert texts(backend.load_messages("import-peer")) == ["из журнала"]
+    assert [e["id"] for e in backend.outbox_pending("import-peer")] == ["o1"]
+
+    # Файлы общие для всех тестов - убираем перенесенные данные
+    files = FileBackend()
+    files.delete_contact("K" * 44)
+    files.delete_chat("import-peer")
+    files.outbox_remove("import-peer", ["o1"])
+    files.close()
+
+
+def test_failed_import_removes_database(tmp_path):
+    class Broken(FileBackend):
+        def list_chats(self):
+            raise OSError("диск недоступен")
+
+    db_file = tmp_path / "broken.db"
+    backend = SQLiteBackend(db_file)
+    with pytest.raises(OSError):
+        backend.import_from(Broken())
+    assert not db_file.exists()
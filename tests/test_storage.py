@@ -0,0 +1,117 @@
+import json
+import os
+import time
+import pytest
+from src.core.expiry import ExpiryIndex
+from src.core.storage import Storage
+
+
+@pytest.fixture
+def storage():
+    storage = Storage()
+    yield storage
+    storage.close()
+
+
+def test_expiry_index_replays_pops(tmp_path):
+    path = tmp_path / "expiry.idx"
+    index = ExpiryIndex(path)
+    for seq in range(1, 6):
+        index.push(float(seq), "peer", seq)
+    assert [e[2] for e in index.pop_due(3.0)] == [1, 2, 3]
+    index.push(0.5, "peer", 6)
+    index.close()
+    size = path.stat().st_size
+
+    reopened = ExpiryIndex(path)
+    # Элемент, добавленный после отметки, не считается извлеченным
+    assert reopened.pop_due(10.0) == [(0.5, "peer", 6), (4.0, "peer", 4), (5.0, "peer", 5)]
+    assert reopened.garbage == {"peer": 6}
+    reopened.close()
+    assert path.stat().st_size > size
+
+
+def test_purge_keeps_log_until_garbage_threshold(storage):
+    peer_id = "purge-peer"
+    storage.add_message(peer_id, {"text": "живое"}, 3600)
+    storage.backend.append_message(peer_id, {"text": "истекшее", "expires_at": time.time() - 1})
+    log = storage.backend._chat_log(peer_id)
+    before = [p.read_bytes() for p in sorted(log.directory.iterdir())]
+
+    assert storage.purge_expired() == 1
+    assert [p.read_bytes() for p in sorted(log.directory.iterdir())] == before
+    assert [m["text"] for m in storage.load_chat_history(peer_id)] == ["живое"]
+
+
+def test_compaction_removes_expired_from_search(storage, monkeypatch):
+    monkeypatch.setattr("src.core.storage.CHAT_COMPACT_INTERVAL", 3)
+    peer_id = "search-peer"
+    storage.add_message(peer_id, {"text": "живое слово"}, 3600)
+    stale = storage.backend.append_message(
+        peer_id, {"text": "истекшее слово", "expires_at": time.time() - 1})
+    storage.search_index.add(peer_id, [stale])
+    assert [r["seq"] for r in storage.search_messages("слово")] == [1]
+
+    storage.add_message(peer_id, {"text": "третье"}, 3600)
+    rows = storage.search_index.conn.execute(
+        "SELECT seq FROM indexed WHERE peer_id = ?", (peer_id,)).fetchall()
+    assert sorted(seq for (seq,) in rows) == [1, 3]
+
+
+def test_contacts_follow_external_edits(storage):
+    storage.add_contact("A" * 44)
+    storage.backend.contacts.flush()
+    storage.backend.contacts._check_interval = 0
+    events = []
+    storage.contact_index.subscribe(lambda event, contact: events.append(
+        (event, contact["public_key"])))
+
+    path = storage.backend.contacts_file
+    path.write_text(json.dumps({"contacts": [
+        {"public_key": "B" * 44, "added_at": "2024-01-01T00:00:00"}]}))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert [c["public_key"] for c in storage.get_contacts()] == ["B" * 44]
+    assert storage.get_contact("A" * 44) is None
+    assert events == [("removed", "A" * 44), ("added", "B" * 44)]
+
+
+def test_history_before_cursor_without_limit(storage):
+    peer_id = "page-peer"
+    seqs = [storage.add_message(peer_id, {"text": str(i)}, 3600)["seq"] for i in range(5)]
+    older = storage.load_chat_history(peer_id, before=seqs[3])
+    assert [m["text"] for m in older] == ["0", "1", "2"]
+    page = storage.load_chat_history(peer_id, before=seqs[3], limit=2)
+    assert [m["text"] for m in page] == ["1", "2"]
+
+
+def test_deleted_chat_does_not_purge_new_messages(storage):
+    peer_id = "deleted-peer"
+    first = storage.add_message(peer_id, {"text": "старое"}, 1)
+    storage.delete_chat(peer_id)
+    kept = storage.add_message(peer_id, {"text": "keepme"}, 3600)
+    assert kept["seq"] > first["seq"]
+    time.sleep(1.2)
+    storage.purge_expired()
+    assert [r["seq"] for r in storage.search_messages("keepme")] == [kept["seq"]]
+    assert [m["text"] for m in storage.load_chat_history(peer_id)] == ["keepme"]
+
+
+def test_seq_not_reused_after_tail_compaction(tmp_path):
+    from src.core.chatlog import ChatLog
+    log = ChatLog(tmp_path)
+    for i in range(5):
+        log.append({"text": str(i)})
+    log.compact(lambda m: m["seq"] < 3)
+    log.close()
+    assert ChatLog(tmp_path).append({"text": "new"})["seq"] == 6
+
+
+def test_stale_expiry_entry_keeps_live_message_searchable(storage):
+    peer_id = "stale-peer"
+    live = storage.add_message(peer_id, {"text": "найдется"}, 3600)
+    storage.backend.expiry_index.push(time.time() - 1, peer_id, live["seq"])
+    storage.backend.expiry_index.push(time.time() - 1, peer_id, live["seq"] + 100)
+    assert storage.purge_expired() == 0
+    assert [r["seq"] for r in storage.search_messages("найдется")] == [live["seq"]]
@@ -0,0 +1,110 @@
+import base64
+import json
+import time
+import pytest
+from src.core.crypto import CryptoManager
+from src.core.storage import Storage, new_message_id
+from src.core.sync import HistorySync
+from src.utils.config import MESSAGE_EXPIRY
+
+
+class Mux:
+    """Поток sync без соединения: отправленные кадры складываются в список"""
+
+    initiator = False
+
+    def __init__(self):
+        self.sent = []
+
+    def register(self, name, attach):
+        pass
+
+    def send(self, name, data):
+        self.sent.append(data)
+
+
+class Channel:
+    readyState = "connecting"
+
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event):
+        def register(handler):
+            self.handlers[event] = handler
+            return handler
+        return register
+
+
+@pytest.fixture
+def storage():
+    storage = Storage()
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def peers(storage):
+    alice, bob = CryptoManager(), CryptoManager()
+    alice.generate_keys()
+    bob.generate_keys()
+    peer_id = base64.b64encode(bob.get_public_key()).decode()
+    sync = HistorySync(storage, peer_id, Mux(), alice, bob.get_public_key())
+    channel = Channel()
+    sync.attach(channel)
+
+    def deliver(message):
+        payload = json.dumps(message).encode()
+        channel.handlers["message"](bob.encrypt_payload(payload, alice.get_public_key()))
+
+    return sync, channel, deliver, alice, bob
+
+
+def test_sync_messages_are_encrypted(peers):
+    sync, _, _, alice, bob = peers
+    sync.start()
+    frame = sync.mux.sent[0]
+    assert isinstance(frame, bytes)
+    _, payload = bob.decrypt_payload(frame, alice.get_public_key())
+    assert json.loads(payload)["type"] == "sync_days"
+
+
+def test_plaintext_sync_rejected(storage, peers):
+    sync, channel, _, _, _ = peers
+    channel.handlers["message"](json.dumps({"type": "sync_messages", "messages": [
+        {"id": new_message_id(), "text": "открыто"}]}))
+    assert storage.load_chat_history(sync.peer_id) == []
+
+
+def test_authorship_and_lifetime_not_trusted(storage, peers):
+    sync, _, deliver, _, _ = peers
+    own = storage.add_message("другой-чат", {"text": "мое", "is_self": True})
+    forged = new_message_id()
+    deliver({"type": "sync_messages", "messages": [
+        {"id": forged, "text": "чужое", "from_me": False, "expires_at": 1e12},
+        {"id": own["id"], "text": "мое", "from_me": True},
+        {"id": own["id"][:-1] + ("1" if own["id"][-1] == "0" else "0"),
+         "text": "подделка", "from_me": False},
+    ]})
+    history = {m["text"]: m for m in storage.load_chat_history(sync.peer_id)}
+    assert history["чужое"]["sender"] == sync.peer_id
+    assert "is_self" not in history["чужое"]
+    assert history["чужое"]["expires_at"] <= int(forged[:12], 16) / 1000 + MESSAGE_EXPIRY
+    assert history["мое"]["is_self"] is True
+    assert "is_self" not in history["подделка"]
+
+
+def test_older_messages_inserted_by_time(storage, peers):
+    sync, _, deliver, _, _ = peers
+    replaced = []
+    storage.history_replaced = replaced.append
+    storage.add_message(sync.peer_id, {"text": "новое", "is_self": True})
+    older = f"{int((time.time() - 60) * 1000):012x}{'a' * 20}"
+    deliver({"type": "sync_messages", "messages": [{"id": older, "text": "старое"}]})
+    # Открытое окно чата перезагружает историю: seq изменились
+    assert replaced == [sync.peer_id]
+    history = storage.load_chat_history(sync.peer_id)
+    assert [m["text"] for m in history] == ["старое", "новое"]
+    assert history[0]["seq"] < history[1]["seq"]
+    page = storage.load_chat_history(sync.peer_id, before=history[1]["seq"], limit=10)
+    assert [m["text"] for m in page] == ["старое"]